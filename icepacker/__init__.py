@@ -3,3 +3,18 @@
 # @brief   py-icepacker python package.
 
 from .icepacker import Icepacker, IcepackerError
+from .icepacker import MIN_LEVEL, DEFAULT_LEVEL, MAX_LEVEL
+from .icepacker import NATIVE, CTYPES
+from .icepacker import load_library
+from .icepacker import pack, pack_into, depack, depack_into, depacked_size
+from .icepacker import pack_many, depack_many
+from .icepacker import pack_batch, depack_batch
+from .icepacker import pack_blocks, depack_blocks
+from .icepacker import pack_async, depack_async
+from .process_pool import IcepackProcessPool
+from .stream import IcepackStreamWriter, pack_stream, depack_file
+from .index import IcepackIndex
+from .restart import pack_restart, depack_parallel
+from .segments import pack_segments
+from .blocks import IcepackBlocks
+from .bundle import IcepackBundle, pack_bundle
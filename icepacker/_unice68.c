@@ -0,0 +1,567 @@
+/*
+ * @file    icepacker/_unice68.c
+ * @brief   Native CPython extension for the unice68 library.
+ * @author  https://github.com/benjihan
+ *
+ * Copyright (c) 1998-2024 Benjamin Gerard
+ *
+ * This program is free software: you can redistribute it and/or
+ * modify it under the terms of the GNU General Public License as
+ * published by the Free Software Foundation, either version 3 of the
+ * License, or (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful, but
+ * WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ * General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.
+ *
+ * If not, see <http://www.gnu.org/licenses/>.
+ *
+ */
+
+/* Same functions than the ctypes binding in icepacker.py without the
+ * argument conversions: inputs are taken with the buffer protocol
+ * and the results are written straight into the returned bytes
+ * object. The GIL is released while packing or depacking.
+ */
+
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <limits.h>
+#include <string.h>
+#include "unice68.h"
+
+/* Exception raised on error (IcepackerError, see set_error) */
+static PyObject * error_class;
+
+#define ERROR(...) \
+  PyErr_Format(error_class ? error_class : PyExc_RuntimeError, __VA_ARGS__)
+
+/* Output buffer size that is always large enough to pack len bytes */
+static Py_ssize_t pack_bound(Py_ssize_t len)
+{
+  return 16 + (len + (len >> 3));
+}
+
+static int check_nargs(const char * name, Py_ssize_t nargs,
+                       Py_ssize_t min, Py_ssize_t max)
+{
+  if (nargs >= min && nargs <= max)
+    return 0;
+  if (min == max)
+    PyErr_Format(PyExc_TypeError, "%s() takes exactly %zd arguments (%zd given)",
+                 name, min, nargs);
+  else
+    PyErr_Format(PyExc_TypeError, "%s() takes from %zd to %zd arguments (%zd given)",
+                 name, min, max, nargs);
+  return -1;
+}
+
+/* Optional int argument (None or missing is def) */
+static int int_arg(PyObject * const * args, Py_ssize_t nargs, Py_ssize_t i,
+                   int def, int * val)
+{
+  if (i >= nargs || args[i] == Py_None) {
+    *val = def;
+    return 0;
+  }
+  else {
+    const long v = PyLong_AsLong(args[i]);
+    if (v == -1 && PyErr_Occurred())
+      return -1;
+    if (v < INT_MIN || v > INT_MAX) {
+      PyErr_SetString(PyExc_OverflowError, "Python int too large to convert to C int");
+      return -1;
+    }
+    *val = (int) v;
+  }
+  return 0;
+}
+
+/* Get an optional compression level argument (None: -1, the default) */
+static int level_arg(PyObject * const * args, Py_ssize_t nargs, Py_ssize_t i,
+                     int * level)
+{
+  if (i >= nargs || args[i] == Py_None) {
+    *level = -1;
+    return 0;
+  }
+  if (int_arg(args, nargs, i, -1, level))
+    return -1;
+  if (*level < UNICE68_LEVEL_MIN || *level > UNICE68_LEVEL_MAX) {
+    ERROR("Invalid compression level %d", *level);
+    return -1;
+  }
+  return 0;
+}
+
+/* Check the header of a packed buffer and get its depacked size */
+static int depack_check(const Py_buffer * src, int * dsize, int * csize)
+{
+  if (src->len < 12) {
+    ERROR("Input buffer is too small");
+    return -1;
+  }
+  *csize = 0;
+  *dsize = unice68_depacked_size(src->buf, csize);
+  if (*dsize < 0) {
+    ERROR("unice68_depacked_size failed with code %d", *dsize);
+    return -1;
+  }
+  if (*dsize == 0) {
+    ERROR("Invalid depacked size");
+    return -1;
+  }
+  if (*csize > src->len) {
+    ERROR("Missing packed data");
+    return -1;
+  }
+  return 0;
+}
+
+/* Run the packer, dst must hold pack_bound(src->len) bytes */
+static int do_pack(void * dst, int max, const Py_buffer * src, int level,
+                   int threads)
+{
+  int result;
+
+  Py_BEGIN_ALLOW_THREADS;
+  if (threads != 1)
+    result = unice68_packer_threads(dst, max, src->buf, (int) src->len,
+                                    level, threads);
+  else if (level < 0)
+    result = unice68_packer(dst, max, src->buf, (int) src->len);
+  else
+    result = unice68_packer_level(dst, max, src->buf, (int) src->len, level);
+  Py_END_ALLOW_THREADS;
+
+  if (result < 0)
+    ERROR("unice68_packer failed [%d]", result);
+  return result;
+}
+
+/* Check the input and threads before packing */
+static int pack_check(const Py_buffer * src, int threads)
+{
+  if (!src->len) {
+    ERROR("Input buffer cannot be empty");
+    return -1;
+  }
+  if (pack_bound(src->len) > INT_MAX) {
+    ERROR("Input buffer is too large");
+    return -1;
+  }
+  if (threads < 0) {
+    ERROR("Invalid number of threads %d", threads);
+    return -1;
+  }
+  return 0;
+}
+
+PyDoc_STRVAR(depacked_size_doc,
+"depacked_size(buffer) -> (depacked_size, compressed_size)\n\n"
+"Get the depacked size of a compressed buffer.");
+
+static PyObject *
+depacked_size(PyObject * self, PyObject * const * args, Py_ssize_t nargs)
+{
+  Py_buffer src;
+  int dsize, csize;
+
+  if (check_nargs("depacked_size", nargs, 1, 1) ||
+      PyObject_GetBuffer(args[0], &src, PyBUF_SIMPLE))
+    return NULL;
+  if (src.len < 12) {
+    PyBuffer_Release(&src);
+    return ERROR("Input buffer is too small");
+  }
+  csize = 0;
+  dsize = unice68_depacked_size(src.buf, &csize);
+  PyBuffer_Release(&src);
+  if (dsize < 0)
+    return ERROR("unice68_depacked_size failed with code %d", dsize);
+  return Py_BuildValue("(ii)", dsize, csize);
+}
+
+PyDoc_STRVAR(depack_doc,
+"depack(src) -> bytes\n\n"
+"Decompress data.");
+
+static PyObject *
+depack(PyObject * self, PyObject * const * args, Py_ssize_t nargs)
+{
+  Py_buffer src;
+  PyObject * res = NULL;
+  int dsize, csize, result;
+
+  if (check_nargs("depack", nargs, 1, 1) ||
+      PyObject_GetBuffer(args[0], &src, PyBUF_SIMPLE))
+    return NULL;
+  if (!depack_check(&src, &dsize, &csize) &&
+      (res = PyBytes_FromStringAndSize(NULL, dsize)) != NULL) {
+    Py_BEGIN_ALLOW_THREADS;
+    result = unice68_depacker(PyBytes_AS_STRING(res), src.buf);
+    Py_END_ALLOW_THREADS;
+    if (result) {
+      Py_CLEAR(res);
+      ERROR("unice68_depacker failed with code %d", result);
+    }
+  }
+  PyBuffer_Release(&src);
+  return res;
+}
+
+PyDoc_STRVAR(depack_into_doc,
+"depack_into(src, out) -> int\n\n"
+"Decompress data into a writable buffer. Returns the number of bytes\n"
+"written at the start of out.");
+
+static PyObject *
+depack_into(PyObject * self, PyObject * const * args, Py_ssize_t nargs)
+{
+  Py_buffer src, out;
+  PyObject * res = NULL;
+  int dsize, csize, result;
+
+  if (check_nargs("depack_into", nargs, 2, 2) ||
+      PyObject_GetBuffer(args[0], &src, PyBUF_SIMPLE))
+    return NULL;
+  if (PyObject_GetBuffer(args[1], &out, PyBUF_WRITABLE)) {
+    PyBuffer_Release(&src);
+    return NULL;
+  }
+  if (depack_check(&src, &dsize, &csize))
+    ;
+  else if (dsize > out.len)
+    ERROR("Output buffer too small (%zd < %d)", out.len, dsize);
+  else {
+    Py_BEGIN_ALLOW_THREADS;
+    result = unice68_depacker(out.buf, src.buf);
+    Py_END_ALLOW_THREADS;
+    if (result)
+      ERROR("unice68_depacker failed with code %d", result);
+    else
+      res = PyLong_FromLong(dsize);
+  }
+  PyBuffer_Release(&out);
+  PyBuffer_Release(&src);
+  return res;
+}
+
+PyDoc_STRVAR(pack_doc,
+"pack(src, max_size=None, level=None, threads=1) -> bytes\n\n"
+"Compress data.");
+
+static PyObject *
+pack(PyObject * self, PyObject * const * args, Py_ssize_t nargs)
+{
+  Py_buffer src;
+  PyObject * res = NULL;
+  int max_size, level, threads, result;
+
+  if (check_nargs("pack", nargs, 1, 4) ||
+      int_arg(args, nargs, 1, 0, &max_size) ||
+      level_arg(args, nargs, 2, &level) ||
+      int_arg(args, nargs, 3, 1, &threads) ||
+      PyObject_GetBuffer(args[0], &src, PyBUF_SIMPLE))
+    return NULL;
+
+  if (pack_check(&src, threads))
+    ;
+  else if (max_size < 0)
+    ERROR("Invalid maximum size");
+  else {
+    /* The packer does not check the output size */
+    const int bound = (int) pack_bound(src.len);
+    if (!max_size)
+      max_size = bound;
+    res = PyBytes_FromStringAndSize(NULL, max_size > bound ? max_size : bound);
+    if (res) {
+      result = do_pack(PyBytes_AS_STRING(res), max_size, &src, level, threads);
+      if (result < 0)
+        Py_CLEAR(res);
+      else if (result > max_size) {
+        Py_CLEAR(res);
+        ERROR("unice68_packer overflowed by %d", result - max_size);
+      } else
+        _PyBytes_Resize(&res, result);
+    }
+  }
+  PyBuffer_Release(&src);
+  return res;
+}
+
+PyDoc_STRVAR(pack_into_doc,
+"pack_into(src, out, level=None, threads=1) -> int\n\n"
+"Compress data into a writable buffer. Returns the number of bytes\n"
+"written at the start of out.");
+
+static PyObject *
+pack_into(PyObject * self, PyObject * const * args, Py_ssize_t nargs)
+{
+  Py_buffer src, out;
+  PyObject * res = NULL;
+  int level, threads, result;
+
+  if (check_nargs("pack_into", nargs, 2, 4) ||
+      level_arg(args, nargs, 2, &level) ||
+      int_arg(args, nargs, 3, 1, &threads) ||
+      PyObject_GetBuffer(args[0], &src, PyBUF_SIMPLE))
+    return NULL;
+  if (PyObject_GetBuffer(args[1], &out, PyBUF_WRITABLE)) {
+    PyBuffer_Release(&src);
+    return NULL;
+  }
+
+  if (!pack_check(&src, threads)) {
+    const Py_ssize_t bound = pack_bound(src.len);
+    if (out.len >= bound) {
+      const int max = out.len > INT_MAX ? INT_MAX : (int) out.len;
+      result = do_pack(out.buf, max, &src, level, threads);
+      if (result >= 0)
+        res = PyLong_FromLong(result);
+    } else {
+      void * tmp = PyMem_Malloc(bound);
+      if (!tmp)
+        PyErr_NoMemory();
+      else {
+        result = do_pack(tmp, (int) bound, &src, level, threads);
+        if (result > out.len)
+          ERROR("Output buffer too small (%zd < %d)", out.len, result);
+        else if (result >= 0) {
+          memcpy(out.buf, tmp, result);
+          res = PyLong_FromLong(result);
+        }
+        PyMem_Free(tmp);
+      }
+    }
+  }
+  PyBuffer_Release(&out);
+  PyBuffer_Release(&src);
+  return res;
+}
+
+/* Batch state: the items and the held input buffers */
+typedef struct {
+  Py_ssize_t count;
+  unice68_batch_t * items;
+  Py_buffer * srcs;
+  PyObject ** outs;
+} batch_t;
+
+static void batch_free(batch_t * B)
+{
+  Py_ssize_t i;
+  for (i = 0; i < B->count; ++i) {
+    if (B->srcs[i].obj)
+      PyBuffer_Release(B->srcs + i);
+    Py_XDECREF(B->outs[i]);
+  }
+  PyMem_Free(B->items);
+  PyMem_Free(B->srcs);
+  PyMem_Free(B->outs);
+}
+
+/* Get the input buffers of a sequence of items */
+static int batch_init(batch_t * B, PyObject * seq)
+{
+  PyObject * fast = PySequence_Fast(seq, "items must be iterable");
+  Py_ssize_t i;
+
+  memset(B, 0, sizeof(*B));
+  if (!fast)
+    return -1;
+  B->count = PySequence_Fast_GET_SIZE(fast);
+  if (B->count > INT_MAX) {
+    Py_DECREF(fast);
+    ERROR("Too many items");
+    return -1;
+  }
+  B->items = PyMem_Calloc(B->count ? B->count : 1, sizeof(*B->items));
+  B->srcs = PyMem_Calloc(B->count ? B->count : 1, sizeof(*B->srcs));
+  B->outs = PyMem_Calloc(B->count ? B->count : 1, sizeof(*B->outs));
+  if (!B->items || !B->srcs || !B->outs) {
+    B->count = 0;
+    Py_DECREF(fast);
+    batch_free(B);
+    PyErr_NoMemory();
+    return -1;
+  }
+  for (i = 0; i < B->count; ++i) {
+    Py_buffer * src = B->srcs + i;
+    if (PyObject_GetBuffer(PySequence_Fast_GET_ITEM(fast, i), src, PyBUF_SIMPLE))
+      break;
+    if (src->len > INT_MAX) {
+      ERROR("Input buffer is too large");
+      break;
+    }
+    B->items[i].src = src->buf;
+    B->items[i].srclen = (int) src->len;
+  }
+  Py_DECREF(fast);
+  if (i < B->count) {
+    batch_free(B);
+    return -1;
+  }
+  return 0;
+}
+
+/* Allocate the output bytes objects */
+static int batch_outputs(batch_t * B)
+{
+  Py_ssize_t i;
+  for (i = 0; i < B->count; ++i) {
+    unice68_batch_t * it = B->items + i;
+    B->outs[i] = PyBytes_FromStringAndSize(NULL, it->size);
+    if (!B->outs[i])
+      return -1;
+    it->dst = PyBytes_AS_STRING(B->outs[i]);
+    it->dstcap = it->size;
+  }
+  return 0;
+}
+
+static int batch_check(batch_t * B, const char * name)
+{
+  Py_ssize_t i;
+  for (i = 0; i < B->count; ++i)
+    if (B->items[i].size < 0) {
+      ERROR("%s failed on item %zd with code %d", name, i, B->items[i].size);
+      return -1;
+    }
+  return 0;
+}
+
+/* Build the result list (steals the outputs) */
+static PyObject * batch_result(batch_t * B)
+{
+  PyObject * list = PyList_New(B->count);
+  Py_ssize_t i;
+
+  for (i = 0; list && i < B->count; ++i) {
+    if (PyBytes_GET_SIZE(B->outs[i]) != B->items[i].size &&
+        _PyBytes_Resize(B->outs + i, B->items[i].size)) {
+      Py_CLEAR(list);
+      break;
+    }
+    PyList_SET_ITEM(list, i, B->outs[i]);
+    B->outs[i] = NULL;
+  }
+  return list;
+}
+
+PyDoc_STRVAR(depack_batch_doc,
+"depack_batch(items, threads=0) -> list\n\n"
+"Decompress many buffers with a single unice68_depack_batch() call.");
+
+static PyObject *
+depack_batch(PyObject * self, PyObject * const * args, Py_ssize_t nargs)
+{
+  batch_t B;
+  PyObject * res = NULL;
+  int threads;
+
+  if (check_nargs("depack_batch", nargs, 1, 2) ||
+      int_arg(args, nargs, 1, 0, &threads) ||
+      batch_init(&B, args[0]))
+    return NULL;
+
+  /* Get the depacked sizes first */
+  unice68_depack_batch(B.items, (int) B.count, 1);
+  if (!batch_check(&B, "unice68_depack_batch") && !batch_outputs(&B)) {
+    Py_BEGIN_ALLOW_THREADS;
+    unice68_depack_batch(B.items, (int) B.count, threads);
+    Py_END_ALLOW_THREADS;
+    if (!batch_check(&B, "unice68_depack_batch"))
+      res = batch_result(&B);
+  }
+  batch_free(&B);
+  return res;
+}
+
+PyDoc_STRVAR(pack_batch_doc,
+"pack_batch(items, level=None, threads=0) -> list\n\n"
+"Compress many buffers with a single unice68_pack_batch() call.");
+
+static PyObject *
+pack_batch(PyObject * self, PyObject * const * args, Py_ssize_t nargs)
+{
+  batch_t B;
+  PyObject * res = NULL;
+  Py_ssize_t i;
+  int level, threads;
+
+  if (check_nargs("pack_batch", nargs, 1, 3) ||
+      level_arg(args, nargs, 1, &level) ||
+      int_arg(args, nargs, 2, 0, &threads))
+    return NULL;
+  if (batch_init(&B, args[0]))
+    return NULL;
+
+  for (i = 0; i < B.count; ++i) {
+    if (B.items[i].srclen > UNICE68_PACK_MAX) {
+      batch_free(&B);
+      return ERROR("Input buffer is too large");
+    }
+    B.items[i].size = (int) pack_bound(B.items[i].srclen);
+  }
+  if (!batch_outputs(&B)) {
+    Py_BEGIN_ALLOW_THREADS;
+    unice68_pack_batch(B.items, (int) B.count, level, threads);
+    Py_END_ALLOW_THREADS;
+    if (!batch_check(&B, "unice68_pack_batch"))
+      res = batch_result(&B);
+  }
+  batch_free(&B);
+  return res;
+}
+
+PyDoc_STRVAR(set_error_doc,
+"set_error(cls)\n\n"
+"Set the exception class raised on error.");
+
+static PyObject *
+set_error(PyObject * self, PyObject * const * args, Py_ssize_t nargs)
+{
+  if (check_nargs("set_error", nargs, 1, 1))
+    return NULL;
+  if (!PyExceptionClass_Check(args[0])) {
+    PyErr_SetString(PyExc_TypeError, "an exception class is required");
+    return NULL;
+  }
+  Py_INCREF(args[0]);
+  Py_XDECREF(error_class);
+  error_class = args[0];
+  Py_RETURN_NONE;
+}
+
+#define FASTCALL(NAME) \
+  { #NAME, (PyCFunction)(void(*)(void)) NAME, METH_FASTCALL, NAME##_doc }
+
+static PyMethodDef methods[] = {
+  FASTCALL(depacked_size),
+  FASTCALL(depack),
+  FASTCALL(depack_into),
+  FASTCALL(pack),
+  FASTCALL(pack_into),
+  FASTCALL(depack_batch),
+  FASTCALL(pack_batch),
+  FASTCALL(set_error),
+  { NULL, NULL, 0, NULL }
+};
+
+static struct PyModuleDef module = {
+  PyModuleDef_HEAD_INIT,
+  "icepacker._unice68",
+  "Native unice68 ice packer/depacker.",
+  -1,
+  methods
+};
+
+PyMODINIT_FUNC PyInit__unice68(void)
+{
+  return PyModule_Create(&module);
+}
@@ -0,0 +1,184 @@
+# @file     icepacker/blocks.py
+# @author   Ben G. Han
+# @brief    Container of independent ICE blocks with a block index.
+
+import struct
+import zlib
+from bisect import bisect_right
+from typing import List, Optional, Tuple
+
+from .icepacker import Icepacker, IcepackerError, BufferLike
+
+# Default raw size of a block
+BLOCK_SIZE = 1 << 20
+
+# Header: magic, raw block size
+_HEADER = struct.Struct('>4sI')
+# Block: offset in the container, packed size, raw size, CRC-32 of the raw data
+_ENTRY = struct.Struct('>QIII')
+# Footer: index offset, number of blocks, magic
+_FOOTER = struct.Struct('>QI4s')
+_MAGIC = b'ICEb'
+
+def pack_container(ice: Icepacker, src: BufferLike, block_size: int,
+                   level: Optional[int], threads: int) -> bytes:
+    """Pack src in blocks of block_size bytes (see Icepacker.pack_blocks())."""
+    if not 0 < block_size < 1 << 32:
+        raise IcepackerError(f"Invalid block size {block_size}")
+    data = memoryview(src).cast('B')
+    raws = [data[pos:pos + block_size] for pos in range(0, data.nbytes, block_size)]
+    return write_container(ice, raws, block_size, level, threads)
+
+def write_container(ice: Icepacker, raws: List[BufferLike], block_size: int,
+                    level: Optional[int], threads: int) -> bytes:
+    """Pack each buffer of raws (at most block_size bytes) in its own block."""
+    packed = ice.pack_batch(raws, level, threads)
+    parts, entries = [_HEADER.pack(_MAGIC, block_size)], []
+    offset = _HEADER.size
+    for raw, block in zip(raws, packed):
+        raw = memoryview(raw).cast('B')
+        entries.append(_ENTRY.pack(offset, len(block), raw.nbytes, zlib.crc32(raw)))
+        parts.append(block)
+        offset += len(block)
+    parts += entries
+    parts.append(_FOOTER.pack(offset, len(entries), _MAGIC))
+    return b''.join(parts)
+
+def depack_container(ice: Icepacker, container: BufferLike, threads: int) -> bytes:
+    """Depack all the blocks of a container (see Icepacker.depack_blocks())."""
+    blocks = IcepackBlocks.__new__(IcepackBlocks)
+    blocks._open(ice, container)
+    return blocks.depack(threads)
+
+class IcepackBlocks:
+    """
+    Random access to a container of ICE blocks.
+
+    The container is a small header, independent standard ICE streams
+    and a trailing index giving the offset, the packed and raw sizes
+    and the CRC-32 of each block. Each block can be depacked on its
+    own, by this class or any ICE depacker (see packed_block()).
+
+    Usage:
+        blocks = IcepackBlocks(container)
+        header = blocks.read_range(0, 128)
+    """
+
+    def __init__(self, container: BufferLike, lib_path: Optional[str] = None):
+        """
+        Args:
+            container: Container data (any contiguous buffer, e.g. a
+                       mmap). It is kept and must not change.
+            lib_path: Path to the unice68 library (see load_library()).
+
+        Raises:
+            IcepackerError: If the container is invalid.
+        """
+        self._open(Icepacker(lib_path), container)
+
+    def _open(self, ice: Icepacker, container: BufferLike) -> None:
+        self._ice = ice
+        self._data = memoryview(container).cast('B')
+        self._entries = self._load(self._data)
+        self._positions = []
+        pos = 0
+        for _, _, raw_size, _ in self._entries:
+            self._positions.append(pos)
+            pos += raw_size
+        self.depacked_size = pos
+
+    @staticmethod
+    def _load(data: memoryview) -> List[Tuple[int, int, int, int]]:
+        """Parse the header and the block index."""
+        size = data.nbytes
+        try:
+            magic, block_size = _HEADER.unpack_from(data)
+            if magic != _MAGIC:
+                raise IcepackerError("Not an ICE block container")
+            index, count, magic = _FOOTER.unpack_from(data, size - _FOOTER.size)
+        except struct.error:
+            raise IcepackerError("Truncated ICE block container") from None
+        if magic != _MAGIC or index + count * _ENTRY.size != size - _FOOTER.size:
+            raise IcepackerError("Invalid ICE block container index")
+        entries = [_ENTRY.unpack_from(data, index + i * _ENTRY.size)
+                   for i in range(count)]
+        for offset, packed_size, raw_size, _ in entries:
+            if offset < _HEADER.size or offset + packed_size > index or raw_size > block_size:
+                raise IcepackerError("Invalid ICE block container index")
+        return entries
+
+    def __len__(self) -> int:
+        """Number of blocks."""
+        return len(self._entries)
+
+    def packed_block(self, i: int) -> memoryview:
+        """
+        Packed data of a block, a standard ICE stream (no copy).
+
+        Raises:
+            IndexError: If there is no such block.
+        """
+        offset, packed_size, _, _ = self._entries[i]
+        return self._data[offset:offset + packed_size]
+
+    def _check(self, i: int, raw: bytes) -> bytes:
+        _, _, raw_size, crc = self._entries[i]
+        if len(raw) != raw_size or zlib.crc32(raw) != crc:
+            raise IcepackerError(f"Block {i} is corrupted")
+        return raw
+
+    def block(self, i: int) -> bytes:
+        """
+        Depack a block.
+
+        Raises:
+            IndexError: If there is no such block.
+            IcepackerError: If depacking fails or the checksum does
+                            not match.
+        """
+        return self._check(i, self._ice.depack(self.packed_block(i)))
+
+    def depack(self, threads: int = 0) -> bytes:
+        """
+        Depack all the blocks with a single library call.
+
+        Args:
+            threads: Number of threads (0: number of CPUs).
+
+        Returns:
+            The depacked data.
+
+        Raises:
+            IcepackerError: If depacking fails or a checksum does not
+                            match.
+        """
+        raws = self._ice.depack_batch(
+            [self.packed_block(i) for i in range(len(self))], threads)
+        return b''.join(self._check(i, raw) for i, raw in enumerate(raws))
+
+    def read_range(self, offset: int, length: int) -> bytes:
+        """
+        Depack a range of the data. Only the blocks it spans are depacked.
+
+        Args:
+            offset: Depacked data offset.
+            length: Number of bytes.
+
+        Returns:
+            The depacked bytes [offset, offset+length).
+
+        Raises:
+            IcepackerError: If the range is out of the data or
+                            depacking fails.
+        """
+        end = offset + length
+        if offset < 0 or length < 0 or end > self.depacked_size:
+            raise IcepackerError(f"Invalid range {offset}:{end}")
+        parts = []
+        i = bisect_right(self._positions, offset) - 1
+        while length and i < len(self._positions) and self._positions[i] < end:
+            pos = self._positions[i]
+            raw = self.block(i)
+            parts.append(raw[max(offset - pos, 0):end - pos])
+            i += 1
+        return b''.join(parts)
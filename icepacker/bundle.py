@@ -0,0 +1,225 @@
+# @file     icepacker/bundle.py
+# @author   Ben G. Han
+# @brief    Solid bundle of many small files with a central directory.
+
+import mmap
+import os
+import struct
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple, Union
+
+from .icepacker import Icepacker, IcepackerError, BufferLike
+from .blocks import IcepackBlocks, write_container
+
+# Default maximum raw size of a solid block
+BUNDLE_BLOCK_SIZE = 1 << 18
+
+# Default number of depacked blocks kept by a reader
+BUNDLE_CACHE = 8
+
+# Directory: magic, number of members
+_HEADER = struct.Struct('>4sI')
+# Member: block, offset in the block, length, name length (UTF-8 name follows)
+_ENTRY = struct.Struct('>IIIH')
+_MAGIC = b'ICEd'
+
+def _similarity(name: str, data: bytes) -> Any:
+    """Default grouping key: files with the same extension and start."""
+    return os.path.splitext(name)[1].lower(), bytes(data[:64])
+
+def pack_bundle(files: Union[Dict[str, BufferLike], Iterable[Tuple[str, BufferLike]]],
+                block_size: int = BUNDLE_BLOCK_SIZE, level: Optional[int] = None,
+                threads: int = 0,
+                key: Optional[Callable[[str, bytes], Any]] = None,
+                lib_path: Optional[str] = None) -> bytes:
+    """
+    Compress many files into a solid bundle.
+
+    The files are sorted by key so similar files (e.g. SNDH files
+    sharing a replay routine) are neighbours, then packed together in
+    solid blocks of at most block_size bytes, so strings can copy
+    bytes of the previous files of the block. A file larger than
+    block_size has a block of its own. A central directory maps each
+    name to its block, offset and length.
+
+    The bundle is a block container (see IcepackBlocks) whose last
+    block is the directory.
+
+    Args:
+        files: Mapping or iterable of (name, data).
+        block_size: Maximum raw size of a block holding many files.
+        level: Compression level (see Icepacker.pack()).
+        threads: Number of threads (0: number of CPUs).
+        key: Grouping key of a file, called with its name and its data
+             (default: its extension and its first 64 bytes).
+        lib_path: Path to the unice68 library (see load_library()).
+
+    Returns:
+        The bundle.
+
+    Raises:
+        IcepackerError: If the arguments are invalid, a name is
+                        repeated or packing fails.
+    """
+    if not 0 < block_size < 1 << 32:
+        raise IcepackerError(f"Invalid block size {block_size}")
+    items = files.items() if isinstance(files, dict) else files
+    members = [(name, memoryview(data).cast('B')) for name, data in items]
+    if len({name for name, _ in members}) != len(members):
+        raise IcepackerError("Duplicate names in the bundle")
+    for name, _ in members:
+        if len(name.encode('utf-8')) > 0xffff:
+            raise IcepackerError(f"Name too long in the bundle ({name[:32]}...)")
+    key = key or _similarity
+    members.sort(key=lambda member: key(*member))
+
+    blocks, current, size = [], [], 0
+    entries = []
+    for name, data in members:
+        if current and size + data.nbytes > block_size:
+            blocks.append(b''.join(current))
+            current, size = [], 0
+        entries.append((name, len(blocks), size, data.nbytes))
+        if data.nbytes:
+            current.append(data)
+            size += data.nbytes
+    if current:
+        blocks.append(b''.join(current))
+
+    directory = [_HEADER.pack(_MAGIC, len(entries))]
+    for name, block, offset, length in entries:
+        encoded = name.encode('utf-8')
+        directory += [_ENTRY.pack(block, offset, length, len(encoded)), encoded]
+    blocks.append(b''.join(directory))
+
+    return write_container(Icepacker(lib_path), blocks,
+                           max(len(block) for block in blocks), level, threads)
+
+class IcepackBundle:
+    """
+    Reader of a bundle made by pack_bundle().
+
+    The bundle is memory mapped when given a path. Reading a file
+    depacks its block and slices it out. The last depacked blocks are
+    kept in a small LRU cache, so reading neighbour files depacks their
+    block once. Reading is thread safe.
+
+    Usage:
+        with IcepackBundle('sndh.bundle') as bundle:
+            data = bundle.read('Mad_Max/Lethal_Xcess.sndh')
+    """
+
+    def __init__(self, bundle: Union[str, os.PathLike, BufferLike],
+                 cache_blocks: int = BUNDLE_CACHE, lib_path: Optional[str] = None):
+        """
+        Args:
+            bundle: Path of the bundle, or bundle data (any contiguous
+                    buffer). Data is kept and must not change.
+            cache_blocks: Number of depacked blocks kept.
+            lib_path: Path to the unice68 library (see load_library()).
+
+        Raises:
+            IcepackerError: If the bundle is invalid.
+            OSError: If the file cannot be mapped.
+        """
+        if cache_blocks < 1:
+            raise IcepackerError(f"Invalid cache size {cache_blocks}")
+        self._mmap = self._blocks = None
+        if isinstance(bundle, (str, os.PathLike)):
+            with open(bundle, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            bundle = self._mmap
+        try:
+            self._blocks = IcepackBlocks(bundle, lib_path)
+            self._members = self._load()
+        except Exception:
+            self.close()
+            raise
+        self._cache = OrderedDict()
+        self._cache_blocks = cache_blocks
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[str, Tuple[int, int, int]]:
+        """Parse the directory (the last block)."""
+        if not len(self._blocks):
+            raise IcepackerError("Not a bundle")
+        data = self._blocks.block(len(self._blocks) - 1)
+        members = {}
+        try:
+            magic, count = _HEADER.unpack_from(data)
+            if magic != _MAGIC:
+                raise IcepackerError("Not a bundle")
+            pos = _HEADER.size
+            for _ in range(count):
+                block, offset, length, size = _ENTRY.unpack_from(data, pos)
+                pos += _ENTRY.size
+                name = data[pos:pos + size].decode('utf-8')
+                pos += size
+                members[name] = (block, offset, length)
+        except (struct.error, UnicodeDecodeError):
+            raise IcepackerError("Invalid bundle directory") from None
+        for block, offset, length in members.values():
+            if length and (block >= len(self._blocks) - 1 or
+                           offset + length > self._blocks._entries[block][2]):
+                raise IcepackerError("Invalid bundle directory")
+        return members
+
+    def __len__(self) -> int:
+        """Number of files."""
+        return len(self._members)
+
+    def __iter__(self) -> Iterator[str]:
+        """Names of the files."""
+        return iter(self._members)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._members
+
+    def _block(self, i: int) -> bytes:
+        """Depacked block, from the cache if possible."""
+        with self._lock:
+            data = self._cache.get(i)
+            if data is not None:
+                self._cache.move_to_end(i)
+                return data
+        data = self._blocks.block(i)
+        with self._lock:
+            self._cache[i] = data
+            if len(self._cache) > self._cache_blocks:
+                self._cache.popitem(last=False)
+        return data
+
+    def read(self, name: str) -> bytes:
+        """
+        Read a file.
+
+        Args:
+            name: Name of the file in the bundle.
+
+        Returns:
+            The file data.
+
+        Raises:
+            KeyError: If there is no such file.
+            IcepackerError: If depacking fails.
+        """
+        block, offset, length = self._members[name]
+        if not length:
+            return b''
+        return self._block(block)[offset:offset + length]
+
+    def close(self) -> None:
+        """Release the mapping of the bundle file."""
+        if self._blocks is not None:
+            self._blocks._data.release()
+            self._blocks = None
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def __enter__(self) -> 'IcepackBundle':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -3,22 +3,150 @@
 # @date     2025-09-03
 # @brief    Python interface for ice packer/depacker C library.
 
-from os import path as ospath
+from os import path as ospath, getpid
 import ctypes
-from ctypes.util import find_library
-from typing import Optional, Tuple
-from importlib import resources
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 from importlib.util import find_spec
 from sys import version_info
-from platform import system as system_name
+import threading
+import struct
 
 lib_base = 'unice68'
 mod_name = 'icepacker'
 
+# Compression levels (see unice68_packer_level)
+MIN_LEVEL = 0
+DEFAULT_LEVEL = 5
+MAX_LEVEL = 9
+
+# Any C-contiguous object supporting the buffer protocol (bytes,
+# bytearray, memoryview, mmap, array, numpy arrays ...)
+BufferLike = Any
+
 class IcepackerError(Exception):
     """Custom exception for icepack module errors."""
     pass
 
+# Native extension (optional, see _unice68.c)
+try:
+    from . import _unice68
+except ImportError:
+    _unice68 = None
+else:
+    _unice68.set_error(IcepackerError)
+
+# Backends
+NATIVE = 'native'
+CTYPES = 'ctypes'
+
+# Inputs smaller than this are processed inline by the async methods
+INLINE_SIZE = 4096
+
+class _PyBuffer(ctypes.Structure):
+    """CPython Py_buffer structure."""
+    _fields_ = [
+        ('buf', ctypes.c_void_p),
+        ('obj', ctypes.c_void_p),
+        ('len', ctypes.c_ssize_t),
+        ('itemsize', ctypes.c_ssize_t),
+        ('readonly', ctypes.c_int),
+        ('ndim', ctypes.c_int),
+        ('format', ctypes.c_char_p),
+        ('shape', ctypes.POINTER(ctypes.c_ssize_t)),
+        ('strides', ctypes.POINTER(ctypes.c_ssize_t)),
+        ('suboffsets', ctypes.POINTER(ctypes.c_ssize_t)),
+        ('internal', ctypes.c_void_p),
+    ]
+
+try:
+    _get_buffer = ctypes.pythonapi.PyObject_GetBuffer
+    _get_buffer.argtypes = [
+        ctypes.py_object,            # PyObject * exporter
+        ctypes.POINTER(_PyBuffer),   # Py_buffer * view
+        ctypes.c_int                 # int flags
+    ]
+    _get_buffer.restype = ctypes.c_int
+    _release_buffer = ctypes.pythonapi.PyBuffer_Release
+    _release_buffer.argtypes = [ ctypes.POINTER(_PyBuffer) ]
+    _release_buffer.restype = None
+except AttributeError:
+    _get_buffer = None      # Not CPython
+
+@contextmanager
+def _buffer(obj: BufferLike, writable: bool = False) -> Iterator[Tuple[int, int]]:
+    """
+    Export a buffer-protocol object without copying it.
+
+    The buffer is locked (e.g. a bytearray can't be resized) until
+    the context exits.
+
+    Args:
+        obj: A C-contiguous buffer-protocol object.
+        writable: Request a writable buffer.
+
+    Returns:
+        Tuple of (address, size in bytes).
+
+    Raises:
+        TypeError: If obj does not support the buffer protocol.
+        BufferError: If obj is not contiguous or not writable.
+    """
+    if _get_buffer is None:
+        view = memoryview(obj).cast('B')
+        if view.readonly and writable:
+            raise BufferError("Object is not writable.")
+        if view.readonly:
+            data = bytes(view)  # ctypes can't address read-only buffers
+            yield ctypes.cast(data, ctypes.c_void_p).value, len(data)
+        else:
+            data = (ctypes.c_char * view.nbytes).from_buffer(view)
+            yield ctypes.addressof(data), view.nbytes
+        return
+
+    view = _PyBuffer()
+    _get_buffer(obj, ctypes.byref(view), int(writable)) # PyBUF_SIMPLE|PyBUF_WRITABLE
+    try:
+        yield view.buf, view.len
+    finally:
+        _release_buffer(ctypes.byref(view))
+
+class _Checkpoint(ctypes.Structure):
+    """unice68_checkpoint_t"""
+    _fields_ = [
+        ('srcpos', ctypes.c_int),
+        ('dstpos', ctypes.c_int),
+        ('bits', ctypes.c_int)
+    ]
+
+class _BatchItem(ctypes.Structure):
+    """unice68_batch_t"""
+    _fields_ = [
+        ('src', ctypes.c_void_p),
+        ('srclen', ctypes.c_int),
+        ('dst', ctypes.c_void_p),
+        ('dstcap', ctypes.c_int),
+        ('size', ctypes.c_int),
+    ]
+
+class _Params(ctypes.Structure):
+    """unice68_params_t"""
+    _fields_ = [
+        ('engine', ctypes.c_int),
+        ('depth', ctypes.c_int),
+        ('parse', ctypes.c_int),
+        ('window', ctypes.c_int),
+        ('threads', ctypes.c_int),
+        ('segments', ctypes.c_int),
+    ]
+
+# unice68_batch_t packing (native alignment, same layout as _BatchItem)
+_BATCH = struct.Struct('@PiPii')
+
+def _pack_bound(size: int) -> int:
+    """Output buffer size that is always large enough to pack size bytes."""
+    return 16 + ( size * 9 >> 3 )
+
 def get_libformat() -> str:
     """
     Determine the platform-specific library file naming scheme by
@@ -31,6 +159,10 @@ def get_libformat() -> str:
         IcepackerError: If the library naming scheme cannot be determined.
 
     """
+    # Imported here as they are slow to import and only needed to probe
+    from ctypes.util import find_library
+    from platform import system as system_name
+
     pyver = 'python%d.%d'%(version_info.major,version_info.minor)
     for tpl in (pyver, 'expat', 'ssl',):
         try:
@@ -69,102 +201,409 @@ def build_library_name(base_name: str) -> str:
     """
     return get_libformat() % base_name
 
-class Icepacker:
-    """Python interface to the icepack C library."""
+def _setup_functions(lib: ctypes.CDLL) -> ctypes.CDLL:
+    """Configure the C function prototypes and argument types."""
 
-    def __init__(self, lib_path: Optional[str] = None):
-        """
-        Initialize the icepack library interface.
+    # unice68_depacked_size
+    lib.unice68_depacked_size.argtypes = [
+        ctypes.c_void_p,             # const void * buffer
+        ctypes.POINTER(ctypes.c_int) # int * p_csize
+    ]
+    lib.unice68_depacked_size.restype = ctypes.c_int
 
-        Args:
+    # unice68_depacker
+    lib.unice68_depacker.argtypes = [
+        ctypes.c_void_p, # void * dst
+        ctypes.c_void_p  # const void * src
+    ]
+    lib.unice68_depacker.restype = ctypes.c_int
 
-            lib_path: Path to the icepack shared library. If None,
-                      tries package-bundled binaries, local build, or
-                      system library using find_library.
+    # unice68_packer
+    lib.unice68_packer.argtypes = [
+        ctypes.c_void_p, # void * dst
+        ctypes.c_int,    # int max
+        ctypes.c_void_p, # const void * src
+        ctypes.c_int     # int len
+    ]
+    lib.unice68_packer.restype = ctypes.c_int
 
-        Raises:
-            IcepackerError: If the library cannot be loaded.
+    # unice68_packer_level (optional)
+    if hasattr(lib, 'unice68_packer_level'):
+        lib.unice68_packer_level.argtypes = [
+            ctypes.c_void_p, # void * dst
+            ctypes.c_int,    # int max
+            ctypes.c_void_p, # const void * src
+            ctypes.c_int,    # int len
+            ctypes.c_int     # int level
+        ]
+        lib.unice68_packer_level.restype = ctypes.c_int
 
-        """
-        self.lib = None
+    # unice68_packer_ex, unice68_params_level (optional)
+    if hasattr(lib, 'unice68_packer_ex'):
+        lib.unice68_packer_ex.argtypes = [
+            ctypes.c_void_p,          # void * dst
+            ctypes.c_int,             # int max
+            ctypes.c_void_p,          # const void * src
+            ctypes.c_int,             # int len
+            ctypes.POINTER(_Params)   # const unice68_params_t * params
+        ]
+        lib.unice68_packer_ex.restype = ctypes.c_int
+        lib.unice68_params_level.argtypes = [
+            ctypes.POINTER(_Params),  # unice68_params_t * params
+            ctypes.c_int              # int level
+        ]
+        lib.unice68_params_level.restype = ctypes.c_int
+
+    # unice68_packer_threads (optional)
+    if hasattr(lib, 'unice68_packer_threads'):
+        lib.unice68_packer_threads.argtypes = [
+            ctypes.c_void_p, # void * dst
+            ctypes.c_int,    # int max
+            ctypes.c_void_p, # const void * src
+            ctypes.c_int,    # int len
+            ctypes.c_int,    # int level
+            ctypes.c_int     # int threads
+        ]
+        lib.unice68_packer_threads.restype = ctypes.c_int
+
+    # unice68_depack_batch, unice68_pack_batch (optional)
+    if hasattr(lib, 'unice68_depack_batch'):
+        lib.unice68_depack_batch.argtypes = [
+            ctypes.POINTER(_BatchItem), # unice68_batch_t * items
+            ctypes.c_int,               # int count
+            ctypes.c_int                # int threads
+        ]
+        lib.unice68_depack_batch.restype = ctypes.c_int
+        lib.unice68_pack_batch.argtypes = [
+            ctypes.POINTER(_BatchItem), # unice68_batch_t * items
+            ctypes.c_int,               # int count
+            ctypes.c_int,               # int level
+            ctypes.c_int                # int threads
+        ]
+        lib.unice68_pack_batch.restype = ctypes.c_int
+
+    # unice68_stream_* (optional)
+    if hasattr(lib, 'unice68_stream_new'):
+        lib.unice68_stream_new.argtypes = [ ctypes.c_int ] # int level
+        lib.unice68_stream_new.restype = ctypes.c_void_p
+        for name in ('unice68_stream_feed', 'unice68_stream_read'):
+            getattr(lib, name).argtypes = [
+                ctypes.c_void_p, # unice68_stream_t * S
+                ctypes.c_void_p, # void * buffer
+                ctypes.c_int     # int len
+            ]
+            getattr(lib, name).restype = ctypes.c_int
+        lib.unice68_stream_finish.argtypes = [
+            ctypes.c_void_p, # unice68_stream_t * S
+            ctypes.c_void_p  # void * header
+        ]
+        lib.unice68_stream_finish.restype = ctypes.c_int
+        lib.unice68_stream_free.argtypes = [ ctypes.c_void_p ]
+        lib.unice68_stream_free.restype = None
+
+    # unice68_depack_stream_* (optional)
+    if hasattr(lib, 'unice68_depack_stream_new'):
+        lib.unice68_depack_stream_new.argtypes = [
+            ctypes.c_void_p, # const void * src
+            ctypes.c_int     # int srclen
+        ]
+        lib.unice68_depack_stream_new.restype = ctypes.c_void_p
+        lib.unice68_depack_stream_read.argtypes = [
+            ctypes.c_void_p,                  # unice68_depack_stream_t * S
+            ctypes.POINTER(ctypes.c_void_p),  # const void ** data
+            ctypes.POINTER(ctypes.c_int)      # int * offset
+        ]
+        lib.unice68_depack_stream_read.restype = ctypes.c_int
+        lib.unice68_depack_stream_chunk.argtypes = [
+            ctypes.c_void_p, # unice68_depack_stream_t * S
+            ctypes.c_int     # int size
+        ]
+        lib.unice68_depack_stream_chunk.restype = ctypes.c_int
+        lib.unice68_depack_stream_save.argtypes = [
+            ctypes.c_void_p,              # unice68_depack_stream_t * S
+            ctypes.POINTER(_Checkpoint),  # unice68_checkpoint_t * cp
+            ctypes.c_void_p               # void * window
+        ]
+        lib.unice68_depack_stream_save.restype = ctypes.c_int
+        lib.unice68_depack_stream_restore.argtypes = [
+            ctypes.c_void_p,              # unice68_depack_stream_t * S
+            ctypes.POINTER(_Checkpoint),  # const unice68_checkpoint_t * cp
+            ctypes.c_void_p,              # const void * window
+            ctypes.c_int                  # int len
+        ]
+        lib.unice68_depack_stream_restore.restype = ctypes.c_int
+        lib.unice68_depack_stream_free.argtypes = [ ctypes.c_void_p ]
+        lib.unice68_depack_stream_free.restype = None
 
-        if lib_path is None:
+    # unice68_packer_restart, unice68_depack_parallel (optional)
+    if hasattr(lib, 'unice68_packer_restart'):
+        lib.unice68_packer_restart.argtypes = [
+            ctypes.c_void_p,              # void * dst
+            ctypes.c_int,                 # int max
+            ctypes.c_void_p,              # const void * src
+            ctypes.c_int,                 # int len
+            ctypes.c_int,                 # int level
+            ctypes.c_int,                 # int interval
+            ctypes.POINTER(_Checkpoint),  # unice68_checkpoint_t * points
+            ctypes.POINTER(ctypes.c_int)  # int * count
+        ]
+        lib.unice68_packer_restart.restype = ctypes.c_int
+        lib.unice68_depack_parallel.argtypes = [
+            ctypes.c_void_p,              # void * dst
+            ctypes.c_void_p,              # const void * src
+            ctypes.POINTER(_Checkpoint),  # const unice68_checkpoint_t * points
+            ctypes.c_int,                 # int count
+            ctypes.c_int                  # int threads
+        ]
+        lib.unice68_depack_parallel.restype = ctypes.c_int
 
-            # Expected library filename for this platform.
-            lib_name = build_library_name(lib_base)
+    # unice68_packer_segments (optional)
+    if hasattr(lib, 'unice68_packer_segments'):
+        lib.unice68_packer_segments.argtypes = [
+            ctypes.c_void_p,              # void * dst
+            ctypes.c_int,                 # int max
+            ctypes.c_void_p,              # const void * src
+            ctypes.c_int,                 # int len
+            ctypes.c_int,                 # int level
+            ctypes.c_int,                 # int threads
+            ctypes.POINTER(ctypes.c_int)  # int * missed
+        ]
+        lib.unice68_packer_segments.restype = ctypes.c_int
 
-            # Try buddy/bunddle library first [icepacker/lib/{lib_name}].
-            if resources.is_resource(mod_name, "lib", lib_name):
-                with resources.path(mod_name,"lib",lib_name) as x:
-                    if self._setup_functions(str(x)):
-                        return
+    return lib
 
-            # Try setup build [unice68/lib/{libname}]
-            top_dir = ospath.dirname(ospath.dirname(__file__))
+def _try_library(lib_path: Optional[str]) -> Optional[ctypes.CDLL]:
+    """Load and setup a library, None if it is not suitable."""
+    if not lib_path:
+        return None
+    try:
+        return _setup_functions(ctypes.cdll.LoadLibrary(lib_path))
+    except (OSError, AttributeError):
+        return None
 
-            # [icepacker/lib/libunice68.so]
-            if self._setup_functions(ospath.join(top_dir,lib_path)):
-                return
+def _bundled_library(lib_name: str) -> Optional[ctypes.CDLL]:
+    """Try the package bundled library [icepacker/lib/{lib_name}]."""
+    from importlib import resources
+    try:
+        res = resources.files(mod_name).joinpath("lib", lib_name)
+    except (AttributeError, TypeError):
+        # Python < 3.9 or multiple path names not supported
+        return _try_library(ospath.join(ospath.dirname(__file__), "lib", lib_name))
+    if not res.is_file():
+        return None
+    with resources.as_file(res) as x:
+        return _try_library(str(x))
 
-            # Check for source dir unice68
-            if ospath.isfile(ospath.join(top_dir,lib_base,"unice68.h")):
-                lib_path = ospath.join(mod_name, "lib", lib_name)
+def _find_library() -> ctypes.CDLL:
+    """
+    Run the library discovery sequence.
 
-                # [build/lib/icepacker/lib/libunice68.so]
-                if self._setup_functions(ospath.join(top_dir,"build","lib",lib_path)):
-                    return
+    Raises:
+        IcepackerError: If no suitable library is found.
+    """
+    # Library recorded by the build: no probing needed.
+    try:
+        from . import _config
+    except ImportError:
+        pass
+    else:
+        if _config.LIB_NAME:
+            lib = _bundled_library(_config.LIB_NAME)
+            if lib: return lib
+        lib = _try_library(_config.LIB_PATH)
+        if lib: return lib
 
-                # [unice68/libunice68.so]
-                if self._setup_functions(ospath.join(top_dir, lib_base, lib_name)):
-                    return
+    from ctypes.util import find_library
 
-            # Finally: System library
-            if self._setup_functions(find_library(lib_base)):
-                return
+    # Expected library filename for this platform.
+    lib_name = build_library_name(lib_base)
 
-            raise IcepackerError(f"Could not find a suitable {lib_base} library")
+    # Try buddy/bunddle library first [icepacker/lib/{lib_name}].
+    lib = _bundled_library(lib_name)
+    if lib: return lib
 
-    def _setup_functions(self, lib_path: Optional[str] = None) -> bool:
-        """Configure the C function prototypes and argument types."""
+    # Check for source dir unice68
+    top_dir = ospath.dirname(ospath.dirname(__file__))
+    if ospath.isfile(ospath.join(top_dir,lib_base,"unice68.h")):
+        lib_path = ospath.join(mod_name, "lib", lib_name)
 
-        try:
-            if lib_path:
-                self.lib = ctypes.cdll.LoadLibrary(lib_path)
+        # [build/lib/icepacker/lib/libunice68.so]
+        lib = _try_library(ospath.join(top_dir,"build","lib",lib_path))
+        if lib: return lib
 
-            # unice68_depacked_size
-            self.lib.unice68_depacked_size.argtypes = [
-                ctypes.c_void_p,             # const void * buffer
-                ctypes.POINTER(ctypes.c_int) # int * p_csize
-            ]
-            self.lib.unice68_depacked_size.restype = ctypes.c_int
+        # [unice68/libunice68.so]
+        lib = _try_library(ospath.join(top_dir, lib_base, lib_name))
+        if lib: return lib
 
-            # unice68_depacker
-            self.lib.unice68_depacker.argtypes = [
-                ctypes.c_void_p, # void * dst
-                ctypes.c_void_p  # const void * src
-            ]
-            self.lib.unice68_depacker.restype = ctypes.c_int
+    # Finally: System library
+    lib = _try_library(find_library(lib_base))
+    if lib: return lib
 
-            # unice68_packer
-            self.lib.unice68_packer.argtypes = [
-                ctypes.c_void_p, # void * dst
-                ctypes.c_int,    # int max
-                ctypes.c_void_p, # const void * src
-                ctypes.c_int     # int len
-            ]
-            self.lib.unice68_packer.restype = ctypes.c_int
+    raise IcepackerError(f"Could not find a suitable {lib_base} library")
 
-        except (OSError, AttributeError) as E:
-            self.lib = None
+# Libraries already bound, by path (None for the discovered one)
+_libraries: Dict[Optional[str], ctypes.CDLL] = { }
+_libraries_lock = threading.Lock()
 
-        return self.lib is not None
+def _after_fork() -> None:
+    """Reset the locks and threads inherited by a forked child."""
+    global _libraries_lock
+    _libraries_lock = threading.Lock()
 
-    def depacked_size(self, buffer: bytes) -> Tuple[int, int]:
+try:
+    from os import register_at_fork
+except ImportError:
+    pass                    # Windows
+else:
+    register_at_fork(after_in_child=_after_fork)
+
+def load_library(lib_path: Optional[str] = None) -> ctypes.CDLL:
+    """
+    Get the unice68 library binding.
+
+    The library is searched, loaded and its prototypes are set up
+    only once per process; following calls return the same binding.
+
+    Args:
+        lib_path: Path to the unice68 shared library. If None, tries
+                  package-bundled binaries, local build, or system
+                  library using find_library.
+
+    Returns:
+        The ctypes library with its function prototypes set.
+
+    Raises:
+        IcepackerError: If the library cannot be loaded.
+    """
+    lib = _libraries.get(lib_path)
+    if lib is not None:
+        return lib
+    with _libraries_lock:
+        lib = _libraries.get(lib_path)
+        if lib is None:
+            if lib_path is None:
+                lib = _find_library()
+            else:
+                lib = _try_library(lib_path)
+                if lib is None:
+                    raise IcepackerError(f"Could not load {lib_path}")
+            _libraries[lib_path] = lib
+    return lib
+
+def _map_ordered(func: Callable[[BufferLike], Any], items: Iterable[BufferLike],
+                 workers: Optional[int], in_flight: Optional[int]) -> Iterator[Any]:
+    """
+    Lazily map func over items with a thread pool.
+
+    Results are yielded in input order. At most in_flight items are
+    submitted ahead of the one being yielded, so items are consumed
+    from the iterable as results are consumed.
+    """
+    from os import cpu_count
+
+    if workers is None:
+        workers = cpu_count() or 1
+    if workers < 1:
+        raise IcepackerError(f"Invalid number of workers {workers}")
+    if in_flight is None:
+        in_flight = 2 * workers
+    if in_flight < 1:
+        raise IcepackerError(f"Invalid number of in-flight jobs {in_flight}")
+
+    return _ordered_results(func, iter(items), workers, in_flight)
+
+def _ordered_results(func: Callable[[BufferLike], Any], items: Iterator[BufferLike],
+                     workers: int, in_flight: int) -> Iterator[Any]:
+    """_map_ordered() generator."""
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
+
+    pending = deque()
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=mod_name)
+    try:
+        for item in items:
+            pending.append(pool.submit(func, item))
+            if len(pending) >= in_flight:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # Early exit (error or generator closed): drop queued jobs
+        for future in pending:
+            future.cancel()
+        pool.shutdown(wait=True)
+
+class Icepacker:
+    """Python interface to the icepack C library."""
+
+    def __init__(self, lib_path: Optional[str] = None,
+                 backend: Optional[str] = None, *,
+                 async_workers: Optional[int] = None,
+                 async_limit: Optional[int] = None,
+                 inline_size: int = INLINE_SIZE):
+        """
+        Initialize the icepack library interface.
+
+        Args:
+
+            lib_path: Path to the icepack shared library. If None,
+                      tries package-bundled binaries, local build, or
+                      system library using find_library.
+
+            backend: NATIVE for the compiled extension, CTYPES for
+                     the shared library. If None, the extension is
+                     used when it is available and lib_path is None.
+
+            async_workers: Number of threads of the executor used by
+                           the async methods (default: number of CPUs).
+
+            async_limit: Maximum number of concurrent async calls per
+                         event loop; others wait for their turn
+                         (default: async_workers).
+
+            inline_size: Async calls on inputs smaller than this many
+                         bytes run inline in the event loop.
+
+        Raises:
+            IcepackerError: If the library cannot be loaded.
+
+        """
+        self.lib_path = lib_path
+        if async_workers is None:
+            from os import cpu_count
+            async_workers = cpu_count() or 1
+        if async_workers < 1:
+            raise IcepackerError(f"Invalid number of workers {async_workers}")
+        if async_limit is None:
+            async_limit = async_workers
+        if async_limit < 1:
+            raise IcepackerError(f"Invalid concurrency limit {async_limit}")
+        self.async_workers = async_workers
+        self.async_limit = async_limit
+        self.inline_size = inline_size
+        self._reset_async()
+
+        if backend is None:
+            backend = NATIVE if _unice68 and lib_path is None else CTYPES
+        if backend == NATIVE:
+            if _unice68 is None:
+                raise IcepackerError("Native extension is not available")
+            if lib_path is not None:
+                raise IcepackerError("lib_path requires the ctypes backend")
+            self.lib = None
+        elif backend == CTYPES:
+            self.lib = load_library(lib_path)
+        else:
+            raise IcepackerError(f"Unknown backend {backend}")
+        self.backend = backend
+        self._native = _unice68 if backend == NATIVE else None
+
+    def depacked_size(self, buffer: BufferLike) -> Tuple[int, int]:
         """
         Get the depacked size of a compressed buffer.
 
         Args:
-            buffer: Input compressed data as bytes.
+            buffer: Input compressed data (any contiguous buffer).
 
         Returns:
             Tuple of (depacked_size, compressed_size).
@@ -172,19 +611,27 @@ class Icepacker:
         Raises:
             IcepackerError: If the function fails.
         """
+        if self._native:
+            return self._native.depacked_size(buffer)
+        with _buffer(buffer) as (addr, size):
+            return self._depacked_size(addr, size)
+
+    def _depacked_size(self, addr: int, size: int) -> Tuple[int, int]:
+        """depacked_size() of an exported buffer."""
+        if size < 12:
+            raise IcepackerError("Input buffer is too small")
         csize = ctypes.c_int()
-        c_buffer = ctypes.c_void_p(ctypes.cast(buffer, ctypes.c_void_p).value)
-        result = self.lib.unice68_depacked_size(c_buffer, ctypes.byref(csize))
+        result = self.lib.unice68_depacked_size(addr, ctypes.byref(csize))
         if result < 0:
             raise IcepackerError(f"unice68_depacked_size failed with code {result}")
         return result, csize.value
 
-    def depack(self, src: bytes) -> bytes:
+    def depack(self, src: BufferLike) -> bytes:
         """
         Decompress data using the icepack library.
 
         Args:
-            src: Input compressed data as bytes.
+            src: Input compressed data (any contiguous buffer).
 
         Returns:
             Decompressed data as bytes.
@@ -192,27 +639,71 @@ class Icepacker:
         Raises:
             IcepackerError: If decompression fails or input is invalid.
         """
-        depacked_size, packed_size = self.depacked_size(src)
+        if self._native:
+            return self._native.depack(src)
+        with _buffer(src) as (addr, size):
+            depacked_size, _ = self._depack_check(addr, size)
+            dst = ctypes.create_string_buffer(depacked_size)
+            self._depack(ctypes.addressof(dst), addr)
+        return ctypes.string_at(dst, depacked_size)
+
+    def depack_into(self, src: BufferLike, out: BufferLike) -> int:
+        """
+        Decompress data into a caller provided buffer.
+
+        Args:
+            src: Input compressed data (any contiguous buffer).
+            out: Writable contiguous buffer large enough for the
+                 depacked data (see depacked_size()).
+
+        Returns:
+            Number of bytes written at the start of out.
+
+        Raises:
+            IcepackerError: If decompression fails, input is invalid
+                            or out is too small.
+        """
+        if self._native:
+            return self._native.depack_into(src, out)
+        with _buffer(src) as (addr, size), \
+             _buffer(out, writable=True) as (out_addr, out_size):
+            depacked_size, _ = self._depack_check(addr, size)
+            if depacked_size > out_size:
+                raise IcepackerError(f"Output buffer too small ({out_size} < {depacked_size})")
+            self._depack(out_addr, addr)
+        return depacked_size
+
+    def _depack_check(self, addr: int, size: int) -> Tuple[int, int]:
+        """Validate the header of an exported packed buffer."""
+        depacked_size, packed_size = self._depacked_size(addr, size)
         if depacked_size <= 0:
             raise IcepackerError("Invalid depacked size")
-        if packed_size > len(src):
+        if packed_size > size:
             raise IcepackerError(f"Missing packed data")
+        return depacked_size, packed_size
 
-        dst = ctypes.create_string_buffer(depacked_size)
-        c_src = ctypes.c_void_p(ctypes.cast(src, ctypes.c_void_p).value)
-        result = self.lib.unice68_depacker(dst, c_src)
+    def _depack(self, dst: int, src: int) -> None:
+        """unice68_depacker() with error check."""
+        result = self.lib.unice68_depacker(dst, src)
         if result != 0:
             raise IcepackerError(f"unice68_depacker failed with code {result}")
 
-        return dst.raw[:depacked_size]
-
-    def pack(self, src: bytes, max_size: Optional[int] = None) -> bytes:
+    def pack(self, src: BufferLike, max_size: Optional[int] = None,
+             level: Optional[int] = None, threads: int = 1) -> bytes:
         """
         Compress data using Ice! packer.
 
         Args:
-            src: Input data to compress as bytes.
+            src: Input data to compress (any contiguous buffer).
             max_size: Maximum size of the compressed output.
+            level: Compression level from MIN_LEVEL (fastest) to
+                   MAX_LEVEL (smallest). None or DEFAULT_LEVEL
+                   produces the original packer output. Sizes are
+                   not strictly decreasing with the level on every
+                   input (see unice68_params_level()).
+            threads: Number of threads searching strings (0: number
+                     of CPUs). The output does not depend on it.
+                     Optimal parsing levels use a single thread.
 
         Returns:
             Compressed data as bytes.
@@ -220,23 +711,432 @@ class Icepacker:
         Raises:
             IcepackerError
         """
-        if not src:
-            raise IcepackerError("Input buffer cannot be empty")
-        input_len = len(src)
+        if self._native:
+            return self._native.pack(src, max_size, level, threads)
+        with _buffer(src) as (c_src, input_len):
+            bound = _pack_bound(input_len)
+            if not max_size: max_size = bound
+            if max_size <= 0:
+                raise IcepackerError("Invalid maximum size")
+            # The packer does not check the output size
+            dst = ctypes.create_string_buffer(max(max_size, bound))
+            result = self._pack(ctypes.addressof(dst), max_size,
+                                c_src, input_len, level, threads)
+        return ctypes.string_at(dst, result)
+
+    def pack_into(self, src: BufferLike, out: BufferLike,
+                  level: Optional[int] = None, threads: int = 1) -> int:
+        """
+        Compress data into a caller provided buffer.
+
+        Args:
+            src: Input data to compress (any contiguous buffer).
+            out: Writable contiguous buffer for the compressed data.
+            level: Compression level (see pack()).
+            threads: Number of threads (see pack()).
+
+        Returns:
+            Number of bytes written at the start of out.
+
+        Raises:
+            IcepackerError: If compression fails or the compressed
+                            data does not fit in out.
+        """
+        if self._native:
+            return self._native.pack_into(src, out, level, threads)
+        with _buffer(src) as (c_src, input_len), \
+             _buffer(out, writable=True) as (out_addr, out_size):
+            bound = _pack_bound(input_len)
+            if out_size >= bound:
+                return self._pack(out_addr, out_size, c_src, input_len,
+                                  level, threads)
+
+            # The packer does not check the output size
+            tmp = ctypes.create_string_buffer(bound)
+            result = self._pack(ctypes.addressof(tmp), bound,
+                                c_src, input_len, level, threads)
+            if result > out_size:
+                raise IcepackerError(f"Output buffer too small ({out_size} < {result})")
+            ctypes.memmove(out_addr, tmp, result)
+        return result
+
+    def depack_many(self, items: Iterable[BufferLike],
+                    workers: Optional[int] = None,
+                    in_flight: Optional[int] = None) -> Iterator[bytes]:
+        """
+        Decompress many buffers concurrently.
+
+        The library is re-entrant and the GIL is released during the
+        C calls, so buffers are depacked in parallel by a pool of
+        threads.
+
+        Args:
+            items: Iterable of compressed buffers. It is consumed
+                   lazily, as results are consumed.
+            workers: Number of threads (default: number of CPUs).
+            in_flight: Maximum number of buffers submitted but not yet
+                       yielded (default: 2 * workers).
+
+        Returns:
+            Iterator over the depacked data, in input order.
+
+        Raises:
+            IcepackerError: When the result of a failed item is reached.
+                            Remaining items are not processed.
+        """
+        return _map_ordered(self.depack, items, workers, in_flight)
+
+    def pack_many(self, items: Iterable[BufferLike],
+                  workers: Optional[int] = None,
+                  in_flight: Optional[int] = None,
+                  level: Optional[int] = None) -> Iterator[bytes]:
+        """
+        Compress many buffers concurrently (see depack_many()).
+
+        Args:
+            items: Iterable of buffers to compress.
+            workers: Number of threads (default: number of CPUs).
+            in_flight: Maximum number of buffers submitted but not yet
+                       yielded (default: 2 * workers).
+            level: Compression level (see pack()).
+
+        Returns:
+            Iterator over the compressed data, in input order.
+
+        Raises:
+            IcepackerError
+        """
+        return _map_ordered(lambda src: self.pack(src, level=level),
+                            items, workers, in_flight)
+
+    def depack_batch(self, items: Iterable[BufferLike],
+                     threads: int = 0) -> List[bytes]:
+        """
+        Decompress many buffers with a single library call.
+
+        Unlike depack_many() the buffers are all handed to the
+        unice68_depack_batch() C function which shares them among its
+        own threads. This removes the per buffer call overhead, which
+        dominates for small buffers. All the outputs are allocated at
+        once.
+
+        Args:
+            items: Iterable of compressed buffers.
+            threads: Number of threads (0: number of CPUs).
+
+        Returns:
+            List of the depacked data, in input order.
+
+        Raises:
+            IcepackerError: If any buffer fails.
+        """
+        if self._native:
+            return self._native.depack_batch(items, threads)
+        return self._run_batch('unice68_depack_batch', list(items), None, threads)
+
+    def pack_batch(self, items: Iterable[BufferLike],
+                   level: Optional[int] = None, threads: int = 0) -> List[bytes]:
+        """
+        Compress many buffers with a single library call (see depack_batch()).
+
+        Args:
+            items: Iterable of buffers to compress.
+            level: Compression level (see pack()).
+            threads: Number of threads (0: number of CPUs).
+
+        Returns:
+            List of the compressed data, in input order.
+
+        Raises:
+            IcepackerError: If any buffer fails.
+        """
+        if self._native:
+            return self._native.pack_batch(items, level, threads)
+        if level is not None and not MIN_LEVEL <= level <= MAX_LEVEL:
+            raise IcepackerError(f"Invalid compression level {level}")
+        srcs = list(items)
+        sizes = [_pack_bound(memoryview(src).nbytes) for src in srcs]
+        return self._run_batch('unice68_pack_batch', srcs, sizes,
+                               -1 if level is None else level, threads)
+
+    def pack_blocks(self, src: BufferLike, block_size: int = 1 << 20,
+                    level: Optional[int] = None, threads: int = 0) -> bytes:
+        """
+        Compress data into a container of independent ICE blocks.
+
+        The data is cut in blocks of block_size bytes packed with
+        pack_batch(). The container is a small header, the blocks,
+        each a standard ICE stream, and a trailing index of their
+        offsets, sizes and CRC-32 (see IcepackBlocks for random
+        access). Strings do not cross blocks, so it is a little
+        larger than pack().
 
-        if not max_size: max_size = 16 + ( input_len * 9 >> 3 )
-        if max_size <= 0:
-            raise IcepackerError("Invalid maximum size")
+        Args:
+            src: Data to compress (any contiguous buffer).
+            block_size: Raw size of the blocks.
+            level: Compression level (see pack()).
+            threads: Number of threads (0: number of CPUs).
+
+        Returns:
+            The container.
 
-        dst = ctypes.create_string_buffer(max_size)
-        c_src = ctypes.c_void_p(ctypes.cast(src, ctypes.c_void_p).value)
-        result = self.lib.unice68_packer(dst, max_size, c_src, input_len)
+        Raises:
+            IcepackerError: If the arguments are invalid or packing fails.
+        """
+        from .blocks import pack_container
+        return pack_container(self, src, block_size, level, threads)
+
+    def depack_blocks(self, container: BufferLike, threads: int = 0) -> bytes:
+        """
+        Decompress a container made by pack_blocks().
+
+        The blocks are depacked with depack_batch() and their
+        checksums verified.
+
+        Args:
+            container: The container (any contiguous buffer).
+            threads: Number of threads (0: number of CPUs).
+
+        Returns:
+            The depacked data.
+
+        Raises:
+            IcepackerError: If the container is invalid, depacking
+                            fails or a checksum does not match.
+        """
+        from .blocks import depack_container
+        return depack_container(self, container, threads)
+
+    def _run_batch(self, name: str, srcs: List[BufferLike],
+                   sizes: Optional[List[int]], *args: int) -> List[bytes]:
+        """
+        Call a batch function and raise on the first failed item.
+
+        The inputs are concatenated and the outputs sliced from a
+        single buffer, so that only a few ctypes calls are made
+        whatever the number of items. If sizes is None the output
+        sizes are queried with a first call.
+        """
+        if not hasattr(self.lib, 'unice68_depack_batch'):
+            raise IcepackerError("Batch functions are not supported by this library")
+        if not srcs:
+            return []
+
+        with _buffer(b''.join(srcs)) as (addr, total):
+            items = []
+            for src in srcs:
+                size = memoryview(src).nbytes
+                if size > 0x7fffffff:
+                    raise IcepackerError("Input buffer is too large")
+                items.append((addr, size))
+                addr += size
+            if sizes is None:
+                sizes = self._call_batch(name, items, None, *args)
+
+            out = bytearray(sum(sizes))
+            with _buffer(out, writable=True) as (out_addr, _):
+                dsts = []
+                for size in sizes:
+                    dsts.append((out_addr, size))
+                    out_addr += size
+                sizes = self._call_batch(name, items, dsts, *args)
+
+        view, offset, results = memoryview(out), 0, []
+        for item, size in zip(dsts, sizes):
+            results.append(view[offset:offset + size].tobytes())
+            offset += item[1]
+        return results
+
+    def _call_batch(self, name: str, items: List[Tuple[int, int]],
+                    dsts: Optional[List[Tuple[int, int]]], *args: int) -> List[int]:
+        """Call a batch function, return the item sizes."""
+        desc = bytearray(_BATCH.size * len(items))
+        for index, (src, srclen) in enumerate(items):
+            dst, dstcap = dsts[index] if dsts else (0, 0)
+            _BATCH.pack_into(desc, index * _BATCH.size, src, srclen, dst, dstcap, 0)
+        batch = (_BatchItem * len(items)).from_buffer(desc)
+        getattr(self.lib, name)(batch, len(items), *args)
+        del batch
+        sizes = [item[4] for item in _BATCH.iter_unpack(desc)]
+        for index, size in enumerate(sizes):
+            if size < 0:
+                raise IcepackerError(f"{name} failed on item {index} with code {size}")
+        return sizes
+
+    async def depack_async(self, src: BufferLike) -> bytes:
+        """
+        Decompress data without blocking the event loop (see depack()).
+
+        The C call runs on the executor of this Icepacker, unless src
+        is smaller than inline_size. At most async_limit calls run at
+        once for a given event loop, the others wait for their turn.
+        src must not be modified until the call completes.
+
+        Raises:
+            IcepackerError: If decompression fails or input is invalid.
+        """
+        if memoryview(src).nbytes < self.inline_size:
+            return self.depack(src)
+        return await self._run_async(self.depack, src)
+
+    async def pack_async(self, src: BufferLike, max_size: Optional[int] = None,
+                         level: Optional[int] = None) -> bytes:
+        """
+        Compress data without blocking the event loop (see pack()
+        and depack_async()).
+
+        Raises:
+            IcepackerError
+        """
+        if memoryview(src).nbytes < self.inline_size:
+            return self.pack(src, max_size, level)
+        return await self._run_async(self.pack, src, max_size, level)
+
+    def close(self) -> None:
+        """Shut down the executor of the async methods (if any)."""
+        with self._async_lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=True)
+
+    def _reset_async(self) -> None:
+        """Forget the async state (initially or after a fork)."""
+        self._pid = getpid()
+        self._executor = None
+        self._semaphores = None
+        self._async_lock = threading.Lock()
+
+    async def _run_async(self, func: Callable[..., Any], *args: Any) -> Any:
+        """Run func on the executor, bounded by the event loop semaphore."""
+        import asyncio
+        if self._pid != getpid():
+            # Forked: the executor threads only exist in the parent
+            self._reset_async()
+        loop = asyncio.get_running_loop()
+        async with self._semaphore(loop):
+            return await loop.run_in_executor(self._async_executor(), func, *args)
+
+    def _async_executor(self) -> 'concurrent.futures.Executor':
+        """The executor of the async methods, created on first use."""
+        executor = self._executor
+        if executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            with self._async_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.async_workers,
+                        thread_name_prefix=f'{mod_name}-async')
+                executor = self._executor
+        return executor
+
+    def _semaphore(self, loop: 'asyncio.AbstractEventLoop') -> 'asyncio.Semaphore':
+        """The concurrency semaphore of an event loop."""
+        import asyncio
+        from weakref import WeakKeyDictionary
+        with self._async_lock:
+            if self._semaphores is None:
+                self._semaphores = WeakKeyDictionary()
+            semaphore = self._semaphores.get(loop)
+            if semaphore is None:
+                semaphore = self._semaphores[loop] = asyncio.Semaphore(self.async_limit)
+        return semaphore
+
+    def _pack(self, dst: int, max_size: int, src: int, input_len: int,
+              level: Optional[int], threads: int = 1) -> int:
+        """unice68_packer() or unice68_packer_level() with error check."""
+        if not input_len:
+            raise IcepackerError("Input buffer cannot be empty")
+        if level is not None and not MIN_LEVEL <= level <= MAX_LEVEL:
+            raise IcepackerError(f"Invalid compression level {level}")
+        if threads < 0:
+            raise IcepackerError(f"Invalid number of threads {threads}")
+
+        if threads != 1:
+            if not hasattr(self.lib, 'unice68_packer_threads'):
+                raise IcepackerError("Threads are not supported by this library")
+            result = self.lib.unice68_packer_threads(
+                dst, max_size, src, input_len,
+                -1 if level is None else level, threads)
+        elif level is None:
+            result = self.lib.unice68_packer(dst, max_size, src, input_len)
+        elif not hasattr(self.lib, 'unice68_packer_level'):
+            raise IcepackerError("Compression levels are not supported by this library")
+        else:
+            result = self.lib.unice68_packer_level(dst, max_size, src, input_len, level)
         if result < 0:
             raise IcepackerError(f"unice68_packer failed [{result}]")
         elif result > max_size:
             raise IcepackerError(f"unice68_packer overflowed by {result - max_size}")
+        return result
+
+_default = None
+
+def _default_packer() -> Icepacker:
+    """Icepacker shared by the module level functions."""
+    global _default
+    if _default is None:
+        _default = Icepacker()
+    return _default
+
+def depacked_size(buffer: BufferLike) -> Tuple[int, int]:
+    """Get the depacked size of a compressed buffer (see Icepacker.depacked_size())."""
+    return _default_packer().depacked_size(buffer)
+
+def depack(src: BufferLike) -> bytes:
+    """Decompress data (see Icepacker.depack())."""
+    return _default_packer().depack(src)
+
+def depack_into(src: BufferLike, out: BufferLike) -> int:
+    """Decompress data into a caller provided buffer (see Icepacker.depack_into())."""
+    return _default_packer().depack_into(src, out)
+
+def pack(src: BufferLike, max_size: Optional[int] = None,
+         level: Optional[int] = None, threads: int = 1) -> bytes:
+    """Compress data (see Icepacker.pack())."""
+    return _default_packer().pack(src, max_size, level, threads)
+
+def pack_into(src: BufferLike, out: BufferLike,
+              level: Optional[int] = None, threads: int = 1) -> int:
+    """Compress data into a caller provided buffer (see Icepacker.pack_into())."""
+    return _default_packer().pack_into(src, out, level, threads)
+
+def depack_many(items: Iterable[BufferLike], workers: Optional[int] = None,
+                in_flight: Optional[int] = None) -> Iterator[bytes]:
+    """Decompress many buffers concurrently (see Icepacker.depack_many())."""
+    return _default_packer().depack_many(items, workers, in_flight)
+
+def pack_many(items: Iterable[BufferLike], workers: Optional[int] = None,
+              in_flight: Optional[int] = None,
+              level: Optional[int] = None) -> Iterator[bytes]:
+    """Compress many buffers concurrently (see Icepacker.pack_many())."""
+    return _default_packer().pack_many(items, workers, in_flight, level)
+
+def depack_batch(items: Iterable[BufferLike], threads: int = 0) -> List[bytes]:
+    """Decompress many buffers in one library call (see Icepacker.depack_batch())."""
+    return _default_packer().depack_batch(items, threads)
+
+def pack_batch(items: Iterable[BufferLike], level: Optional[int] = None,
+               threads: int = 0) -> List[bytes]:
+    """Compress many buffers in one library call (see Icepacker.pack_batch())."""
+    return _default_packer().pack_batch(items, level, threads)
+
+def pack_blocks(src: BufferLike, block_size: int = 1 << 20,
+                level: Optional[int] = None, threads: int = 0) -> bytes:
+    """Compress data into a container of ICE blocks (see Icepacker.pack_blocks())."""
+    return _default_packer().pack_blocks(src, block_size, level, threads)
+
+def depack_blocks(container: BufferLike, threads: int = 0) -> bytes:
+    """Decompress a container of ICE blocks (see Icepacker.depack_blocks())."""
+    return _default_packer().depack_blocks(container, threads)
+
+async def depack_async(src: BufferLike) -> bytes:
+    """Decompress data without blocking the event loop (see Icepacker.depack_async())."""
+    return await _default_packer().depack_async(src)
 
-        return dst.raw[:result]
+async def pack_async(src: BufferLike, max_size: Optional[int] = None,
+                     level: Optional[int] = None) -> bytes:
+    """Compress data without blocking the event loop (see Icepacker.pack_async())."""
+    return await _default_packer().pack_async(src, max_size, level)
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,173 @@
+# @file     icepacker/index.py
+# @author   Ben G. Han
+# @brief    Random access to packed data with a checkpoint index.
+
+import struct
+import zlib
+from bisect import bisect_left
+from typing import List, Optional, Tuple
+
+from .icepacker import Icepacker, IcepackerError, BufferLike, load_library
+from .icepacker import _buffer, _Checkpoint
+from .stream import _DepackStream, UNICE68_DEPACK_WINDOW
+
+# Default distance between two checkpoints (depacked bytes)
+INDEX_INTERVAL = 1 << 18
+
+# Sidecar: magic, packed size, depacked size, number of checkpoints,
+# CRC-32 of the checkpoints and the windows
+_HEADER = struct.Struct('>4sIIII')
+# Checkpoint: srcpos, dstpos, bits, packed window size
+_ENTRY = struct.Struct('>IIBH')
+_MAGIC = b'ICEx'
+
+class IcepackIndex:
+    """
+    Checkpoints of a packed buffer for random access.
+
+    The depacker works backward, from the end of the output towards
+    its start. A checkpoint records its state at some output position
+    (the packed data position, the bit buffer and a small window of
+    output bytes just above), so depacking can resume from there.
+    read_range() only depacks from the nearest checkpoint above the
+    requested range.
+
+    The index is built with one full depack. It can be saved as a
+    sidecar (to_bytes()) and given back with the packed data later.
+
+    Usage:
+        index = IcepackIndex(packed)
+        sidecar = index.to_bytes()
+        ...
+        header = IcepackIndex(packed, sidecar).read_range(0, 128)
+    """
+
+    def __init__(self, packed: BufferLike, sidecar: Optional[BufferLike] = None,
+                 interval: int = INDEX_INTERVAL, lib_path: Optional[str] = None):
+        """
+        Args:
+            packed: Packed data (any contiguous buffer, e.g. a mmap).
+                    It is kept and must not change.
+            sidecar: Index saved with to_bytes() (default: build it).
+            interval: Depacked bytes between two checkpoints when
+                      building the index (16 KiB minimum).
+            lib_path: Path to the unice68 library (see load_library()).
+
+        Raises:
+            IcepackerError: If the packed data or the sidecar is invalid.
+        """
+        self._ice = Icepacker(lib_path)
+        self._lib = load_library(lib_path)
+        self._packed = packed
+        self._interval = min(interval, INDEX_INTERVAL)
+        with _buffer(packed) as (addr, size):
+            self.depacked_size, self.packed_size = self._ice.depacked_size(packed)
+            if self.packed_size > size:
+                raise IcepackerError("Missing packed data")
+            if sidecar is None:
+                self._checkpoints = self._build(addr, size, interval)
+            else:
+                self._checkpoints = self._load(sidecar)
+        self._positions = [cp.dstpos for cp, _ in self._checkpoints]
+
+    def _build(self, addr: int, size: int,
+               interval: int) -> List[Tuple[_Checkpoint, bytes]]:
+        """Depack the whole buffer and save checkpoints."""
+        checkpoints = []
+        last = self.depacked_size
+        stream = _DepackStream(self._lib, addr, size, self._interval)
+        try:
+            for _ in stream.chunks():
+                saved = stream.save()
+                if saved and last - saved[0].dstpos >= interval:
+                    checkpoints.append(saved)
+                    last = saved[0].dstpos
+        finally:
+            stream.close()
+        checkpoints.reverse()           # ascending positions
+        return checkpoints
+
+    def _load(self, sidecar: BufferLike) -> List[Tuple[_Checkpoint, bytes]]:
+        """Parse a sidecar."""
+        data = memoryview(sidecar).cast('B')
+        try:
+            magic, packed_size, depacked_size, count, crc = _HEADER.unpack_from(data)
+            if magic != _MAGIC:
+                raise IcepackerError("Not an index sidecar")
+            if (packed_size, depacked_size) != (self.packed_size, self.depacked_size):
+                raise IcepackerError("The index does not match the packed data")
+            if zlib.crc32(data[_HEADER.size:]) != crc:
+                raise IcepackerError("Index sidecar is corrupted")
+            pos = _HEADER.size + count * _ENTRY.size
+            checkpoints = []
+            for i in range(count):
+                srcpos, dstpos, bits, size = _ENTRY.unpack_from(
+                    data, _HEADER.size + i * _ENTRY.size)
+                if not (12 <= srcpos < self.packed_size and
+                        0 < dstpos <= self.depacked_size and bits & 255):
+                    raise IcepackerError("Invalid checkpoint in index sidecar")
+                window = self._ice.depack(data[pos:pos + size]) if size else b''
+                if len(window) != min(self.depacked_size - dstpos, UNICE68_DEPACK_WINDOW):
+                    raise IcepackerError("Invalid window in index sidecar")
+                checkpoints.append((_Checkpoint(srcpos, dstpos, bits), window))
+                pos += size
+        except struct.error:
+            raise IcepackerError("Truncated index sidecar") from None
+        if [cp.dstpos for cp, _ in checkpoints] != sorted(cp.dstpos for cp, _ in checkpoints):
+            raise IcepackerError("Invalid index sidecar")
+        return checkpoints
+
+    def to_bytes(self) -> bytes:
+        """
+        Sidecar of the index.
+
+        The windows are packed. The checkpoint positions are stored
+        with the sizes of the packed data so a sidecar is not used
+        with the wrong data, and a CRC-32 of the checkpoints and the
+        windows so a damaged sidecar is rejected.
+        """
+        entries, windows = [], []
+        for cp, window in self._checkpoints:
+            windows.append(self._ice.pack(window) if window else b'')
+            entries.append(_ENTRY.pack(cp.srcpos, cp.dstpos, cp.bits, len(windows[-1])))
+        body = b''.join(entries + windows)
+        return _HEADER.pack(_MAGIC, self.packed_size, self.depacked_size,
+                            len(entries), zlib.crc32(body)) + body
+
+    def read_range(self, offset: int, length: int) -> bytes:
+        """
+        Depack a range of the data.
+
+        Args:
+            offset: Depacked data offset.
+            length: Number of bytes.
+
+        Returns:
+            The depacked bytes [offset, offset+length).
+
+        Raises:
+            IcepackerError: If the range is out of the data or
+                            depacking fails.
+        """
+        end = offset + length
+        if offset < 0 or length < 0 or end > self.depacked_size:
+            raise IcepackerError(f"Invalid range {offset}:{end}")
+        out = bytearray(length)
+        if not length:
+            return bytes(out)
+
+        i = bisect_left(self._positions, end)
+        with _buffer(self._packed) as (addr, size):
+            stream = _DepackStream(self._lib, addr, size, self._interval)
+            try:
+                if i < len(self._checkpoints):
+                    stream.restore(*self._checkpoints[i])
+                for pos, data in stream.chunks():
+                    lo, hi = max(pos, offset), min(pos + len(data), end)
+                    if lo < hi:
+                        out[lo - offset:hi - offset] = data[lo - pos:hi - pos]
+                    if pos <= offset:
+                        break
+            finally:
+                stream.close()
+        return bytes(out)
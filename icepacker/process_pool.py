@@ -0,0 +1,193 @@
+# @file     icepacker/process_pool.py
+# @author   Ben G. Han
+# @brief    Pack and depack buffers with a pool of processes.
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .icepacker import Icepacker, IcepackerError, BufferLike, _pack_bound
+from .icepacker import MIN_LEVEL, MAX_LEVEL
+
+# Inputs of a single round are limited to this many bytes
+SEGMENT_SIZE = 64 << 20
+
+def _shared_memory(name: Optional[str] = None, size: int = 0):
+    """Create (name is None) or attach a shared memory segment."""
+    try:
+        from multiprocessing.shared_memory import SharedMemory
+    except ImportError:
+        raise IcepackerError("Process pools require Python 3.8 or later") from None
+    if name is None:
+        return SharedMemory(create=True, size=max(size, 1))
+    try:
+        # Python >= 3.13: the creator takes care of the segment
+        return SharedMemory(name, track=False)
+    except TypeError:
+        return SharedMemory(name)
+
+# Worker process state (see _worker_init)
+_worker: Optional[Icepacker] = None
+_worker_segments: Dict[str, object] = { }
+
+def _worker_init(lib_path: Optional[str], backend: Optional[str]) -> None:
+    """Bind the library once per worker process."""
+    global _worker
+    _worker = Icepacker(lib_path, backend)
+
+def _worker_segment(name: str, keep: Tuple[str, str]):
+    """Attached segment, segments of previous rounds are closed."""
+    shm = _worker_segments.get(name)
+    if shm is None:
+        for old in [old for old in _worker_segments if old not in keep]:
+            _worker_segments.pop(old).close()
+        shm = _worker_segments[name] = _shared_memory(name)
+    return shm
+
+def _worker_run(task: Tuple[bool, Optional[int], str, str, int, int, int, int]) -> int:
+    """Pack or depack one item from the input to the output segment."""
+    pack, level, in_name, out_name, in_off, in_len, out_off, out_cap = task
+    names = (in_name, out_name)
+    src = _worker_segment(in_name, names).buf[in_off:in_off + in_len]
+    out = _worker_segment(out_name, names).buf[out_off:out_off + out_cap]
+    try:
+        if pack:
+            return _worker.pack_into(src, out, level)
+        return _worker.depack_into(src, out)
+    finally:
+        src.release()
+        out.release()
+
+class IcepackProcessPool:
+    """
+    Pack or depack lists of buffers with a pool of worker processes.
+
+    Each worker binds the library once. Inputs and outputs go through
+    shared memory segments; only offsets and sizes are sent to the
+    workers, so payloads are never pickled.
+
+    Workers are started with the 'forkserver' method (or 'spawn'
+    where it is not available) so they do not inherit the threads
+    and locks of the parent.
+
+    Usage:
+        with IcepackProcessPool() as pool:
+            packed = pool.pack(files, level=MAX_LEVEL)
+    """
+
+    def __init__(self, processes: Optional[int] = None,
+                 lib_path: Optional[str] = None,
+                 backend: Optional[str] = None,
+                 mp_context=None,
+                 segment_size: int = SEGMENT_SIZE):
+        """
+        Start the pool.
+
+        Args:
+            processes: Number of worker processes (default: number of CPUs).
+            lib_path, backend: Library used by the workers (see Icepacker).
+            mp_context: multiprocessing context (default: forkserver or spawn).
+            segment_size: Maximum input bytes per round. Inputs are
+                          copied into shared memory in rounds of about
+                          that size.
+
+        Raises:
+            IcepackerError: If the library cannot be loaded.
+        """
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        self._ice = Icepacker(lib_path, backend)
+        if mp_context is None:
+            methods = multiprocessing.get_all_start_methods()
+            mp_context = multiprocessing.get_context(
+                'forkserver' if 'forkserver' in methods else 'spawn')
+        self.processes = processes or multiprocessing.cpu_count()
+        self.segment_size = segment_size
+        self._pool = ProcessPoolExecutor(
+            self.processes, mp_context=mp_context,
+            initializer=_worker_init, initargs=(lib_path, self._ice.backend))
+
+    def __enter__(self) -> 'IcepackProcessPool':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Stop the worker processes."""
+        self._pool.shutdown(wait=True)
+
+    def pack(self, items: Iterable[BufferLike],
+             level: Optional[int] = None) -> List[bytes]:
+        """
+        Compress buffers (see Icepacker.pack()).
+
+        Returns:
+            List of the compressed data, in input order.
+
+        Raises:
+            IcepackerError: If any buffer fails.
+        """
+        if level is not None and not MIN_LEVEL <= level <= MAX_LEVEL:
+            raise IcepackerError(f"Invalid compression level {level}")
+        return self._run(items, True, level)
+
+    def depack(self, items: Iterable[BufferLike]) -> List[bytes]:
+        """
+        Decompress buffers (see Icepacker.depack()).
+
+        Returns:
+            List of the depacked data, in input order.
+
+        Raises:
+            IcepackerError: If any buffer fails.
+        """
+        return self._run(items, False, None)
+
+    def _run(self, items: Iterable[BufferLike], pack: bool,
+             level: Optional[int]) -> List[bytes]:
+        results = []
+        group, group_size = [], 0
+        for item in items:
+            view = memoryview(item).cast('B')
+            if group and group_size + view.nbytes > self.segment_size:
+                results += self._round(group, pack, level)
+                group, group_size = [], 0
+            group.append(view)
+            group_size += view.nbytes
+        if group:
+            results += self._round(group, pack, level)
+        return results
+
+    def _round(self, views: List[memoryview], pack: bool,
+               level: Optional[int]) -> List[bytes]:
+        """Process items whose inputs fit in one segment."""
+        if pack:
+            sizes = [_pack_bound(view.nbytes) for view in views]
+        else:
+            sizes = [self._ice.depacked_size(view)[0] for view in views]
+
+        src = _shared_memory(size=sum(view.nbytes for view in views))
+        try:
+            dst = _shared_memory(size=sum(sizes))
+            try:
+                tasks, in_off, out_off = [], 0, 0
+                for view, size in zip(views, sizes):
+                    src.buf[in_off:in_off + view.nbytes] = view
+                    tasks.append((pack, level, src.name, dst.name,
+                                  in_off, view.nbytes, out_off, size))
+                    in_off += view.nbytes
+                    out_off += size
+
+                chunksize = max(1, len(tasks) // (4 * self.processes))
+                results = []
+                for task, size in zip(tasks, self._pool.map(_worker_run, tasks,
+                                                            chunksize=chunksize)):
+                    out_off = task[6]
+                    results.append(bytes(dst.buf[out_off:out_off + size]))
+                return results
+            finally:
+                dst.close()
+                dst.unlink()
+        finally:
+            src.close()
+            src.unlink()
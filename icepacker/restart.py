@@ -0,0 +1,126 @@
+# @file     icepacker/restart.py
+# @author   Ben G. Han
+# @brief    Packed data with restart points for multi-threaded depacking.
+
+import ctypes
+import struct
+from typing import Optional, Tuple
+
+from .icepacker import IcepackerError, BufferLike, load_library
+from .icepacker import _buffer, _pack_bound, _Checkpoint
+from .icepacker import MIN_LEVEL, MAX_LEVEL
+
+# Default distance between two restart points (depacked bytes)
+RESTART_INTERVAL = 1 << 18
+
+# Sidecar: magic, packed size, depacked size, number of restart points
+_HEADER = struct.Struct('>4sIII')
+# Restart point: srcpos, dstpos, bits
+_ENTRY = struct.Struct('>IIB')
+_MAGIC = b'ICEr'
+
+def _restart_library(lib_path: Optional[str]) -> ctypes.CDLL:
+    lib = load_library(lib_path)
+    if not hasattr(lib, 'unice68_packer_restart'):
+        raise IcepackerError("Restart points are not supported by this library")
+    return lib
+
+def pack_restart(data: BufferLike, interval: int = RESTART_INTERVAL,
+                 level: Optional[int] = None,
+                 lib_path: Optional[str] = None) -> Tuple[bytes, bytes]:
+    """
+    Compress data with restart points.
+
+    No string crosses a multiple of interval, so the data between two
+    restart points can be depacked on its own (see depack_parallel()).
+    The packed data is a regular ICE stream, depack() and any other
+    ICE depacker accept it. It is a little larger (about 0.2% with the
+    default interval).
+
+    Args:
+        data: Data to compress (any contiguous buffer).
+        interval: Depacked bytes between two restart points.
+        level: Compression level (see Icepacker.pack()).
+        lib_path: Path to the unice68 library (see load_library()).
+
+    Returns:
+        The packed data and the sidecar listing the restart points.
+
+    Raises:
+        IcepackerError: If the arguments are invalid or packing fails.
+    """
+    if level is not None and not MIN_LEVEL <= level <= MAX_LEVEL:
+        raise IcepackerError(f"Invalid compression level {level}")
+    if interval <= 0:
+        raise IcepackerError(f"Invalid restart interval {interval}")
+    lib = _restart_library(lib_path)
+    with _buffer(data) as (addr, size):
+        if not size:
+            raise IcepackerError("Input buffer cannot be empty")
+        count = ctypes.c_int(size // interval)
+        points = (_Checkpoint * max(count.value, 1))()
+        out = ctypes.create_string_buffer(_pack_bound(size))
+        packed_size = lib.unice68_packer_restart(
+            out, len(out), addr, size, -1 if level is None else level,
+            interval, points, ctypes.byref(count))
+    if packed_size < 0:
+        raise IcepackerError("unice68_packer_restart failed")
+
+    sidecar = [_HEADER.pack(_MAGIC, packed_size, size, count.value)]
+    sidecar += [_ENTRY.pack(cp.srcpos, cp.dstpos, cp.bits)
+                for cp in points[:count.value]]
+    return out.raw[:packed_size], b''.join(sidecar)
+
+def _load_sidecar(sidecar: BufferLike, packed_size: int,
+                  depacked_size: int) -> Tuple[ctypes.Array, int]:
+    """Parse a sidecar into an array of restart points."""
+    data = memoryview(sidecar).cast('B')
+    try:
+        magic, csize, dsize, count = _HEADER.unpack_from(data)
+        if magic != _MAGIC:
+            raise IcepackerError("Not a restart point sidecar")
+        if (csize, dsize) != (packed_size, depacked_size):
+            raise IcepackerError("The sidecar does not match the packed data")
+        points = (_Checkpoint * max(count, 1))()
+        for i in range(count):
+            points[i].srcpos, points[i].dstpos, points[i].bits = \
+                _ENTRY.unpack_from(data, _HEADER.size + i * _ENTRY.size)
+    except struct.error:
+        raise IcepackerError("Truncated restart point sidecar") from None
+    return points, count
+
+def depack_parallel(packed: BufferLike, sidecar: Optional[BufferLike] = None,
+                    threads: int = 0, lib_path: Optional[str] = None) -> bytes:
+    """
+    Decompress data packed with pack_restart() on many threads.
+
+    The segments between restart points are shared by a pool of
+    threads of the library (the GIL is released).
+
+    Args:
+        packed: Packed data (any contiguous buffer).
+        sidecar: Restart points returned by pack_restart() (default:
+                 none, depack in a single thread).
+        threads: Number of threads (0: number of CPUs).
+        lib_path: Path to the unice68 library (see load_library()).
+
+    Returns:
+        The depacked data.
+
+    Raises:
+        IcepackerError: If the packed data or the sidecar is invalid.
+    """
+    lib = _restart_library(lib_path)
+    with _buffer(packed) as (addr, size):
+        csize = ctypes.c_int(0)
+        dsize = lib.unice68_depacked_size(addr, ctypes.byref(csize))
+        if dsize < 0:
+            raise IcepackerError("Not ICE packed data")
+        if csize.value > size:
+            raise IcepackerError("Missing packed data")
+        points, count = (None, 0) if sidecar is None else \
+            _load_sidecar(sidecar, csize.value, dsize)
+        out = ctypes.create_string_buffer(max(dsize, 1))
+        if lib.unice68_depack_parallel(out, addr, points, count, threads):
+            raise IcepackerError("unice68_depack_parallel failed")
+    return out.raw[:dsize]
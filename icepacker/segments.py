@@ -0,0 +1,58 @@
+# @file     icepacker/segments.py
+# @author   Ben G. Han
+# @brief    Segment-parallel packing of large buffers.
+
+import ctypes
+from typing import Optional, Tuple
+
+from .icepacker import IcepackerError, BufferLike, load_library
+from .icepacker import _buffer, _pack_bound
+from .icepacker import MIN_LEVEL, MAX_LEVEL
+
+def pack_segments(data: BufferLike, level: Optional[int] = None,
+                  threads: int = 0,
+                  lib_path: Optional[str] = None) -> Tuple[bytes, int]:
+    """
+    Compress a large buffer by parsing segments of it in parallel.
+
+    Segments of 256 KiB are parsed and stored by a pool of threads of
+    the library (the GIL is released). At each seam the parse goes on
+    until it meets the parse of the next segment, which it usually
+    does within a few strings. Otherwise (e.g. in a long sequence of
+    identical bytes) the seam costs one more string, or less than
+    1033 literal bytes. The packed data is a single regular ICE
+    stream.
+
+    Args:
+        data: Data to compress (any contiguous buffer).
+        level: Compression level (see Icepacker.pack()). Optimal
+               parsing levels use a single thread.
+        threads: Number of threads (0: number of CPUs).
+        lib_path: Path to the unice68 library (see load_library()).
+
+    Returns:
+        The packed data and the number of seams where the parses did
+        not meet. When it is 0 the packed data is the same than pack()
+        returns.
+
+    Raises:
+        IcepackerError: If the arguments are invalid or packing fails.
+    """
+    if level is not None and not MIN_LEVEL <= level <= MAX_LEVEL:
+        raise IcepackerError(f"Invalid compression level {level}")
+    if threads < 0:
+        raise IcepackerError(f"Invalid number of threads {threads}")
+    lib = load_library(lib_path)
+    if not hasattr(lib, 'unice68_packer_segments'):
+        raise IcepackerError("Segment packing is not supported by this library")
+    with _buffer(data) as (addr, size):
+        if not size:
+            raise IcepackerError("Input buffer cannot be empty")
+        missed = ctypes.c_int(0)
+        out = ctypes.create_string_buffer(_pack_bound(size))
+        packed_size = lib.unice68_packer_segments(
+            out, len(out), addr, size, -1 if level is None else level,
+            threads, ctypes.byref(missed))
+    if packed_size < 0:
+        raise IcepackerError("unice68_packer_segments failed")
+    return out.raw[:packed_size], missed.value
@@ -0,0 +1,260 @@
+# @file     icepacker/stream.py
+# @author   Ben G. Han
+# @brief    Streaming ice packer and depacker.
+
+import ctypes
+import io
+import mmap
+import os
+import struct
+from typing import BinaryIO, Iterator, Optional, Tuple
+
+from .icepacker import IcepackerError, BufferLike, load_library, _buffer
+from .icepacker import _Checkpoint
+from .icepacker import MIN_LEVEL, MAX_LEVEL
+
+# Size of the reads and writes of the streaming functions
+CHUNK_SIZE = 1 << 18
+
+# Output bytes a depacker checkpoint depends on (see unice68.h)
+UNICE68_DEPACK_WINDOW = 0x1528
+
+class IcepackStreamWriter(io.RawIOBase):
+    """
+    Write-only file object packing its input to a seekable sink.
+
+    The data is packed as it is written with a bounded amount of
+    memory, so inputs of any size (up to 2 GiB) can be packed. The
+    header is written when the writer is closed: the sink is seeked
+    back to where the packed stream started then to its end.
+
+    Up to DEFAULT_LEVEL+1 the packed stream is the same than pack()
+    produces. Optimal parsing levels work on 256 KiB blocks.
+
+    Usage:
+        with open('disk.st.ice', 'wb') as f, IcepackStreamWriter(f) as w:
+            shutil.copyfileobj(src, w)
+    """
+
+    def __init__(self, sink: BinaryIO, level: Optional[int] = None,
+                 lib_path: Optional[str] = None):
+        """
+        Args:
+            sink: Seekable binary file object receiving the packed data.
+            level: Compression level (see Icepacker.pack()).
+            lib_path: Path to the unice68 library (see load_library()).
+
+        Raises:
+            IcepackerError: If the library does not support streaming,
+                            the level is invalid or sink is not seekable.
+        """
+        super().__init__()
+        self._ctx = None
+        self._lib = load_library(lib_path)
+        if not hasattr(self._lib, 'unice68_stream_new'):
+            raise IcepackerError("Streaming is not supported by this library")
+        if level is not None and not MIN_LEVEL <= level <= MAX_LEVEL:
+            raise IcepackerError(f"Invalid compression level {level}")
+        if not sink.seekable():
+            raise IcepackerError("The sink must be seekable")
+        self._sink = sink
+        self._start = sink.tell()
+        self._out = ctypes.create_string_buffer(CHUNK_SIZE)
+        self._ctx = self._lib.unice68_stream_new(-1 if level is None else level)
+        if not self._ctx:
+            raise IcepackerError("unice68_stream_new failed")
+        self.packed_size = None
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: BufferLike) -> int:
+        """Pack data (any contiguous buffer). Returns its length."""
+        if self.closed:
+            raise ValueError("write to closed file")
+        with _buffer(data) as (addr, size):
+            done = 0
+            while done < size:
+                n = self._lib.unice68_stream_feed(
+                    self._ctx, addr + done, min(size - done, CHUNK_SIZE))
+                if n < 0:
+                    raise IcepackerError("unice68_stream_feed failed")
+                done += n
+                self._drain()
+        return size
+
+    def close(self) -> None:
+        """Pack the buffered data and write the header."""
+        if self.closed:
+            return
+        try:
+            if self._ctx:
+                header = ctypes.create_string_buffer(12)
+                size = self._lib.unice68_stream_finish(self._ctx, header)
+                if size < 0:
+                    raise IcepackerError("unice68_stream_finish failed (no input?)")
+                self._drain()
+                end = self._sink.tell()
+                self._sink.seek(self._start)
+                self._sink.write(header.raw)
+                self._sink.seek(end)
+                self.packed_size = size
+        finally:
+            if self._ctx:
+                self._lib.unice68_stream_free(self._ctx)
+                self._ctx = None
+            super().close()
+
+    def _drain(self) -> None:
+        """Write the packed data available to the sink."""
+        while True:
+            n = self._lib.unice68_stream_read(self._ctx, self._out, CHUNK_SIZE)
+            if n <= 0:
+                break
+            self._sink.write(ctypes.string_at(self._out, n))
+
+def pack_stream(src: BinaryIO, sink: BinaryIO, level: Optional[int] = None,
+                chunk_size: int = CHUNK_SIZE) -> int:
+    """
+    Pack a binary file object into another, chunk by chunk.
+
+    Args:
+        src: Binary file object to read until EOF.
+        sink: Seekable binary file object (see IcepackStreamWriter).
+        level: Compression level (see Icepacker.pack()).
+        chunk_size: Size of the reads from src.
+
+    Returns:
+        Packed size.
+
+    Raises:
+        IcepackerError
+    """
+    with IcepackStreamWriter(sink, level) as writer:
+        buf = bytearray(chunk_size)
+        view = memoryview(buf)
+        while True:
+            n = src.readinto(buf)
+            if not n:
+                break
+            writer.write(view[:n])
+        view.release()
+    return writer.packed_size
+
+def _pwrite(f: BinaryIO, data: BufferLike, offset: int) -> None:
+    """Write data at offset in f."""
+    if not hasattr(os, 'pwrite'):
+        f.seek(offset)
+        f.write(data)
+        return
+    view = memoryview(data).cast('B')
+    while view:
+        n = os.pwrite(f.fileno(), view, offset)
+        view, offset = view[n:], offset + n
+
+class _DepackStream:
+    """Streaming depacker (unice68_depack_stream_*) of an exported buffer."""
+
+    def __init__(self, lib: ctypes.CDLL, addr: int, size: int,
+                 chunk_size: Optional[int] = None):
+        if not hasattr(lib, 'unice68_depack_stream_new'):
+            raise IcepackerError("Streaming is not supported by this library")
+        self._lib = lib
+        self._ctx = lib.unice68_depack_stream_new(addr, size)
+        if not self._ctx:
+            raise IcepackerError("Invalid or truncated packed data")
+        if chunk_size:
+            lib.unice68_depack_stream_chunk(self._ctx, chunk_size)
+
+    def close(self) -> None:
+        if self._ctx:
+            self._lib.unice68_depack_stream_free(self._ctx)
+            self._ctx = None
+
+    def chunks(self) -> Iterator[Tuple[int, memoryview]]:
+        """
+        Depack the next chunks.
+
+        Yields:
+            Tuples of (offset, data), offsets descending. The data is
+            only valid until the next chunk.
+        """
+        data, offset = ctypes.c_void_p(), ctypes.c_int()
+        while True:
+            n = self._lib.unice68_depack_stream_read(
+                self._ctx, ctypes.byref(data), ctypes.byref(offset))
+            if n < 0:
+                raise IcepackerError("unice68_depack_stream_read failed (corrupted data)")
+            if not n:
+                break
+            yield offset.value, memoryview((ctypes.c_char * n).from_address(data.value)).cast('B')
+
+    def save(self) -> Optional[Tuple[_Checkpoint, bytes]]:
+        """Checkpoint and window, None when the depacker is done."""
+        cp = _Checkpoint()
+        window = ctypes.create_string_buffer(UNICE68_DEPACK_WINDOW)
+        n = self._lib.unice68_depack_stream_save(self._ctx, ctypes.byref(cp), window)
+        if n < 0:
+            return None
+        return cp, window.raw[:n]
+
+    def restore(self, cp: _Checkpoint, window: bytes) -> None:
+        """Restart from a checkpoint."""
+        if self._lib.unice68_depack_stream_restore(self._ctx, ctypes.byref(cp),
+                                                  window, len(window)):
+            raise IcepackerError("Invalid checkpoint")
+
+def depack_file(src_path: str, dst_path: str,
+                lib_path: Optional[str] = None) -> int:
+    """
+    Depack a packed file into another file.
+
+    The packed file is memory mapped and the output is written chunk
+    by chunk, so the memory used does not depend on the file sizes.
+    The depacker works backward: the destination is preallocated then
+    written from its end towards its start.
+
+    Args:
+        src_path: Packed file path.
+        dst_path: Depacked file path (created or truncated). It is
+                  removed if depacking fails.
+        lib_path: Path to the unice68 library (see load_library()).
+
+    Returns:
+        Depacked size.
+
+    Raises:
+        IcepackerError: If the library does not support streaming or
+                        the packed file is invalid.
+        OSError: If a file can't be read or written.
+    """
+    lib = load_library(lib_path)
+    with open(src_path, 'rb') as src:
+        if os.fstat(src.fileno()).st_size < 12:
+            raise IcepackerError("Invalid packed file")
+        with mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ) as packed, \
+             _buffer(packed) as (addr, size):
+            stream = _DepackStream(lib, addr, size)
+            try:
+                depacked_size, = struct.unpack_from('>I', packed, 8)
+                with open(dst_path, 'wb') as dst:
+                    try:
+                        _preallocate(dst, depacked_size)
+                        for offset, data in stream.chunks():
+                            _pwrite(dst, data, offset)
+                    except BaseException:
+                        dst.close()
+                        os.unlink(dst_path)
+                        raise
+            finally:
+                stream.close()
+    return depacked_size
+
+def _preallocate(f: BinaryIO, size: int) -> None:
+    """Set the size of f and allocate its blocks if possible."""
+    f.truncate(size)
+    if hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(f.fileno(), 0, size)
+        except OSError:
+            pass                # not supported by the file system
@@ -7,15 +7,16 @@ import os
 import platform
 import sys
 import subprocess
-from setuptools import setup, find_packages
+from setuptools import setup, find_packages, Extension
 from setuptools.command.build_py import build_py
 from ctypes import cdll
 from ctypes.util import find_library
 
 modname='icepacker'
 libbase='unice68'
-top_dir = os.path.dirname(__file__)
+top_dir = os.path.dirname(os.path.abspath(__file__))
 lib_dir = os.path.join(top_dir, modname, 'lib')
+config_path = os.path.join(top_dir, modname, '_config.py')
 os.makedirs(lib_dir, exist_ok=True) # setuptools need this
 
 class CustomBuildPy(build_py):
@@ -29,16 +30,37 @@ class CustomBuildPy(build_py):
             # If the library file does not exists, try to build it
             self.build_nativelib()
 
-        if not self.check_library(lib_path):
+        if self.check_library(lib_path):
+            self.write_config(lib_name=lib_name)
+        else:
             # Could not load the compiled (or precompiled), try to
             # find it elsewhere.
             lib_path = find_library(libbase)
             if not lib_path or not self.check_library(lib_path):
                 raise RuntimeError(f"unable to load a suitable '{libbase}' library")
+            self.write_config(lib_path=lib_path)
 
         # Run standard build_py command
         super().run()
 
+    def write_config(self, lib_name: str = None, lib_path: str = None):
+        """Write the build configuration module loaded at runtime."""
+        lines = [
+            f"# @file    {modname}/_config.py",
+            f"# @brief   Generated by setup.py build_py; do not edit.",
+            "",
+            f"# Library filename in {modname}/lib (bundled library)",
+            f"LIB_NAME = {lib_name!r}",
+            "# Library path (system library found at build time)",
+            f"LIB_PATH = {lib_path!r}",
+            "",
+            "# Build flags",
+        ]
+        for var in ( "CC","CFLAGS","LIBNAME" ):
+            lines.append(f"{var} = {os.getenv(var)!r}")
+        with open(config_path, 'w') as out:
+            out.write('\n'.join(lines) + '\n')
+
     def check_library(self, lib_path: str) -> bool:
         """Try to load existing shared library."""
         try:
@@ -116,4 +138,15 @@ class CustomBuildPy(build_py):
 setup(
     # Minimal setup.py as metadata is in pyproject.toml
     cmdclass={"build_py": CustomBuildPy},
+    # Optional native backend; the ctypes binding is used without it.
+    ext_modules=[
+        Extension(f'{modname}._{libbase}',
+                  sources=[f'{modname}/_{libbase}.c',
+                           f'{libbase}/{libbase}_pack.c',
+                           f'{libbase}/{libbase}_unpack.c',
+                           f'{libbase}/{libbase}_batch.c'],
+                  include_dirs=[libbase],
+                  libraries=[] if hasattr(sys, 'winver') else ['pthread'],
+                  optional=True),
+    ],
 )
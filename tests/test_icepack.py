@@ -4,8 +4,44 @@
 # @author  Ben "G" Han
 # @brief   icepacker python module test script.
 
-import unittest, random
+import unittest, random, mmap, array, tempfile, hashlib, ctypes, struct
 from icepacker import Icepacker, IcepackerError
+from icepacker import MIN_LEVEL, DEFAULT_LEVEL, MAX_LEVEL
+import icepacker
+
+def samples(seed, count=8):
+    """Reproducible inputs over alphabets of 2 to 256 symbols."""
+    rng = random.Random(seed)
+    return [bytes(rng.randrange(rng.choice((2, 4, 16, 256)))
+                  for _ in range(rng.randrange(1, 40000))) for _ in range(count)]
+
+def run_samples(seed, count=8):
+    """Reproducible inputs made of runs and repeated pairs of bytes."""
+    rng = random.Random(seed)
+    data = []
+    for _ in range(count):
+        parts = []
+        for _ in range(rng.randrange(1, 40)):
+            size = rng.choice((1, 2, 3, 0x408, 0x409, 0x40a, 0x812, rng.randrange(5000)))
+            parts.append(rng.randbytes(rng.choice((1, 2))) * size)
+            parts.append(rng.randbytes(rng.randrange(4)))
+        data.append(b''.join(parts))
+    return data
+
+def literal_samples(seed, count=8):
+    """Reproducible inputs with literal runs of every count class."""
+    rng = random.Random(seed)
+    data = []
+    for _ in range(count):
+        parts = [rng.randbytes(16)]
+        for _ in range(rng.randrange(1, 12)):
+            parts.append(rng.randbytes(rng.choice((1, 2, 6, 7, 8, 14, 15, 22, 270, 271, 1500, 40000))))
+            parts.append(parts[0][:rng.randrange(2, 16)])
+        data.append(b''.join(parts))
+    return data
+
+def digest(items):
+    return hashlib.sha256(b''.join(hashlib.sha256(item).digest() for item in items)).hexdigest()
 
 class TestIcepack(unittest.TestCase):
     def test_pack_depack(self):
@@ -27,5 +63,519 @@ class TestIcepack(unittest.TestCase):
             decompressed = ice.depack(compressed)
             self.assertEqual(data, decompressed)
 
+    def test_pack_original(self):
+        # Digest of the original packer output (hash-chain search must not change it)
+        ice = Icepacker()
+        data = samples(1)
+        packed = [ice.pack(item) for item in data]
+        self.assertEqual(digest(packed),
+                         '8e130469f831c55b77e9b25d58f43ae38ec763fa8a9b3e9f408405776df2476a')
+        self.assertEqual([ice.depack(item) for item in packed], data)
+
+    def test_pack_optimal(self):
+        ice = Icepacker()
+        data = samples(2)
+        greedy = [ice.pack(item) for item in data]
+        optimal = [ice.pack(item, level=MAX_LEVEL) for item in data]
+        self.assertEqual([ice.depack(item) for item in optimal], data)
+        self.assertLess(sum(map(len, optimal)), sum(map(len, greedy)))
+
+    def test_pack_lazy(self):
+        ice = Icepacker()
+        data = samples(4)
+        greedy = [ice.pack(item) for item in data]
+        lazy = [ice.pack(item, level=DEFAULT_LEVEL+1) for item in data]
+        self.assertEqual([ice.depack(item) for item in lazy], data)
+        self.assertLess(sum(map(len, lazy)), sum(map(len, greedy)))
+
+        # Two bytes lookahead has no level: unice68_packer_ex() parameters
+        lib = icepacker.load_library()
+        params = icepacker.icepacker._Params()
+        self.assertEqual(lib.unice68_params_level(params, DEFAULT_LEVEL+1), 0)
+        self.assertEqual(params.parse, 2)                   # UNICE68_PARSE_LAZY
+        self.assertEqual(lib.unice68_params_level(params, MAX_LEVEL+1), -1)
+        params = icepacker.icepacker._Params(parse=3)       # UNICE68_PARSE_LAZY2
+        lazy2 = []
+        for item in data:
+            out = ctypes.create_string_buffer(len(item) * 2 + 16)
+            size = lib.unice68_packer_ex(out, len(out), item, len(item), params)
+            lazy2.append(out.raw[:size])
+        self.assertEqual([ice.depack(item) for item in lazy2], data)
+        self.assertLess(sum(map(len, lazy2)), sum(map(len, greedy)))
+
+    def test_pack_runs_original(self):
+        # Digest of the original packer output (the run table must not change it)
+        ice = Icepacker()
+        data = run_samples(2)
+        packed = [ice.pack(item) for item in data]
+        self.assertEqual(digest(packed),
+                         '7922a4e509c16a4efbcde17e501bbdc54afce6138808e5c80b05498f8860c560')
+        for level in (MIN_LEVEL, DEFAULT_LEVEL+1, MAX_LEVEL):
+            self.assertEqual([ice.depack(ice.pack(item, level=level)) for item in data], data)
+
+    def test_pack_literals_original(self):
+        # Digest of the original packer output (bulk literals must not change it)
+        ice = Icepacker()
+        data = literal_samples(3)
+        packed = [ice.pack(item) for item in data]
+        self.assertEqual(digest(packed),
+                         '920154319f9fc6dc2d13af85017413dedcdf2d6830ddbb670851988e9b291b7e')
+        self.assertEqual([ice.depack(item) for item in packed], data)
+        out = bytearray(max(map(len, packed)))
+        for item, expected in zip(data, packed):
+            size = ice.pack_into(item, out)
+            self.assertEqual(out[:size], expected)
+
+    def test_pack_levels(self):
+        ice = Icepacker()
+
+        with open(__file__,'rb') as inp:
+            data = inp.read()
+        sizes = [ ]
+        for level in range(MIN_LEVEL, MAX_LEVEL+1):
+            compressed = ice.pack(data, level=level)
+            self.assertEqual(data, ice.depack(compressed))
+            sizes.append(len(compressed))
+        self.assertLess(max(sizes), len(data))
+        self.assertEqual(ice.pack(data), ice.pack(data, level=DEFAULT_LEVEL))
+        self.assertLessEqual(sizes[MAX_LEVEL], sizes[DEFAULT_LEVEL])
+        self.assertRaises(IcepackerError, ice.pack, data, level=MAX_LEVEL+1)
+
+    def test_pack_runs(self):
+        ice = Icepacker()
+
+        data = bytes(0x10000) + random.randbytes(100) + b'\xff' * 0x409 \
+            + b'\x4e\x71' * 0x800 + bytes(0x40a)
+        for level in (MIN_LEVEL, DEFAULT_LEVEL, MAX_LEVEL):
+            compressed = ice.pack(data, level=level)
+            self.assertEqual(data, ice.depack(compressed))
+        self.assertLess(len(ice.pack(data)), 512)
+
+    def test_depack_reference(self):
+        # Digest of the reference decoder results on corrupted streams:
+        # the fast path must fail or succeed with the very same output
+        for backend in self.backends():
+            ice = Icepacker(backend=backend)
+            rng = random.Random(4)
+            results = []
+            for item in samples(4, 64):
+                packed = bytearray(ice.pack(item))
+                for _ in range(rng.randrange(1, 4)):
+                    packed[rng.randrange(12, len(packed))] ^= 1 << rng.randrange(8)
+                try:
+                    results.append(ice.depack(packed))
+                except IcepackerError:
+                    results.append(b'E')
+            self.assertEqual(digest(results),
+                             '05418a06de0974251d8814ea89f7b812360ae1f5932926b0286229451102e65b')
+
+    def test_depack_edges(self):
+        ice = Icepacker()
+        # Outputs around the size of the guard zones of the unchecked loop
+        rng = random.Random(8)
+        for size in list(range(1, 80)) + list(range(1040, 1120)):
+            item = bytes(rng.randrange(4) for _ in range(size))
+            packed = ice.pack(item)
+            out = bytearray(b'\xaa' * (size + 32))
+            with memoryview(out) as view:
+                self.assertEqual(ice.depack_into(packed, view[16:16+size]), size)
+            self.assertEqual(out, b'\xaa' * 16 + item + b'\xaa' * 16)
+
+        # Truncated streams fail or decode the same whatever lies around
+        # the output: strings must not copy bytes from beyond its end
+        for backend in self.backends():
+            ice = Icepacker(backend=backend)
+            for item in samples(8, 16):
+                packed = ice.pack(item)
+                for cut in (1, 2, 5, 17, 64, 65):
+                    if len(packed) - cut <= 12:
+                        continue
+                    truncated = bytearray(packed[:-cut])
+                    struct.pack_into('>I', truncated, 4, len(truncated))
+                    results = []
+                    for fill in (b'\x00', b'\xff'):
+                        out = bytearray(fill * (len(item) + 0x3000))
+                        try:
+                            with memoryview(out) as view:
+                                ice.depack_into(truncated, view[0x1800:0x1800+len(item)])
+                            results.append(out[0x1800:0x1800+len(item)])
+                        except IcepackerError:
+                            results.append(None)
+                        self.assertEqual(out[:0x1800] + out[0x1800+len(item):], fill * 0x3000)
+                    self.assertEqual(results[0], results[1])
+
+    def test_buffer_inputs(self):
+        ice = Icepacker()
+
+        with open(__file__,'rb') as inp:
+            data = inp.read()
+        compressed = ice.pack(data)
+        for src in (bytearray(data), memoryview(data), array.array('B', data)):
+            self.assertEqual(compressed, ice.pack(src))
+        for src in (bytearray(compressed), memoryview(b'xx' + compressed)[2:]):
+            self.assertEqual(ice.depacked_size(src), (len(data), len(compressed)))
+            self.assertEqual(data, ice.depack(src))
+
+        # Packed data inside a larger read-only mapped file
+        with tempfile.TemporaryFile() as tmp:
+            tmp.write(bytes(100) + compressed + bytes(100))
+            tmp.flush()
+            with mmap.mmap(tmp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                with memoryview(mm) as view:
+                    self.assertEqual(data, ice.depack(view[100:]))
+                    self.assertEqual(data, ice.depack(view[100:100+len(compressed)]))
+                    self.assertRaises(IcepackerError, ice.depack, view[100:120])
+
+        self.assertRaises(TypeError, ice.pack, 'not a buffer')
+
+    def test_into(self):
+        ice = Icepacker()
+
+        with open(__file__,'rb') as inp:
+            data = inp.read()
+        compressed = ice.pack(data)
+
+        out = bytearray(len(data) * 2)
+        for level in (None, MAX_LEVEL):
+            size = ice.pack_into(data, out, level=level)
+            self.assertEqual(bytes(out[:size]), ice.pack(data, level=level))
+
+        # Output buffer smaller than the worst case but large enough
+        out = bytearray(len(compressed))
+        self.assertEqual(ice.pack_into(data, out), len(compressed))
+        self.assertEqual(bytes(out), compressed)
+        self.assertRaises(IcepackerError, ice.pack_into, data, out[:-1])
+        for backend in self.backends():
+            small = Icepacker(backend=backend)
+            self.assertEqual(small.pack(data, max_size=len(compressed)), compressed)
+            self.assertRaises(IcepackerError, small.pack, random.randbytes(100000), max_size=100)
+
+        out = bytearray(len(data) + 16)
+        with memoryview(out) as view:
+            self.assertEqual(ice.depack_into(compressed, view[16:]), len(data))
+        self.assertEqual(bytes(out[16:]), data)
+        self.assertRaises(IcepackerError, ice.depack_into, compressed, out[:-17])
+        self.assertRaises(BufferError, ice.depack_into, compressed, bytes(out))
+
+    def test_module_functions(self):
+        ice = Icepacker(backend=icepacker.CTYPES)
+        self.assertIs(ice.lib, Icepacker(backend=icepacker.CTYPES).lib)
+        self.assertIs(ice.lib, icepacker.load_library())
+
+        data = random.randbytes(100) * 10
+        compressed = icepacker.pack(data)
+        self.assertEqual(compressed, Icepacker().pack(data))
+        self.assertEqual(icepacker.depacked_size(compressed), (len(data), len(compressed)))
+        self.assertEqual(data, icepacker.depack(compressed))
+        self.assertRaises(IcepackerError, Icepacker, '/nonexistent/libunice68.so')
+
+    def test_many(self):
+        ice = Icepacker()
+        items = [random.randbytes(random.randrange(1, 2000)) * 4 for _ in range(50)]
+        consumed = []
+        def source():
+            for item in items:
+                consumed.append(item)
+                yield item
+
+        results = ice.pack_many(source(), workers=4, in_flight=3)
+        self.assertEqual(consumed, [])
+        first = next(results)
+        self.assertLessEqual(len(consumed), 3)
+        packed = [first] + list(results)
+        self.assertEqual(packed, [ice.pack(item) for item in items])
+        self.assertEqual(list(icepacker.depack_many(packed, workers=2)), items)
+
+        packed[10] = packed[10][:-1]
+        results = ice.depack_many(packed, workers=2)
+        self.assertEqual([next(results) for _ in range(10)], items[:10])
+        self.assertRaises(IcepackerError, next, results)
+        self.assertRaises(IcepackerError, ice.depack_many, packed, workers=0)
+        self.assertEqual(list(ice.pack_many([])), [])
+
+    def test_batch(self):
+        items = [random.randbytes(random.randrange(1, 300)) * random.randrange(1, 5)
+                 for _ in range(200)]
+        for backend in self.backends():
+            ice = Icepacker(backend=backend)
+            packed = ice.pack_batch(items, threads=4)
+            self.assertEqual(packed, [ice.pack(item) for item in items])
+            self.assertEqual(ice.pack_batch(items, MAX_LEVEL, 3),
+                             [ice.pack(item, level=MAX_LEVEL) for item in items])
+            self.assertEqual(ice.depack_batch(packed), items)
+            self.assertEqual(ice.depack_batch(iter([memoryview(packed[0])])), items[:1])
+            self.assertEqual(ice.depack_batch([]), [])
+
+            bad = packed[:]
+            bad[7] = bad[7][:-1]
+            with self.assertRaisesRegex(IcepackerError, 'item 7 '):
+                ice.depack_batch(bad)
+            self.assertRaises(IcepackerError, ice.pack_batch, [b'x', b''])
+            self.assertRaises(IcepackerError, ice.pack_batch, items, MAX_LEVEL + 1)
+            self.assertRaises(TypeError, ice.depack_batch, [packed[0], 'not a buffer'])
+
+    def test_async(self):
+        import asyncio, time
+
+        class Tracker(Icepacker):
+            active = peak = 0
+            def depack(self, src):
+                Tracker.active += 1
+                Tracker.peak = max(Tracker.peak, Tracker.active)
+                time.sleep(0.01)
+                Tracker.active -= 1
+                return super().depack(src)
+
+        ice = Tracker(async_workers=4, async_limit=2, inline_size=100)
+        small = ice.pack(b'small')
+        data = [random.randbytes(100) * random.randrange(2, 20) for _ in range(10)]
+        packed = [ice.pack(item) for item in data]
+
+        async def main():
+            self.assertEqual(await ice.pack_async(data[0]), packed[0])
+            self.assertEqual(await icepacker.depack_async(packed[0]), data[0])
+            self.assertEqual(await asyncio.gather(*map(ice.depack_async, packed)), data)
+            self.assertEqual(await ice.depack_async(small), b'small')
+            with self.assertRaises(IcepackerError):
+                await ice.depack_async(packed[0][:-1])
+
+        asyncio.run(main())
+        self.assertEqual(Tracker.peak, 2)
+        self.assertIsNotNone(ice._executor)
+        ice.close()
+        self.assertIsNone(ice._executor)
+        asyncio.run(main())         # new loop, new executor
+        ice.close()
+        self.assertRaises(IcepackerError, Icepacker, async_workers=0)
+
+    def test_process_pool(self):
+        items = [random.randbytes(random.randrange(1, 500)) * random.randrange(1, 8)
+                 for _ in range(100)]
+        ice = Icepacker()
+        with icepacker.IcepackProcessPool(2, segment_size=20000) as pool:
+            packed = pool.pack(items, level=MAX_LEVEL)
+            self.assertEqual(packed, [ice.pack(item, level=MAX_LEVEL) for item in items])
+            self.assertEqual(pool.depack(packed), items)
+            self.assertEqual(pool.depack([bytearray(packed[0])]), items[:1])
+            self.assertEqual(pool.pack([]), [])
+            with self.assertRaises(IcepackerError):
+                pool.depack([packed[0], packed[1][:-1]])
+            with self.assertRaises(IcepackerError):
+                pool.pack([b''])
+
+    def test_stream(self):
+        import io
+        ice = Icepacker()
+        data = bytes(random.randrange(4) for _ in range(16000)) * 8 + random.randbytes(5000)
+        for level in (None, MIN_LEVEL, 6, MAX_LEVEL):
+            sink = io.BytesIO(b'prefix')
+            sink.seek(0, io.SEEK_END)
+            with icepacker.IcepackStreamWriter(sink, level) as writer:
+                for i in range(0, len(data), 7777):
+                    writer.write(memoryview(data)[i:i+7777])
+            packed = sink.getvalue()[6:]
+            self.assertEqual(writer.packed_size, len(packed))
+            self.assertEqual(sink.getvalue()[:6], b'prefix')
+            self.assertEqual(ice.depack(packed), data)
+            if level != MAX_LEVEL:
+                self.assertEqual(packed, ice.pack(data, level=level))
+
+        sink = io.BytesIO()
+        self.assertEqual(icepacker.pack_stream(io.BytesIO(data), sink, chunk_size=1000),
+                         len(sink.getvalue()))
+        self.assertEqual(sink.getvalue(), ice.pack(data))
+        with self.assertRaises(IcepackerError):
+            icepacker.pack_stream(io.BytesIO(), io.BytesIO())
+        self.assertRaises(IcepackerError, icepacker.IcepackStreamWriter, io.BytesIO(), MAX_LEVEL + 1)
+
+    def test_depack_file(self):
+        import os
+        ice = Icepacker()
+        data = random.randbytes(40000) + bytes(random.randrange(4) for _ in range(20000)) * 20
+        with tempfile.TemporaryDirectory() as tmp:
+            src, dst = os.path.join(tmp, 'data.ice'), os.path.join(tmp, 'data')
+            for sample in (data[:1000], data):
+                with open(src, 'wb') as f:
+                    f.write(ice.pack(sample))
+                with open(dst, 'wb') as f:
+                    f.write(b'x' * (len(data) + 100))
+                self.assertEqual(icepacker.depack_file(src, dst), len(sample))
+                with open(dst, 'rb') as f:
+                    self.assertEqual(f.read(), sample)
+
+            with open(src, 'r+b') as f:
+                f.truncate(os.path.getsize(src) - 1)
+            self.assertRaises(IcepackerError, icepacker.depack_file, src, dst)
+            with open(src, 'wb') as f:
+                f.write(b'Ice!')
+            self.assertRaises(IcepackerError, icepacker.depack_file, src, dst)
+
+    def test_index(self):
+        ice = Icepacker()
+        data = random.randbytes(30000) + bytes(random.randrange(4) for _ in range(10000)) * 20
+        packed = ice.pack(data)
+        index = icepacker.IcepackIndex(packed, interval=1 << 14)
+        sidecar = index.to_bytes()
+        self.assertGreater(len(index._checkpoints), 5)
+        for idx in (index, icepacker.IcepackIndex(bytearray(packed), sidecar)):
+            self.assertEqual(idx.depacked_size, len(data))
+            self.assertEqual(idx.read_range(0, len(data)), data)
+            self.assertEqual(idx.read_range(len(data), 0), b'')
+            for _ in range(20):
+                offset = random.randrange(len(data))
+                length = random.randrange(min(5000, len(data) - offset))
+                self.assertEqual(idx.read_range(offset, length), data[offset:offset+length])
+            self.assertRaises(IcepackerError, idx.read_range, len(data) - 1, 2)
+
+        self.assertRaises(IcepackerError, icepacker.IcepackIndex, packed, sidecar[:-1])
+        self.assertRaises(IcepackerError, icepacker.IcepackIndex, ice.pack(data[1:]), sidecar)
+
+        # Short windows are rejected by the sidecar parser and by the library
+        bad = icepacker.IcepackIndex(packed, sidecar)
+        bad._checkpoints = [(cp, window[:1]) for cp, window in bad._checkpoints]
+        self.assertRaises(IcepackerError, icepacker.IcepackIndex, packed, bad.to_bytes())
+        self.assertRaises(IcepackerError, bad.read_range, 0, 100)
+        bad = icepacker.IcepackIndex(packed, sidecar)
+        bad._checkpoints[0][0].dstpos = len(data) + 1
+        self.assertRaises(IcepackerError, icepacker.IcepackIndex, packed, bad.to_bytes())
+
+        # A damaged srcpos, bit buffer or window fails the checksum
+        header, entry = struct.calcsize('>4sIIII'), struct.calcsize('>IIBH')
+        for pos in (header + 2 * entry + 3, header + 2 * entry + 8, len(sidecar) - 1):
+            damaged = bytearray(sidecar)
+            damaged[pos] ^= 1
+            self.assertRaises(IcepackerError, icepacker.IcepackIndex, packed, damaged)
+
+    def test_pack_threads(self):
+        data = random.randbytes(100000) + bytes(random.randrange(4) for _ in range(50000)) * 4
+        for backend in self.backends():
+            ice = Icepacker(backend=backend)
+            for level in (None, MIN_LEVEL, 6):
+                packed = ice.pack(data, level=level)
+                for threads in (0, 3):
+                    self.assertEqual(ice.pack(data, level=level, threads=threads), packed)
+                out = bytearray(len(packed))
+                self.assertEqual(ice.pack_into(data, out, level, threads=2), len(packed))
+                self.assertEqual(out, packed)
+            self.assertRaises(IcepackerError, ice.pack, data, threads=-1)
+
+    def test_pack_segments(self):
+        ice = Icepacker()
+        data = random.randbytes(300000) + bytes(random.randrange(4) for _ in range(100000)) * 3
+        for level in (None, MIN_LEVEL, 6):
+            packed, missed = icepacker.pack_segments(data, level, threads=4)
+            self.assertEqual(ice.depack(packed), data)
+            self.assertGreaterEqual(missed, 0)
+            if not missed:
+                self.assertEqual(packed, ice.pack(data, level=level))
+        # Parses never meet in a long sequence of identical bytes
+        packed, missed = icepacker.pack_segments(bytes(600000))
+        self.assertEqual(ice.depack(packed), bytes(600000))
+        self.assertGreater(missed, 0)
+        self.assertRaises(IcepackerError, icepacker.pack_segments, data, threads=-1)
+        self.assertRaises(IcepackerError, icepacker.pack_segments, b'')
+
+    def test_restart(self):
+        ice = Icepacker()
+        data = random.randbytes(30000) + bytes(random.randrange(4) for _ in range(10000)) * 20
+        for level in (None, MIN_LEVEL, 6, MAX_LEVEL):
+            packed, sidecar = icepacker.pack_restart(data, 1 << 14, level)
+            self.assertEqual(ice.depack(packed), data)
+            self.assertEqual(icepacker.depack_parallel(packed, sidecar, threads=4), data)
+        self.assertEqual(icepacker.depack_parallel(packed), data)
+
+        self.assertRaises(IcepackerError, icepacker.depack_parallel, packed, sidecar[:-1])
+        self.assertRaises(IcepackerError, icepacker.depack_parallel, ice.pack(data), sidecar)
+        self.assertRaises(IcepackerError, icepacker.pack_restart, data, 0)
+        self.assertRaises(IcepackerError, icepacker.pack_restart, b'')
+
+    def test_blocks(self):
+        data = random.randbytes(30000) + bytes(random.randrange(4) for _ in range(10000)) * 20
+        for backend in self.backends():
+            ice = Icepacker(backend=backend)
+            container = ice.pack_blocks(data, 1 << 14, threads=4)
+            self.assertEqual(ice.depack_blocks(container, threads=4), data)
+            blocks = icepacker.IcepackBlocks(container)
+            self.assertEqual(len(blocks), (len(data) + (1 << 14) - 1) >> 14)
+            self.assertEqual(blocks.depacked_size, len(data))
+            self.assertEqual(ice.depack(blocks.packed_block(3)), data[3 << 14:4 << 14])
+            self.assertEqual(blocks.read_range(10000, 50000), data[10000:60000])
+            self.assertEqual(blocks.read_range(len(data), 0), b'')
+        self.assertEqual(icepacker.depack_blocks(icepacker.pack_blocks(b'')), b'')
+
+        broken = bytearray(container)
+        broken[8 + 12] ^= 1         # first packed byte of block 0
+        self.assertRaises(IcepackerError, ice.depack_blocks, broken)
+        self.assertRaises(IcepackerError, ice.depack_blocks, container[:-1])
+        self.assertRaises(IcepackerError, blocks.read_range, 0, len(data) + 1)
+        self.assertRaises(IcepackerError, ice.pack_blocks, data, 0)
+
+    def test_bundle(self):
+        replays = [random.randbytes(1500) for _ in range(3)]
+        files = {f'{i % 5}/{i}.sndh': random.choice(replays) + random.randbytes(random.randrange(500))
+                 for i in range(300)}
+        files['empty'] = b''
+        bundle = icepacker.pack_bundle(files, block_size=1 << 14)
+        self.assertLess(len(bundle), sum(len(icepacker.pack(data)) for data in files.values() if data))
+        with tempfile.NamedTemporaryFile() as tmp:
+            tmp.write(bundle)
+            tmp.flush()
+            with icepacker.IcepackBundle(tmp.name, cache_blocks=2) as reader:
+                self.assertEqual(sorted(reader), sorted(files))
+                for name in random.sample(list(files), len(files)):
+                    self.assertEqual(reader.read(name), files[name])
+                self.assertRaises(KeyError, reader.read, 'missing')
+        self.assertEqual(len(icepacker.IcepackBundle(icepacker.pack_bundle({}))), 0)
+
+        self.assertRaises(IcepackerError, icepacker.IcepackBundle, icepacker.pack_blocks(b'x' * 100))
+        self.assertRaises(IcepackerError, icepacker.pack_bundle, [('a', b'x'), ('a', b'y')])
+        self.assertRaises(IcepackerError, icepacker.pack_bundle, {'a' * 0x10000: b'x'})
+
+    def backends(self):
+        if icepacker.icepacker._unice68 is None:
+            return [icepacker.CTYPES]
+        return [icepacker.CTYPES, icepacker.NATIVE]
+
+    def test_pack_invalid_level(self):
+        data = b'invalid level' * 10
+        for backend in self.backends():
+            ice = Icepacker(backend=backend)
+            for level in (-1, MIN_LEVEL - 1, MAX_LEVEL + 1):
+                self.assertRaises(IcepackerError, ice.pack, data, level=level)
+                self.assertRaises(IcepackerError, ice.pack_into, data, bytearray(1000), level=level)
+                self.assertRaises(IcepackerError, ice.pack_batch, [data], level=level)
+            self.assertEqual(ice.pack(data, level=None), ice.pack(data, level=DEFAULT_LEVEL))
+
+    @unittest.skipIf(icepacker.icepacker._unice68 is None, "native extension not built")
+    def test_backends(self):
+        native = Icepacker(backend=icepacker.NATIVE)
+        ice = Icepacker(backend=icepacker.CTYPES)
+        self.assertEqual(Icepacker().backend, icepacker.NATIVE)
+        self.assertRaises(IcepackerError, Icepacker, 'libunice68.so', icepacker.NATIVE)
+        self.assertRaises(IcepackerError, Icepacker, None, 'foo')
+
+        data = random.randbytes(500) * 20
+        for level in (None, MIN_LEVEL, MAX_LEVEL):
+            compressed = native.pack(data, level=level)
+            self.assertEqual(compressed, ice.pack(data, level=level))
+            self.assertEqual(native.depacked_size(compressed), ice.depacked_size(compressed))
+            self.assertEqual(data, native.depack(memoryview(compressed)))
+
+        out = bytearray(len(data))
+        self.assertEqual(native.depack_into(compressed, out), len(data))
+        self.assertEqual(out, data)
+        size = native.pack_into(data, out)
+        self.assertEqual(out[:size], ice.pack(data))
+        self.assertRaises(IcepackerError, native.pack_into, data, bytearray(10))
+        self.assertRaises(IcepackerError, native.depack_into, compressed, bytearray(10))
+
+        for fn in (native.pack, ice.pack):
+            self.assertRaises(IcepackerError, fn, b'')
+            self.assertRaises(IcepackerError, fn, data, None, MAX_LEVEL + 1)
+        for fn in (native.depack, ice.depack):
+            self.assertRaises(IcepackerError, fn, b'Ice!')
+            self.assertRaises(IcepackerError, fn, compressed[:-1])
+            self.assertRaises(TypeError, fn, 'not a buffer')
+
 if __name__ == "__main__":
     unittest.main()
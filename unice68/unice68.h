@@ -90,6 +90,8 @@ UNICE68_API
  * @retval 0     succcess
  * @retval -1    failure
  *
+ * @note   On failure the content of dst is undefined.
+ *
  * @warning The original ICE depacker may allow to use the same buffer for
  *          compressed and uncompressed data. Anyway this has not been tested
  *          and you are encouraged to add guard bands.
@@ -113,6 +115,512 @@ UNICE68_API
  */
 int unice68_packer(void * dst, int max, const void * src, int len);
 
+/**
+ *  Packer match finder engines.
+ */
+enum {
+  UNICE68_ENGINE_CHAIN = 0,   /**< Hash-chain match finder (default). */
+  UNICE68_ENGINE_SCAN  = 1    /**< Original forward window scan.      */
+};
+
+/**
+ *  Packer parsing modes.
+ */
+enum {
+  UNICE68_PARSE_GREEDY  = 0,  /**< Longest string first (original).   */
+  UNICE68_PARSE_OPTIMAL = 1,  /**< Minimal bit cost ("ultra"), slow.   */
+  UNICE68_PARSE_LAZY    = 2,  /**< Greedy with one byte lookahead.     */
+  UNICE68_PARSE_LAZY2   = 3   /**< Greedy with two bytes lookahead.    */
+};
+
+/**
+ *  Packer parameters.
+ *
+ *    A zero-filled structure gives the default parameters which
+ *    produce the very same output than the original packer.
+ */
+typedef struct {
+  int engine;   /**< Match finder engine (UNICE68_ENGINE_*).          */
+  int depth;    /**< Max hash-chain links visited per search (0:inf). */
+  int parse;    /**< Parsing mode (UNICE68_PARSE_*).                  */
+  int window;   /**< Forward search window size (0:0x1580).           */
+  int threads;  /**< Match search threads (0,1:none, <0:CPUs).        */
+  int segments; /**< Parse segments in parallel (0:no).               */
+} unice68_params_t;
+
+/**
+ *  Compression levels.
+ */
+enum {
+  UNICE68_LEVEL_MIN     = 0,  /**< Fastest (short window, shallow search). */
+  UNICE68_LEVEL_DEFAULT = 5,  /**< Original packer output.                 */
+  UNICE68_LEVEL_MAX     = 9   /**< Best compression (optimal parsing).     */
+};
+
+UNICE68_API
+/**
+ *  Fill packer parameters for a given compression level.
+ *
+ *    Levels below UNICE68_LEVEL_DEFAULT are the original greedy
+ *    parse with a shorter window or a shallower search. A deeper
+ *    search finds longer strings, which are not always cheaper to
+ *    store, so levels are ordered by speed and typical ratio but not
+ *    strictly by ratio: on some inputs (e.g. random data over a few
+ *    symbols) a lower greedy level is a few percent smaller.
+ *
+ * @param  params  parameters to fill.
+ * @param  level   compression level [UNICE68_LEVEL_MIN..UNICE68_LEVEL_MAX].
+ *
+ * @return error code
+ * @retval 0     succcess
+ * @retval -1    invalid level
+ */
+int unice68_params_level(unice68_params_t * params, int level);
+
+UNICE68_API
+/**
+ *  Pack a buffer with ice packer using custom parameters.
+ *
+ * @param  dst     output (destination) buffer (compressed data).
+ * @param  max     output buffer size.
+ * @param  src     input  (source)      buffer (uncompressed data).
+ * @param  len     input buffer length.
+ * @param  params  packer parameters (0 for default).
+ *
+ * @return packed size
+ * @retval -1    failure
+ *
+ * @see unice68_packer()
+ */
+int unice68_packer_ex(void * dst, int max, const void * src, int len,
+                      const unice68_params_t * params);
+
+UNICE68_API
+/**
+ *  Pack a buffer with ice packer at a given compression level.
+ *
+ * @param  dst    output (destination) buffer (compressed data).
+ * @param  max    output buffer size.
+ * @param  src    input  (source)      buffer (uncompressed data).
+ * @param  len    input buffer length.
+ * @param  level  compression level [UNICE68_LEVEL_MIN..UNICE68_LEVEL_MAX].
+ *
+ * @return packed size
+ * @retval -1    failure
+ *
+ * @see unice68_params_level()
+ */
+int unice68_packer_level(void * dst, int max, const void * src, int len,
+                         int level);
+
+UNICE68_API
+/**
+ *  Pack a buffer at a given compression level on many threads.
+ *
+ *    Threads search the strings of the input ahead of the packer.
+ *    The output is the same than unice68_packer_level(). Optimal
+ *    parsing levels (above UNICE68_LEVEL_DEFAULT+1) do not use
+ *    threads.
+ *
+ * @param  dst      output (destination) buffer (compressed data).
+ * @param  max      output buffer size.
+ * @param  src      input  (source)      buffer (uncompressed data).
+ * @param  len      input buffer length.
+ * @param  level    compression level (<0: UNICE68_LEVEL_DEFAULT).
+ * @param  threads  number of threads (0: number of CPUs).
+ *
+ * @return packed size
+ * @retval -1    failure
+ */
+int unice68_packer_threads(void * dst, int max, const void * src, int len,
+                           int level, int threads);
+
+UNICE68_API
+/**
+ *  Pack a large buffer by parsing segments of it in parallel.
+ *
+ *    Segments of the input are parsed and stored by threads. At each
+ *    seam the parse goes on until it meets the parse of the next
+ *    segment, which usually happens within a few strings, so the
+ *    output is mostly the same than unice68_packer_level(). Where
+ *    they do not meet, the seam costs one more string (or less than
+ *    0x409 literal bytes). The result is a single regular ICE
+ *    stream. Optimal parsing levels (above UNICE68_LEVEL_DEFAULT+1)
+ *    do not use threads.
+ *
+ * @param  dst      output (destination) buffer (compressed data).
+ * @param  max      output buffer size.
+ * @param  src      input  (source)      buffer (uncompressed data).
+ * @param  len      input buffer length.
+ * @param  level    compression level (<0: UNICE68_LEVEL_DEFAULT).
+ * @param  threads  number of threads (0: number of CPUs).
+ * @param  missed   receives the number of seams where the parses did
+ *                  not meet (0: the output is the same than
+ *                  unice68_packer_level()), may be 0.
+ *
+ * @return packed size
+ * @retval -1    failure
+ */
+int unice68_packer_segments(void * dst, int max, const void * src, int len,
+                            int level, int threads, int * missed);
+
+/**
+ *  Worst case packed size of len bytes.
+ *
+ *    An output buffer of this size can not overflow.
+ */
+#define UNICE68_PACK_BOUND(len) (16 + (len) + ((len) >> 3))
+
+/**
+ *  Largest input length accepted by the batch packer.
+ */
+#define UNICE68_PACK_MAX 0x70000000
+
+/**
+ *  Batch item error codes.
+ */
+enum {
+  UNICE68_ERR_FORMAT    = -1, /**< Not an ICE! buffer or invalid input. */
+  UNICE68_ERR_TRUNCATED = -2, /**< Input shorter than its header says.  */
+  UNICE68_ERR_OVERFLOW  = -3, /**< Output buffer too small.             */
+  UNICE68_ERR_DATA      = -4, /**< Packer or depacker failure.          */
+  UNICE68_ERR_MEMORY    = -5  /**< Memory allocation failure.           */
+};
+
+/**
+ *  Batch item descriptor.
+ */
+typedef struct {
+  const void * src;   /**< input buffer.                                */
+  int srclen;         /**< input buffer length.                         */
+  void * dst;         /**< output buffer (0: query the output size).    */
+  int dstcap;         /**< output buffer size.                          */
+  int size;           /**< [out] output size or UNICE68_ERR_* code.     */
+} unice68_batch_t;
+
+UNICE68_API
+/**
+ *  Depack many ICE buffers.
+ *
+ *    The items are shared by a pool of threads that lives for the
+ *    duration of the call. Each item size is set to the depacked
+ *    size on success or to a negative error code. Items with a null
+ *    dst are only checked, their size is set to the depacked size.
+ *
+ * @param  items    items to depack.
+ * @param  count    number of items.
+ * @param  threads  number of threads (0: number of CPUs).
+ *
+ * @return number of failed items
+ * @retval -1    invalid arguments
+ */
+int unice68_depack_batch(unice68_batch_t * items, int count, int threads);
+
+UNICE68_API
+/**
+ *  Pack many buffers.
+ *
+ *    Like unice68_depack_batch(). Items with a null dst get the
+ *    UNICE68_PACK_BOUND() size. Output buffers smaller than this
+ *    bound are safe, the item fails with UNICE68_ERR_OVERFLOW if the
+ *    packed data does not fit.
+ *
+ * @param  items    items to pack.
+ * @param  count    number of items.
+ * @param  level    compression level (<0: unice68_packer() default).
+ * @param  threads  number of threads (0: number of CPUs).
+ *
+ * @return number of failed items
+ * @retval -1    invalid arguments
+ */
+int unice68_pack_batch(unice68_batch_t * items, int count, int level,
+                       int threads);
+
+UNICE68_API
+/**
+ *  Run jobs on a pool of threads.
+ *
+ *    job(ctx,i) is called once for each i in [0..count) by a pool of
+ *    threads that lives for the duration of the call (see
+ *    unice68_depack_batch()). The calling thread works too.
+ *
+ * @param  count    number of jobs.
+ * @param  job      job function, returns a negative value on failure.
+ * @param  ctx      job context.
+ * @param  threads  number of threads (0: number of CPUs).
+ *
+ * @return number of failed jobs
+ * @retval -1    invalid arguments
+ */
+int unice68_parallel(int count, int (*job)(void * ctx, int i), void * ctx,
+                     int threads);
+
+/**
+ *  Streaming packer context.
+ */
+typedef struct unice68_stream_s unice68_stream_t;
+
+UNICE68_API
+/**
+ *  Create a streaming packer.
+ *
+ *    The streaming packer uses a fixed amount of memory (a few
+ *    hundred KiB) whatever the input size. Levels up to
+ *    UNICE68_LEVEL_DEFAULT+1 produce the same stream than
+ *    unice68_packer_level(). Optimal parsing levels work on blocks
+ *    of 256 KiB so the result might differ (but not by much) for
+ *    larger inputs.
+ *
+ * @param  level  compression level (<0: UNICE68_LEVEL_DEFAULT).
+ *
+ * @return streaming packer context
+ * @retval 0  invalid level or memory allocation failure
+ */
+unice68_stream_t * unice68_stream_new(int level);
+
+UNICE68_API
+/**
+ *  Feed input data to a streaming packer.
+ *
+ *    The data is buffered and packed as far as possible. The whole
+ *    output produced must be taken with unice68_stream_read() before
+ *    the next call; otherwise no input is consumed.
+ *
+ * @param  S    streaming packer context.
+ * @param  src  input data.
+ * @param  len  input data length.
+ *
+ * @return number of input bytes consumed (may be less than len)
+ * @retval -1  failure
+ */
+int unice68_stream_feed(unice68_stream_t * S, const void * src, int len);
+
+UNICE68_API
+/**
+ *  Take packed data out of a streaming packer.
+ *
+ *    The first 12 bytes of the packed stream are a placeholder for
+ *    the header returned by unice68_stream_finish().
+ *
+ * @param  S    streaming packer context.
+ * @param  dst  output buffer.
+ * @param  max  output buffer size.
+ *
+ * @return number of bytes copied into dst (0 when there is none)
+ */
+int unice68_stream_read(unice68_stream_t * S, void * dst, int max);
+
+UNICE68_API
+/**
+ *  Terminate the packed stream.
+ *
+ *    Packs the buffered input. The remaining output must then be
+ *    taken with unice68_stream_read() and the 12 header bytes written
+ *    over the placeholder at the start of the packed stream.
+ *
+ * @param  S       streaming packer context.
+ * @param  header  receives the 12 bytes of the final header.
+ *
+ * @return packed size (header included)
+ * @retval -1  failure (e.g. no input, output not read)
+ */
+int unice68_stream_finish(unice68_stream_t * S, void * header);
+
+UNICE68_API
+/**
+ *  Free a streaming packer.
+ *
+ * @param  S  streaming packer context (may be 0).
+ */
+void unice68_stream_free(unice68_stream_t * S);
+
+/**
+ *  Streaming depacker context.
+ */
+typedef struct unice68_depack_stream_s unice68_depack_stream_t;
+
+UNICE68_API
+/**
+ *  Create a streaming depacker.
+ *
+ *    The streaming depacker decodes into a window buffer of a few
+ *    hundred KiB whatever the depacked size. The packed data must
+ *    stay available (e.g. memory mapped) until the context is freed.
+ *
+ * @param  src     packed data (ICE! header included).
+ * @param  srclen  packed data length.
+ *
+ * @return streaming depacker context
+ * @retval 0  invalid header, truncated data or memory allocation failure
+ */
+unice68_depack_stream_t * unice68_depack_stream_new(const void * src,
+                                                    int srclen);
+
+UNICE68_API
+/**
+ *  Depack the next chunk of output.
+ *
+ *    The depacker works backward: the chunks come from the end of
+ *    the output towards its start, each one just below the previous
+ *    one. The chunk data is valid until the next call.
+ *
+ * @param  S       streaming depacker context.
+ * @param  data    receives the chunk address.
+ * @param  offset  receives the chunk offset in the depacked data.
+ *
+ * @return chunk size
+ * @retval 0                 the whole output has been depacked
+ * @retval UNICE68_ERR_DATA  corrupted packed data
+ */
+int unice68_depack_stream_read(unice68_depack_stream_t * S,
+                               const void ** data, int * offset);
+
+UNICE68_API
+/**
+ *  Set the output size decoded by each unice68_depack_stream_read().
+ *
+ *    Smaller chunks give closer checkpoints. The size is clamped to
+ *    [16 KiB..256 KiB], 256 KiB being the default.
+ *
+ * @param  S     streaming depacker context.
+ * @param  size  chunk size.
+ *
+ * @return chunk size used
+ */
+int unice68_depack_stream_chunk(unice68_depack_stream_t * S, int size);
+
+/**
+ *  Bytes above the current output position a string can copy from.
+ */
+#define UNICE68_DEPACK_WINDOW 0x1528
+
+/**
+ *  Streaming depacker checkpoint.
+ */
+typedef struct {
+  int srcpos;   /**< packed data position (a5 offset).       */
+  int dstpos;   /**< depacked data position (a6 offset).     */
+  int bits;     /**< bit buffer (d7 low byte).               */
+} unice68_checkpoint_t;
+
+UNICE68_API
+/**
+ *  Save the state of a streaming depacker.
+ *
+ *    The state between two unice68_depack_stream_read() calls is a
+ *    checkpoint and the window of output bytes just above its
+ *    dstpos (up to UNICE68_DEPACK_WINDOW bytes).
+ *
+ * @param  S       streaming depacker context.
+ * @param  cp      receives the checkpoint.
+ * @param  window  receives the window (UNICE68_DEPACK_WINDOW bytes).
+ *
+ * @return window size
+ * @retval -1  the depacker is done or has failed
+ */
+int unice68_depack_stream_save(unice68_depack_stream_t * S,
+                               unice68_checkpoint_t * cp, void * window);
+
+UNICE68_API
+/**
+ *  Restart a streaming depacker from a checkpoint.
+ *
+ *    The next unice68_depack_stream_read() continues below
+ *    cp->dstpos as the depacker the checkpoint was saved from did.
+ *    The context must have been created for the same packed data.
+ *
+ * @param  S       streaming depacker context.
+ * @param  cp      checkpoint.
+ * @param  window  window saved with the checkpoint.
+ * @param  len     window size (as returned by unice68_depack_stream_save()).
+ *
+ * @return error code
+ * @retval 0   success
+ * @retval -1  invalid checkpoint or window size
+ */
+int unice68_depack_stream_restore(unice68_depack_stream_t * S,
+                                  const unice68_checkpoint_t * cp,
+                                  const void * window, int len);
+
+UNICE68_API
+/**
+ *  Free a streaming depacker.
+ *
+ * @param  S  streaming depacker context (may be 0).
+ */
+void unice68_depack_stream_free(unice68_depack_stream_t * S);
+
+UNICE68_API
+/**
+ *  Pack a buffer with restart points.
+ *
+ *    A restart point is recorded at the first string starting at or
+ *    above each multiple of interval, and no string copies bytes
+ *    from above the next multiple. The output between two restart
+ *    points can then be depacked on its own (see
+ *    unice68_depack_parallel()). The packed data is a regular ICE
+ *    stream that any depacker accepts.
+ *
+ *    The points are in ascending dstpos order. There is at most one
+ *    point per interval.
+ *
+ * @param  dst       output (destination) buffer (compressed data).
+ * @param  max       output buffer size.
+ * @param  src       input  (source)      buffer (uncompressed data).
+ * @param  len       input buffer length.
+ * @param  level     compression level (<0: UNICE68_LEVEL_DEFAULT).
+ * @param  interval  depacked bytes between two restart points.
+ * @param  points    receives the restart points.
+ * @param  count     [in] points capacity (len/interval is enough),
+ *                   [out] number of restart points.
+ *
+ * @return packed size
+ * @retval -1    failure
+ */
+int unice68_packer_restart(void * dst, int max, const void * src, int len,
+                           int level, int interval,
+                           unice68_checkpoint_t * points, int * count);
+
+UNICE68_API
+/**
+ *  Depack the output between two restart points.
+ *
+ * @param  dst     output buffer (the whole depacked size).
+ * @param  src     packed data.
+ * @param  top     restart point above the segment (0: end of data).
+ * @param  bottom  depacked data position of the restart point below
+ *                 the segment (0: start of data).
+ *
+ * @return error code
+ * @retval 0   success
+ * @retval -1  failure
+ *
+ * @see unice68_packer_restart()
+ */
+int unice68_depack_segment(void * dst, const void * src,
+                           const unice68_checkpoint_t * top, int bottom);
+
+UNICE68_API
+/**
+ *  Depack a buffer packed with restart points on many threads.
+ *
+ *    The count restart points split the output in count+1 segments
+ *    shared by a pool of threads (see unice68_depack_batch()).
+ *
+ * @param  dst      output buffer (the whole depacked size).
+ * @param  src      packed data.
+ * @param  points   restart points (see unice68_packer_restart()).
+ * @param  count    number of restart points.
+ * @param  threads  number of threads (0: number of CPUs).
+ *
+ * @return error code
+ * @retval 0   success
+ * @retval -1  failure
+ */
+int unice68_depack_parallel(void * dst, const void * src,
+                            const unice68_checkpoint_t * points, int count,
+                            int threads);
+
 /**
  * @}
  */
@@ -0,0 +1,323 @@
+/*
+ * @file    unice68_batch.c
+ * @brief   Ice packer/depacker batch processing
+ * @author  https://github.com/benjihan
+ *
+ * Copyright (c) 1998-2024 Benjamin Gerard
+ *
+ * This program is free software: you can redistribute it and/or
+ * modify it under the terms of the GNU General Public License as
+ * published by the Free Software Foundation, either version 3 of the
+ * License, or (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful, but
+ * WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ * General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.
+ *
+ * If not, see <http://www.gnu.org/licenses/>.
+ *
+ */
+
+/* Items are shared by a small pool of threads created for the
+ * duration of a batch call. The calling thread works too. Each
+ * thread takes the next unprocessed item with an atomic increment
+ * so the cost of an item does not matter.
+ *
+ * Define UNICE68_NO_THREADS to process batches in the calling thread
+ * only.
+ */
+
+#include "unice68.h"
+#include <stdlib.h>
+#include <string.h>
+
+#if defined(UNICE68_NO_THREADS)
+# define MAX_THREADS 1
+#elif defined(_WIN32)
+# define WIN32_LEAN_AND_MEAN
+# include <windows.h>
+# define MAX_THREADS 64
+#else
+# include <pthread.h>
+# include <unistd.h>
+# define MAX_THREADS 64
+#endif
+
+#if defined(_WIN32) && !defined(UNICE68_NO_THREADS)
+typedef volatile LONG counter_t;
+#else
+typedef volatile long counter_t;
+#endif
+
+typedef struct batch_s batch_t;
+struct batch_s {
+  int count;                            /* number of items         */
+  int (*process)(batch_t *, int);       /* <0 if the item failed   */
+  counter_t next;                       /* next item to process    */
+  counter_t fails;                      /* number of failed items  */
+
+  /* unice68_depack_batch(), unice68_pack_batch() */
+  unice68_batch_t * items;              /* items to process        */
+  int level;                            /* packer level (<0 def)   */
+
+  /* unice68_depack_parallel() */
+  void * dst;                           /* depacked data           */
+  const void * src;                     /* packed data             */
+  const unice68_checkpoint_t * points;  /* restart points          */
+
+  /* unice68_parallel() */
+  int (*job)(void *, int);              /* job function            */
+  void * ctx;                           /* job context             */
+};
+
+/* Atomic post-increment */
+static int fetch_inc(counter_t * counter)
+{
+#if defined(UNICE68_NO_THREADS)
+  return (int) (*counter)++;
+#elif defined(_WIN32)
+  return (int) InterlockedIncrement(counter) - 1;
+#else
+  return (int) __sync_fetch_and_add(counter, 1);
+#endif
+}
+
+static int depack_item(batch_t * B, int i)
+{
+  unice68_batch_t * const it = B->items + i;
+  int csize = 0, dsize;
+
+  if (!it->src || it->srclen < 12)
+    return it->size = UNICE68_ERR_TRUNCATED;
+  dsize = unice68_depacked_size(it->src, &csize);
+  if (dsize <= 0)
+    it->size = UNICE68_ERR_FORMAT;
+  else if (csize > it->srclen)
+    it->size = UNICE68_ERR_TRUNCATED;
+  else if (!it->dst)
+    it->size = dsize;                   /* size query only */
+  else if (dsize > it->dstcap)
+    it->size = UNICE68_ERR_OVERFLOW;
+  else if (unice68_depacker(it->dst, it->src))
+    it->size = UNICE68_ERR_DATA;
+  else
+    it->size = dsize;
+  return it->size;
+}
+
+static int pack_item(batch_t * B, int i)
+{
+  unice68_batch_t * const it = B->items + i;
+  void * tmp = 0, * dst = it->dst;
+  int bound, size;
+
+  if (!it->src || it->srclen <= 0 || it->srclen > UNICE68_PACK_MAX)
+    return it->size = UNICE68_ERR_FORMAT;
+  bound = UNICE68_PACK_BOUND(it->srclen);
+  if (!dst)
+    return it->size = bound;            /* size query only */
+
+  /* The packer does not check the output size */
+  if (it->dstcap < bound) {
+    dst = tmp = malloc(bound);
+    if (!tmp)
+      return it->size = UNICE68_ERR_MEMORY;
+  }
+
+  if (B->level < 0)
+    size = unice68_packer(dst, bound, it->src, it->srclen);
+  else
+    size = unice68_packer_level(dst, bound, it->src, it->srclen, B->level);
+
+  if (size < 0)
+    size = UNICE68_ERR_DATA;
+  else if (size > it->dstcap)
+    size = UNICE68_ERR_OVERFLOW;
+  else if (tmp)
+    memcpy(it->dst, tmp, size);
+  free(tmp);
+  return it->size = size;
+}
+
+/* Segment i is between restart points i-1 and i (from the bottom) */
+static int segment_item(batch_t * B, int i)
+{
+  const int last = B->count - 1;
+  return unice68_depack_segment(B->dst, B->src,
+                                i < last ? B->points + i : 0,
+                                i > 0 ? B->points[i-1].dstpos : 0);
+}
+
+static int job_item(batch_t * B, int i)
+{
+  return B->job(B->ctx, i);
+}
+
+static void run_batch(batch_t * B)
+{
+  int i;
+  while (i = fetch_inc(&B->next), i < B->count)
+    if (B->process(B, i) < 0)
+      fetch_inc(&B->fails);
+}
+
+#if MAX_THREADS > 1
+
+# ifdef _WIN32
+
+typedef HANDLE thread_t;
+
+static DWORD WINAPI thread_main(LPVOID B)
+{
+  run_batch(B);
+  return 0;
+}
+
+static int thread_start(thread_t * t, batch_t * B)
+{
+  *t = CreateThread(0, 0, thread_main, B, 0, 0);
+  return *t ? 0 : -1;
+}
+
+static void thread_join(thread_t t)
+{
+  WaitForSingleObject(t, INFINITE);
+  CloseHandle(t);
+}
+
+static int cpu_count(void)
+{
+  SYSTEM_INFO info;
+  GetSystemInfo(&info);
+  return (int) info.dwNumberOfProcessors;
+}
+
+# else
+
+typedef pthread_t thread_t;
+
+static void * thread_main(void * B)
+{
+  run_batch(B);
+  return 0;
+}
+
+static int thread_start(thread_t * t, batch_t * B)
+{
+  return pthread_create(t, 0, thread_main, B) ? -1 : 0;
+}
+
+static void thread_join(thread_t t)
+{
+  pthread_join(t, 0);
+}
+
+static int cpu_count(void)
+{
+  return (int) sysconf(_SC_NPROCESSORS_ONLN);
+}
+
+# endif
+
+#endif /* MAX_THREADS > 1 */
+
+static int batch(batch_t * B, int threads)
+{
+  B->next = B->fails = 0;
+
+#if MAX_THREADS > 1
+  if (threads <= 0)
+    threads = cpu_count();
+  if (threads > B->count)
+    threads = B->count;
+  if (threads > MAX_THREADS)
+    threads = MAX_THREADS;
+
+  if (threads > 1) {
+    thread_t tid[MAX_THREADS];
+    int n;
+
+    /* Failing to start a thread is not an error, there are just
+     * less threads to share the work. */
+    for (n = 0; n < threads-1 && !thread_start(tid+n, B); ++n)
+      ;
+    run_batch(B);
+    while (n)
+      thread_join(tid[--n]);
+  } else
+#endif
+    run_batch(B);
+
+  return (int) B->fails;
+}
+
+int unice68_depack_batch(unice68_batch_t * items, int count, int threads)
+{
+  batch_t B;
+
+  if (count < 0 || (count && !items))
+    return -1;
+  memset(&B, 0, sizeof(B));
+  B.items = items;
+  B.count = count;
+  B.level = -1;
+  B.process = depack_item;
+  return batch(&B, threads);
+}
+
+int unice68_pack_batch(unice68_batch_t * items, int count, int level,
+                       int threads)
+{
+  batch_t B;
+
+  if (count < 0 || (count && !items))
+    return -1;
+  if (level >= 0 && (level < UNICE68_LEVEL_MIN || level > UNICE68_LEVEL_MAX))
+    return -1;
+  memset(&B, 0, sizeof(B));
+  B.items = items;
+  B.count = count;
+  B.level = level;
+  B.process = pack_item;
+  return batch(&B, threads);
+}
+
+int unice68_depack_parallel(void * dst, const void * src,
+                            const unice68_checkpoint_t * points, int count,
+                            int threads)
+{
+  batch_t B;
+  int i;
+
+  if (!dst || !src || count < 0 || (count && !points))
+    return -1;
+  for (i = 1; i < count; ++i)
+    if (points[i].dstpos <= points[i-1].dstpos)
+      return -1;
+  memset(&B, 0, sizeof(B));
+  B.count = count + 1;
+  B.process = segment_item;
+  B.dst = dst;
+  B.src = src;
+  B.points = points;
+  return batch(&B, threads) ? -1 : 0;
+}
+
+int unice68_parallel(int count, int (*job)(void * ctx, int i), void * ctx,
+                     int threads)
+{
+  batch_t B;
+
+  if (count < 0 || !job)
+    return -1;
+  memset(&B, 0, sizeof(B));
+  B.count = count;
+  B.process = job_item;
+  B.job = job;
+  B.ctx = ctx;
+  return batch(&B, threads);
+}
@@ -24,19 +24,62 @@
 
 #include "unice68.h"
 #include <stdint.h>
+#include <stdlib.h>
+#include <string.h>
+#include <limits.h>
 #include <assert.h>
 
 typedef uint8_t * areg_t;
 typedef     int   dreg_t;
 
+/* String search result at a position (see threaded_crunch) */
+typedef struct {
+  uint16_t len;               /* string length (1:none, 0:not searched) */
+  uint16_t off;               /* string offset */
+} match_t;
+
 typedef struct {
   areg_t a0,a1,a2,a3,a4,a5,a6,ax;
   dreg_t d0,d1,d2,d3,d4,d5,d6,d7;
   areg_t srcbuf,srcend,dstbuf,dstend;
   int srclen, dstlen, dstmax;
   int error, optimize, maxlength, maxgleich, maxoffset;
+
+  /* Hash-chain match finder */
+  int *last;                  /* last position inserted for a key */
+  int *link;                  /* next position with the same key */
+  int mask;                   /* link[] ring buffer mask */
+  int ins;                    /* next position to insert */
+  int depth;                  /* max chain links per search (0:inf) */
+  int parse;                  /* parsing mode (UNICE68_PARSE_*) */
+
+  /* Run-length table */
+  uint16_t *run;              /* identical bytes starting at each position */
+
+  /* Lazy parsing (searched positions after a0) */
+  int lz_have, lz_len[3], lz_off[3], lz_gain[3];
+
+  /* Streaming (see unice68_stream_*) */
+  areg_t stop;                /* crunch pauses at this position (0:never) */
+  int stream;                 /* header is not patched by ice_finish */
+  int flushed;                /* output bytes already taken out of dst */
+
+  /* Restart points (see unice68_packer_restart) */
+  int interval;               /* distance between restart points (0:none) */
+  int next_restart;           /* next restart point at or above this */
+  unice68_checkpoint_t *points;
+  int npoints, maxpoints;
+
+  /* String search results (see threaded_crunch) */
+  const match_t *matches;     /* results from position mstart (0:none) */
+  int mstart, mend;           /* positions with results */
+
+  /* Segment-parallel parsing (see segment_crunch) */
+  int missed;                 /* seams where the parses did not meet */
 } all_regs_t;
 
+#define CHAIN_KEYS 0x10000
+
 #define ICE_MAGIC 0x49636521 /* 'Ice!' */
 
 #define EQ(A,B) ((A) == (B))
@@ -67,10 +110,32 @@ typedef struct {
 #define DBGE(A,B,REG,LABEL) DB_CC( GE(A,B), REG, LABEL )
 
 
+/* make_normal_bytes: literal count classes and bit fields */
+static const int t1a[7] = { 0, 1, 2, 5, 8, 15, 270 };
+static const int tib[7][2] = {
+  { 0x01,0x01 }, { 0x01, 0x02 }, { 0x02, 0x04 }, { 0x02, 0x06 },
+  { 0x03,0x09 }, { 0x08, 0x11 }, { 0x0f, 0x20 }
+};
+
+/* make_offset_mehr: offset classes and bit fields */
+static const int16_t table3[6] = {
+  0x0000,0x0020,0x0120,
+  0x0606,0x0908,0x0C0D
+};
+
+/* make_stringlength: length classes and bit fields */
+static const int ta[5] = { 0x2, 0x3, 0x4, 0x6, 0xa };
+static const int tb[5] = { 0x1, 0x1, 0x2, 0x3, 0xa };
+
 static void longword_store(all_regs_t *R);
 static void put_bits(all_regs_t * R);
 static void make_stringlength(all_regs_t * R);
 static void make_normal_bytes(all_regs_t * R);
+static void make_offset_2(all_regs_t * R);
+static void make_offset_mehr(all_regs_t * R);
+static void gleich_search(all_regs_t * R);
+static void string_search(all_regs_t * R);
+static int ice_finish(all_regs_t * R);
 
 /* Store d7.l
  */
@@ -87,22 +152,29 @@ static void longword_store(all_regs_t *R)
  * d1[d4+1] bit field
  * d7:      bit acu
  * d6:      free bit in d7 minus 1
+ *
+ *   The bits are merged at once in a 64-bit accumulator and complete
+ *   bytes are flushed right away so that they are still interleaved
+ *   with the literal bytes exactly as the original bit loop does.
  */
 static void put_bits(all_regs_t *R)
 {
+  const int n = R->d4 + 1;
+  int cnt = 7 - R->d6;                  /* bits already in d7 */
+  uint64_t acc;
+
   assert(R->d7 >= 0 && R->d7 < 0x100);
   assert(R->d4 >= 0 && R->d4 < 32);
 
-  do {
-    R->d7 |= (R->d1 & 1) << 8;
-    R->d1 >>= 1;
-    R->d7 >>= 1;
-    if (--R->d6 < 0) {
-      *R->a1++ = R->d7;
-      R->d7 = 0;
-      R->d6 = 7;
-    }
-  } while (--R->d4 >= 0);
+  acc  = (uint64_t) R->d7 >> (8 - cnt);
+  acc |= ((uint32_t) R->d1 & (((uint64_t) 1 << n) - 1)) << cnt;
+  for (cnt += n; cnt >= 8; cnt -= 8) {
+    *R->a1++ = acc;
+    acc >>= 8;
+  }
+  R->d7 = (acc << (8 - cnt)) & 0xff;
+  R->d6 = 7 - cnt;
+  R->d4 = -1;
 }
 
 
@@ -131,10 +203,6 @@ put:
 
 static void make_offset_mehr(all_regs_t * R)
 {
-  static const int16_t table3[6] = {
-    0x0000,0x0020,0x0120,
-    0x0606,0x0908,0x0C0D
-  };
   /* moveq        #2,d3 */
   R->d3 = 2;
 look_on:
@@ -158,7 +226,7 @@ look_on:
   /* moveq   #-1,d1 */
   /* lsl.w   d3,d1 */
   /* or.w    d0,d1 */
-  R->d1 = (-1 << R->d3) | R->d0;
+  R->d1 = (int) ((unsigned) -1 << R->d3) | R->d0;
   /* andi.w  #$f,d4 */
   R->d4 &= 0xf;
   /* bra     put_bits */
@@ -167,8 +235,6 @@ look_on:
 
 static void make_stringlength(all_regs_t *R)
 {
-  static const int ta[5] = { 0x2, 0x3, 0x4, 0x6, 0xa };
-  static const int tb[5] = { 0x1, 0x1, 0x2, 0x3, 0xa };
   int i, d4, d0;
 
   assert(R->maxlength >= 2);
@@ -179,81 +245,20 @@ static void make_stringlength(all_regs_t *R)
   assert ( i >= 0 );
   assert ( i <  5 );
   d4 = tb[i];
-  R->d1 = (-1 << d4) | d0;
+  R->d1 = (int) ((unsigned) -1 << d4) | d0;
   R->d4 = d4 + i - 1;
   put_bits(R);
 }
 
-static int ice_crunch(all_regs_t *R)
-{
-  R->a0 = R->srcbuf;
-  R->d0 = R->srclen;
-
-mainloop:
-
-/***********************************************************************
- * 1. Sequence of identical bytes are looking for pay
- */
-
-  /* lea        $409(a0),a4 */
-  R->a4 = R->a0 + 0x409;            /* a4 = End of the search range */
-  /* cmpa.l     src_ende,a4 */
-  /* ble.s      gleich_ok */
-  BLE ( R->srcend, R->a4, gleich_ok);
-  /* movea.l    src_ende,a4 */
-  R->a4 = R->srcend;
-
-gleich_ok:
-/* a0 : search start
- * a3 : search current
- * a4 : search end
- */
-
-  /* move.l     a0,a3 */
-  R->a3 = R->a0;              /* a3 = Beginning of the search range */
-  /* move.b     (a3)+,d0 */
-  R->d0 = *R->a3++;                     /* current byte */
-
-  /* while ( R->d0 == *R->a3++ && R->a3 < R->a4) */
-  /*   ; */
-
-gleich_compare:
-  /* cmp.b      (a3)+,d0 */
-  /* bne.s      gleich_ende */
-  BNE( *R->a3++, R->d0, gleich_ende );
-  /* cmpa.l     a4,a3 */
-  /* blt.s      gleich_compare */
-  BLT ( R->a4, R->a3, gleich_compare );
-gleich_ende:
-
-  /* move.l     a3,d1 */
-  /* sub.l      a0,d1 */
-  /* subq.l     #2,d1 */
-  /* move.l     d1,maxgleich */
-  R->maxgleich = R->d1 = R->a3 - R->a0 - 2;
-
-  /* cmp.l      #$409,d1 */
-  /* beq        gleich_ablegen */
-  BEQ (0x409, R->d1, gleich_ablegen);
-
-
-/*************************************************************
- * 2. Search string with the greatest possible length and a small offset
+/* Search the longest string at a0 by scanning the whole forward
+ * window (original algorithm).
+ *
+ * a0 : search start
+ * a3 : search end
+ * d4 : best string length found (1 if none)
  */
-
-  /* move.l     a0,a3 */
-  /* adda.l     optimize(pc),a3 */
-  R->a3 = R->a0 + R->optimize;
-  /* cmpa.l     src_ende,a3 */
-  /* ble.s      offset_ende */
-  BLE ( R->srcend, R->a3, offset_ende );
-  /* movea.l    src_ende,a3 */
-  R->a3 = R->srcend;
-
-offset_ende:
-  /* if (R->a3 > R->srcend) */
-  /*   R->a3 = R->srcend; */
-
+static void scan_string(all_regs_t *R)
+{
   /* moveq      #1,d4 */
   R->d4 = 1;
   /* lea        2(a0),a4 */
@@ -357,6 +362,314 @@ string_lohnt_nicht:
   BGT ( R->a4, R->a3, weiter_mit_string );
 
 string_suche_fertig:
+  return;
+}
+
+/* Insert positions entering the window in the hash-chain.
+ *
+ * pos : current position (positions below are dead)
+ * lim : insert positions up to lim (excluded)
+ */
+static void chain_insert(all_regs_t *R, int pos, int lim)
+{
+  const areg_t s = R->srcbuf;
+  const int mask = R->mask;
+  int q;
+
+  /* Positions below pos were never searched, they are dead already */
+  for (q = R->ins > pos ? R->ins : pos; q < lim; ++q) {
+    const int k = ( s[q] << 8 ) | s[q+1];
+    const int t = R->last[k];
+    R->link[q & mask] = -1;
+    if (t >= pos)
+      R->link[t & mask] = q;
+    R->last[k] = q;
+  }
+  if (q > R->ins)
+    R->ins = q;
+}
+
+/* Search the longest string at a0 by walking the hash-chain.
+ *
+ *   Candidates are the positions sharing the two first bytes of a0
+ *   visited in increasing order, which is the very same order the
+ *   window scan uses. Without a depth limit the result is identical.
+ *
+ * a0 : search start
+ * a3 : search end
+ * d4 : best string length found (1 if none)
+ */
+static void chain_string(all_regs_t *R)
+{
+  const areg_t s = R->srcbuf, a0 = R->a0;
+  const int pos = a0 - s;
+  const int lim = R->a3 - s - 1;        /* string end limit */
+  const int mask = R->mask;
+  int p, d4 = 1, cnt = R->depth > 0 ? R->depth : INT_MAX;
+
+  if (lim <= pos) {
+    R->d4 = 1;                          /* no room (restart point) */
+    return;
+  }
+  chain_insert(R, pos, lim);
+  for (p = R->link[pos & mask]; p >= 0 && p < lim - d4;
+       p = R->link[p & mask]) {
+    const int d = p - pos;
+    int len, max;
+
+    if (--cnt < 0)
+      break;                            /* chain too deep */
+    if (d <= d4)
+      continue;                         /* not enough room */
+    if (d4 >= 2 && d - 0x408 > 0x111f)
+      break;                            /* offsets are too large */
+    if (a0[d4] != s[p+d4])
+      continue;                         /* can't beat d4 */
+
+    max = lim - p;
+    if (max > d) max = d;
+    if (max > 0x409) max = 0x409;
+    len = 0;
+    if (R->run) {
+      /* Both start with a sequence of the same byte */
+      len = R->run[pos] < R->run[p] ? R->run[pos] : R->run[p];
+      if (len > max) len = max;
+    }
+    for (; len < max && a0[len] == s[p+len]; ++len)
+      ;
+    if (len <= d4 || (len > 2 && d - len + 1 > 0x111f))
+      continue;
+
+    R->maxlength = d4 = len;
+    R->maxoffset = d - len + 1;
+    if (d4 == 0x409)
+      break;
+  }
+  R->d4 = d4;
+}
+
+/* Store remaining bytes and terminate the packed stream.
+ */
+static int ice_finish(all_regs_t *R)
+{
+  /* still_packing: */
+  /* cmp.l      src_ende,a0 */
+  /* bge.s      all_packed */
+  /* move.b     (a0)+,(a1)+ */
+  /* addq.l     #1,d5 */
+  /* bra.s      still_packing */
+
+  /* Copied by make_normal_bytes */
+  if (R->a0 < R->srcend) {
+    R->d5 += R->srcend - R->a0;
+    R->a0 = R->srcend;
+  }
+
+  /* all_packed: */
+  /* bsr        make_normal_bytes */
+  make_normal_bytes(R);
+  /* bset       d6,d7 */
+  /* move.b     d7,(a1)+ */
+
+  /* fprintf(stdout,"%04x %02x (%s:%d) /all_packed\n", */
+  /*         R->a1 - R->dstbuf, */
+  /*         R->d7 | (1 << R->d6), */
+  /*         __FUNCTION__ , __LINE__); */
+  *R->a1++ = R->d7 |= (1 << R->d6);
+  /* sub.l   packed_data(pc),a1 */
+  /* move.l  a1,d0 */
+  /* move.l  d0,d7 */
+  R->d7 = R->d0 = R->a1 - R->dstbuf + R->flushed;
+  if (R->stream)
+    return R->d0;                       /* header written by the caller */
+  /* move.l  packed_data,a1 */
+  /* addq.l  #4,a1 */
+  /* bsr     longword_store */
+  R->a1 = R->dstbuf + 4;
+  longword_store(R);
+  /* rts */
+  return R->d0;
+}
+
+/* End of the data a string at a0 may copy from: the end of the input
+ * or the next restart interval boundary (see unice68_packer_restart).
+ */
+static areg_t search_end(all_regs_t *R)
+{
+  if (R->interval) {
+    const int lim = ((R->a0 - R->srcbuf) / R->interval + 1) * R->interval;
+    if (lim < R->srcend - R->srcbuf)
+      return R->srcbuf + lim;
+  }
+  return R->srcend;
+}
+
+/* Record a restart point if the string at a0 is the first one at or
+ * above the next restart interval boundary. Literal bytes before a0
+ * must be stored already: the depacker resumes right before their
+ * count.
+ */
+static void restart_point(all_regs_t *R)
+{
+  const int pos = R->a0 - R->srcbuf;
+  unice68_checkpoint_t * cp;
+
+  if (!R->interval || pos < R->next_restart)
+    return;
+  if (R->npoints >= R->maxpoints) {
+    R->error = -1;
+    return;
+  }
+  cp = R->points + R->npoints++;
+  cp->srcpos = R->a1 - R->dstbuf + R->flushed;
+  cp->dstpos = pos;
+  cp->bits   = R->d7 | (1 << R->d6);
+  R->next_restart = (pos / R->interval + 1) * R->interval;
+}
+
+/***********************************************************************
+ * 1. Sequence of identical bytes are looking for pay
+ */
+
+/* Count identical bytes starting at each source position of [lo,hi)
+ * in a single backward pass, as if the input ended at hi. Counts are
+ * capped to the longest sequence the search can store.
+ */
+static void run_table(all_regs_t *R, int lo, int hi)
+{
+  uint16_t * const run = R->run;
+  int i = hi;
+
+  if (--i < lo)
+    return;
+  run[i] = 1;
+  while (--i >= lo)
+    run[i] = R->srcbuf[i] != R->srcbuf[i+1] ? 1 :
+      run[i+1] - (run[i+1] == 0x409) + 1;
+}
+
+/* Search sequence of identical bytes at a0.
+ *
+ * maxgleich : length of the sequence minus one
+ */
+static void gleich_search(all_regs_t *R)
+{
+  const areg_t end = search_end(R);
+
+  if (R->run) {
+    /* Same as the compare loop below */
+    int lim = end - R->a0 < 0x409 ? end - R->a0 : 0x409;
+    int len = R->run[R->a0 - R->srcbuf];
+    if (len > lim - 1)
+      len = lim - 1;
+    R->maxgleich = R->d1 = len - 1;
+    return;
+  }
+
+  /* lea        $409(a0),a4 */
+  R->a4 = R->a0 + 0x409;            /* a4 = End of the search range */
+  /* cmpa.l     src_ende,a4 */
+  /* ble.s      gleich_ok */
+  BLE ( end, R->a4, gleich_ok);
+  /* movea.l    src_ende,a4 */
+  R->a4 = end;
+
+gleich_ok:
+/* a0 : search start
+ * a3 : search current
+ * a4 : search end
+ */
+
+  /* move.l     a0,a3 */
+  R->a3 = R->a0;              /* a3 = Beginning of the search range */
+  /* move.b     (a3)+,d0 */
+  R->d0 = *R->a3++;                     /* current byte */
+
+  /* while ( R->d0 == *R->a3++ && R->a3 < R->a4) */
+  /*   ; */
+
+gleich_compare:
+  /* cmp.b      (a3)+,d0 */
+  /* bne.s      gleich_ende */
+  BNE( *R->a3++, R->d0, gleich_ende );
+  /* cmpa.l     a4,a3 */
+  /* blt.s      gleich_compare */
+  BLT ( R->a4, R->a3, gleich_compare );
+gleich_ende:
+
+  /* move.l     a3,d1 */
+  /* sub.l      a0,d1 */
+  /* subq.l     #2,d1 */
+  /* move.l     d1,maxgleich */
+  R->maxgleich = R->d1 = R->a3 - R->a0 - 2;
+}
+
+/*************************************************************
+ * 2. Search string with the greatest possible length and a small offset
+ */
+
+/* Search string with the greatest possible length at a0.
+ *
+ * d4 : best string length found (1 if none)
+ */
+static void string_search(all_regs_t *R)
+{
+  const areg_t end = search_end(R);
+
+  /* move.l     a0,a3 */
+  /* adda.l     optimize(pc),a3 */
+  R->a3 = R->a0 + R->optimize;
+  /* cmpa.l     src_ende,a3 */
+  /* ble.s      offset_ende */
+  BLE ( end, R->a3, offset_ende );
+  /* movea.l    src_ende,a3 */
+  R->a3 = end;
+
+offset_ende:
+  /* if (R->a3 > R->srcend) */
+  /*   R->a3 = R->srcend; */
+
+  if (R->link)
+    chain_string(R);
+  else
+    scan_string(R);
+}
+
+/* Search string at a0, or take the result found by a thread.
+ */
+static void string_find(all_regs_t *R)
+{
+  const int pos = R->a0 - R->srcbuf;
+
+  if (R->matches && pos >= R->mstart && pos < R->mend) {
+    const match_t * const m = R->matches + pos - R->mstart;
+    if (m->len) {
+      R->d4 = m->len;
+      if (m->len > 1) {
+        R->maxlength = m->len;
+        R->maxoffset = m->off;
+      }
+      return;
+    }
+  }
+  string_search(R);
+}
+
+static int ice_crunch(all_regs_t *R)
+{
+mainloop:
+  if (R->stop && R->a0 >= R->stop)
+    return 0;                           /* wait for more input */
+
+  gleich_search(R);
+
+  /* cmp.l      #$409,d1 */
+  /* beq        gleich_ablegen */
+  BEQ (0x409, R->d1, gleich_ablegen);
+
+  string_find(R);
+
+/* string_suche_fertig: */
   /* move.l     maxgleich,d0 */
   R->d0 = R->maxgleich;
   /* cmp.w      #1,d0 */
@@ -386,11 +699,8 @@ nogleich:
 ein_byte_ablegen:
   /* move.b     (a0)+,(a1)+ */
 
-  /* fprintf(stdout,"%04x %02x (%s:%d) / ein_byte_ablegen\n", */
-  /*         R->a1 - R->dstbuf, */
-  /*         *R->a0, */
-  /*         __FUNCTION__, __LINE__); */
-  *R->a1++ = *R->a0++;
+  /* Copied by make_normal_bytes */
+  R->a0++;
   /* addq.l     #1,d5 */
   R->d5++;
   /* bra.s      kein_byte_ablegen */
@@ -417,6 +727,7 @@ zwei_byte_ablegen:
   /* cmpi.w     #$23f,d0 */
   /* bhi        ein_byte_ablegen */
   BHI( 0x23f, R->d0, ein_byte_ablegen );
+  restart_point(R);
   /* bsr        make_offset_2 */
   make_offset_2(R);
   /* bra.s      drop_length */
@@ -425,6 +736,7 @@ zwei_byte_ablegen:
 mehr_bytes_ablegen:
   /* bsr        make_normal_bytes */
   make_normal_bytes(R);
+  restart_point(R);
   /* bsr        make_offset_mehr */
   make_offset_mehr(R);
 
@@ -446,53 +758,853 @@ kein_byte_ablegen:
   if ( ( R->d0 = R->srcend - R->a0 - 3 ) >= 0 )
     goto mainloop;
 
-still_packing:
-  /* cmp.l      src_ende,a0 */
-  /* bge.s      all_packed */
-  BGE ( R->srcend, R->a0, all_packed );
-  /* move.b     (a0)+,(a1)+ */
-  /* fprintf(stdout,"%04x %02x (%s:%d) / still_packing\n", */
-  /*         R->a1 - R->dstbuf, */
-  /*         *R->a0, */
-  /*         __FUNCTION__ , __LINE__); */
-  *R->a1++ = *R->a0++;
-  /* addq.l     #1,d5 */
-  R->d5++;
-  /* bra.s      still_packing */
-  BRA(still_packing);
+  return ice_finish(R);
+}
 
-all_packed:
-  /* bsr        make_normal_bytes */
+/* Bit cost of a string length (see make_stringlength).
+ */
+static int stringlength_cost(int len)
+{
+  int i;
+  for (i = 4; len < ta[i]; --i)
+    ;
+  return tb[i] + i;
+}
+
+/* Bit cost of a literal count (see make_normal_bytes).
+ */
+static int literal_cost(int cnt)
+{
+  int i;
+  for (i = 6; cnt < t1a[i]; --i)
+    ;
+  return tib[i][1];
+}
+
+/* Bit cost of a string offset (see make_offset_2, make_offset_mehr).
+ */
+static int offset_cost(int len, int off)
+{
+  int i;
+  if (len == 2)
+    return off > 0x3f ? 10 : 7;
+  for (i = 2; off < table3[i]; --i)
+    ;
+  return (table3[3+i] & 15) + 1;
+}
+
+/* Store a string of len bytes at a0 (see mehr_bytes_ablegen).
+ */
+static void emit_string(all_regs_t *R, int len, int off)
+{
+  R->maxlength = len;
+  R->d0 = off;
   make_normal_bytes(R);
-  /* bset       d6,d7 */
-  /* move.b     d7,(a1)+ */
+  restart_point(R);
+  if (len == 2)
+    make_offset_2(R);
+  else
+    make_offset_mehr(R);
+  make_stringlength(R);
+  R->d5 = 0;
+  R->a0 += len;
+}
 
-  /* fprintf(stdout,"%04x %02x (%s:%d) /all_packed\n", */
-  /*         R->a1 - R->dstbuf, */
-  /*         R->d7 | (1 << R->d6), */
-  /*         __FUNCTION__ , __LINE__); */
-  *R->a1++ = R->d7 |= (1 << R->d6);
-  /* sub.l   packed_data(pc),a1 */
-  /* move.l  a1,d0 */
-  /* move.l  d0,d7 */
-  R->d7 = R->d0 = R->a1 - R->dstbuf;
-  /* move.l  packed_data,a1 */
-  /* addq.l  #4,a1 */
-  /* bsr     longword_store */
-  R->a1 = R->dstbuf + 4;
-  longword_store(R);
-  /* rts */
+/* Greedy decision at a0 (see string_suche_fertig).
+ *
+ * @return  length to store at a0 (1 for a literal byte)
+ */
+static int search_token(all_regs_t *R, int *off)
+{
+  gleich_search(R);
+  if (R->maxgleich != 0x409)
+    string_find(R);
+  if (R->maxgleich > 1 &&
+      (R->maxgleich == 0x409 || R->maxgleich >= R->d4)) {
+    *off = 0;
+    return R->maxgleich;
+  }
+  if (R->d4 == 1 || (R->d4 == 2 && R->maxoffset > 0x23f))
+    return 1;
+  *off = R->maxoffset;
+  return R->d4;
+}
+
+/* Bits saved by storing a string instead of literal bytes.
+ */
+static int string_gain(int len, int off)
+{
+  return len < 2 ? 0 :
+    8 * len - stringlength_cost(len) - offset_cost(len, off);
+}
+
+/* Bits a deferred string must gain per skipped byte. A skipped byte
+ * costs a literal and often starts a new literal run.
+ */
+#define LAZY_MARGIN 12
+
+/* Lazy decision at a0.
+ *
+ *   Before storing the string found at a0 look for a better one
+ *   starting one (or two) bytes later. Searched positions are kept
+ *   so that each position is searched at most once and in order.
+ *   Without look ahead (steps=0) it is the greedy decision.
+ *
+ * @return  length to store at a0 (1 for a literal byte)
+ */
+static int lazy_token(all_regs_t *R, int steps, int *off)
+{
+  int * const len = R->lz_len, * const lzo = R->lz_off, * const gain = R->lz_gain;
+  int i;
+
+  if (!R->lz_have) {
+    len[0] = search_token(R, lzo);
+    gain[0] = string_gain(len[0], lzo[0]);
+    R->lz_have = 1;
+  }
+  if (len[0] >= 2) {
+    const areg_t at = R->a0;
+    int defer = 0;
+    for (i = 1; i <= steps && R->srcend - (at+i) >= 3; ++i) {
+      if (R->lz_have <= i) {
+        R->a0 = at + i;
+        len[i] = search_token(R, lzo+i);
+        gain[i] = string_gain(len[i], lzo[i]);
+        R->lz_have = i + 1;
+      }
+      if (gain[i] > gain[0] + LAZY_MARGIN * i)
+        defer = 1;
+    }
+    R->a0 = at;
+    if (!defer) {
+      R->lz_have = 0;
+      *off = lzo[0];
+      return len[0];
+    }
+  }
+  /* Literal byte: slide the searched positions */
+  for (i = 1; i < R->lz_have; ++i) {
+    len[i-1] = len[i];
+    lzo[i-1] = lzo[i];
+    gain[i-1] = gain[i];
+  }
+  --R->lz_have;
+  return 1;
+}
+
+/* Lazy parsing (see lazy_token).
+ */
+static int lazy_crunch(all_regs_t *R)
+{
+  const int steps = R->parse == UNICE68_PARSE_LAZY2 ? 2 : 1;
+  int len, off;
+
+  for (;;) {
+    if (R->stop && R->a0 >= R->stop)
+      return 0;                         /* wait for more input */
+    if (R->srcend - R->a0 < 3)
+      break;
+    len = lazy_token(R, steps, &off);
+    if (len >= 2)
+      emit_string(R, len, off);
+    else {
+      /* Store a literal byte */
+      R->a0++;
+      R->d5++;
+    }
+  }
+  return ice_finish(R);
+}
+
+/***********************************************************************
+ * Threaded string search
+ *
+ *   The string found at a position only depends on the input, not on
+ *   the tokens stored before. Jobs parse segments of the input on
+ *   their own and keep the search result of every position they
+ *   visit. Past its first tokens a segment parse visits the same
+ *   positions than the packer, which then finds most results ready.
+ *   Other positions are searched as usual so the output is the same.
+ *
+ *   The input is processed in rounds. The tokens of a round are
+ *   stored by one thread while the others search the next round.
+ */
+
+#define SEARCH_SEGMENT 0x20000            /* positions parsed by a job */
+#define SEARCH_ROUND   16                 /* jobs per round */
+#define SEARCH_TABLE   (SEARCH_SEGMENT * SEARCH_ROUND)
+
+typedef struct {
+  all_regs_t regs;                      /* packer state jobs start from */
+  all_regs_t * R;                       /* packer (stores tokens) */
+  match_t * table;                      /* results from position start */
+  int start, end;                       /* positions of the round */
+  int emit;                             /* job 0 stores the last round */
+  int ret;                              /* crunch result */
+} search_t;
+
+/* Store the tokens of the last round searched.
+ */
+static void emit_round(search_t * S)
+{
+  all_regs_t * const R = S->R;
+
+  if (R->a0 >= R->srcend)
+    return;                             /* stored up to the end already */
+  if (R->parse == UNICE68_PARSE_LAZY || R->parse == UNICE68_PARSE_LAZY2)
+    S->ret = lazy_crunch(R);
+  else
+    S->ret = ice_crunch(R);
+}
+
+static int search_job(void * ctx, int i)
+{
+  search_t * const S = ctx;
+  const int steps = S->regs.parse == UNICE68_PARSE_LAZY2 ? 2
+    : S->regs.parse == UNICE68_PARSE_LAZY;
+  int lo, hi, len, off, k;
+  all_regs_t W;
+  areg_t at;
+
+  if (S->emit && !i--) {
+    emit_round(S);
+    return 0;
+  }
+  lo = S->start + i * SEARCH_SEGMENT;
+  hi = lo + SEARCH_SEGMENT < S->end ? lo + SEARCH_SEGMENT : S->end;
+
+  /* Own hash-chain */
+  W = S->regs;
+  W.last = malloc(sizeof(int) * (CHAIN_KEYS + W.mask + 1));
+  if (!W.last)
+    return -1;
+  memset(W.last, -1, sizeof(int) * CHAIN_KEYS);
+  W.link = W.last + CHAIN_KEYS;
+  W.ins = lo;
+
+  /* Greedy parse, plus the positions lazy parsing looks ahead */
+  for (at = W.srcbuf + lo; at < W.srcbuf + hi && W.srcend - at >= 3;
+       at += len) {
+    len = 1;
+    for (k = 0; k <= steps; ++k) {
+      match_t * m;
+      int n;
+
+      if (at + k >= W.srcbuf + hi || W.srcend - (at + k) < 3)
+        break;
+      W.a0 = at + k;
+      n = search_token(&W, &off);
+      m = S->table + (W.a0 - W.srcbuf) - S->start;
+      m->len = W.d4;
+      m->off = W.maxoffset;
+      if (!k && (len = n) < 2)
+        break;
+    }
+  }
+  free(W.last);
+  return 0;
+}
+
+/* Greedy or lazy parsing with the strings searched by threads.
+ */
+static int threaded_crunch(all_regs_t *R, int threads)
+{
+  match_t * const tables = malloc(sizeof(match_t) * SEARCH_TABLE * 2);
+  search_t S;
+  int jobs;
+
+  if (!tables) {
+    S.R = R;
+    emit_round(&S);
+    return S.ret;
+  }
+
+  S.regs = *R;
+  S.R = R;
+  S.table = tables + SEARCH_TABLE;
+  S.start = S.end = R->a0 - R->srcbuf;
+  S.emit = 0;
+  do {
+    /* Search the next round */
+    S.start = S.end;
+    S.end = R->srclen - S.start > SEARCH_TABLE
+      ? S.start + SEARCH_TABLE : R->srclen;
+    S.table = S.table == tables ? tables + SEARCH_TABLE : tables;
+    memset(S.table, 0, sizeof(match_t) * (S.end - S.start));
+    jobs = (S.end - S.start + SEARCH_SEGMENT - 1) / SEARCH_SEGMENT;
+    /* Failed jobs are not an error, the packer searches instead */
+    unice68_parallel(S.emit + jobs, search_job, &S, threads);
+
+    /* Store its tokens with the next one */
+    R->matches = S.table;
+    R->mstart = S.start;
+    R->mend = S.end;
+    R->stop = S.end < R->srclen ? R->srcbuf + S.end : 0;
+    S.emit = 1;
+  } while (jobs);
+
+  R->matches = 0;
+  free(tables);
+  return S.ret;
+}
+
+/***********************************************************************
+ * Segment-parallel parsing
+ *
+ *   The tokens only depend on the position they are parsed from.
+ *   Jobs parse segments of the input on their own. At each seam the
+ *   parse of a segment goes on into the next segment until it stops
+ *   at a position the next parse visits too: from there both parses
+ *   take the same decisions, so the tokens are those of the serial
+ *   parse. If they do not meet within SEAM_LIMIT bytes (e.g. in a long
+ *   sequence of identical bytes) the rest of the string of the next
+ *   segment is stored instead, or less than 0x409 literal bytes when
+ *   its offset is too large.
+ *
+ *   Then the bits of each segment are counted, which gives the
+ *   position of its first byte and the number of bits pending before
+ *   it, and jobs store the segments. Bits pending at the end of a
+ *   segment are merged in the first byte of bits of the next one.
+ *
+ *   The input is processed in rounds of SEAM_ROUND segments to bound
+ *   the memory used by the tokens.
+ */
+
+#define SEAM_SEGMENT 0x40000              /* positions parsed by a job */
+#define SEAM_ROUND   32                   /* segments per round */
+#define SEAM_LIMIT   0x8000               /* parse past a seam (max) */
+
+#if SEAM_LIMIT + 0x409 >= SEAM_SEGMENT
+# error "A parse must not go past the next segment"
+#endif
+
+/* String parsed by a segment */
+typedef struct {
+  int pos;                              /* string start */
+  uint16_t len, off;                    /* string length and offset */
+} token_t;
+
+typedef struct {
+  all_regs_t W;                         /* parser, then storer */
+  token_t * tok;                        /* strings parsed */
+  int ntok, maxtok;
+  int nparsed;                          /* strings parsed in the segment */
+  int first;                            /* first string stored */
+  int start, end;                       /* positions stored [start,end) */
+  int lead;                             /* literal bytes before first */
+  int tail;                             /* literal bytes after the last */
+  int bits, bytes;                      /* stored after the first count */
+  int d5;                               /* literal bytes pending at start */
+  int cnt;                              /* bits pending at start */
+  areg_t out;                           /* first byte stored */
+  areg_t fix;                           /* first byte of bits (0:none) */
+  int shift;                            /* position of the bits pending */
+  int missed;                           /* the parses did not meet */
+} segment_t;
+
+typedef struct {
+  segment_t * seg;                      /* segments of the round */
+  int count;                            /* number of segments */
+  int end;                              /* end of the last segment (min) */
+  int last;                             /* the round ends the input */
+  int steps;                            /* lazy parsing look ahead */
+} seam_t;
+
+/* Keep a string parsed by a segment.
+ */
+static int segment_push(segment_t * G, int len, int off)
+{
+  if (G->ntok == G->maxtok) {
+    const int max = G->maxtok ? G->maxtok * 2 : 0x1000;
+    token_t * const tok = realloc(G->tok, sizeof(token_t) * max);
+    if (!tok)
+      return -1;
+    G->tok = tok;
+    G->maxtok = max;
+  }
+  G->tok[G->ntok].pos = G->W.a0 - G->W.srcbuf;
+  G->tok[G->ntok].len = len;
+  G->tok[G->ntok].off = off;
+  ++G->ntok;
+  return 0;
+}
+
+/* Parse the token at a0.
+ */
+static int segment_step(segment_t * G, int steps)
+{
+  int off, len = lazy_token(&G->W, steps, &off);
+
+  if (len >= 2 && segment_push(G, len, off))
+    return -1;
+  G->W.a0 += len;
+  return 0;
+}
+
+static int seam_parse(void * ctx, int i)
+{
+  seam_t * const S = ctx;
+  segment_t * const G = S->seg + i;
+  all_regs_t * const W = &G->W;
+  const int end = i+1 < S->count ? G[1].start : S->end;
+
+  /* Own hash-chain */
+  W->last = malloc(sizeof(int) * (CHAIN_KEYS + W->mask + 1));
+  if (!W->last)
+    return -1;
+  memset(W->last, -1, sizeof(int) * CHAIN_KEYS);
+  W->link = W->last + CHAIN_KEYS;
+  W->ins = G->start;
+  W->a0 = W->srcbuf + G->start;
+  W->lz_have = 0;
+
+  while (W->a0 < W->srcbuf + end && W->srcend - W->a0 >= 3)
+    if (segment_step(G, S->steps))
+      return -1;
+  G->end = W->a0 - W->srcbuf;
+  G->nparsed = G->ntok;
+
+  /* Room for the strings parsed past the seam: the next job reads
+   * the strings of this segment meanwhile.
+   */
+  if (G->maxtok - G->ntok < SEAM_LIMIT / 2 + 0x209) {
+    token_t * const tok =
+      realloc(G->tok, sizeof(token_t) * (G->ntok + SEAM_LIMIT / 2 + 0x209));
+    if (!tok)
+      return -1;
+    G->tok = tok;
+    G->maxtok = G->ntok + SEAM_LIMIT / 2 + 0x209;
+  }
+  return 0;
+}
+
+/* Parse segment i past its seam until it meets segment i+1.
+ */
+static int seam_join(void * ctx, int i)
+{
+  seam_t * const S = ctx;
+  segment_t * const A = S->seg + i, * const B = A + 1;
+  const token_t * const t = B->tok;
+  int j = 0;
+
+  for (;;) {
+    const int x = A->W.a0 - A->W.srcbuf;
+    while (j < B->nparsed && t[j].pos + t[j].len <= x)
+      ++j;
+    if (j == B->nparsed || t[j].pos >= x) {
+      if (i+2 == S->count && B->end < x)
+        B->end = x;                     /* B is the end of the input */
+      break;                            /* not in a string of B */
+    }
+    if (x - B->start >= SEAM_LIMIT || A->W.srcend - A->W.a0 < 3) {
+      /* Give up: store the rest of the string of B. It copies from
+       * the same place so its offset grows, unless it is a sequence
+       * of identical bytes (offset 0).
+       */
+      const int len = t[j].pos + t[j].len - x;
+      const int off = t[j].off ? t[j].off + t[j].len - len : 0;
+      if (len >= 2 && off <= (len == 2 ? 0x23f : 0x111f) &&
+          segment_push(A, len, off))
+        return -1;
+      A->W.a0 += len;                   /* or literal bytes */
+      A->missed = 1;
+      ++j;
+      break;
+    }
+    if (segment_step(A, S->steps))
+      return -1;
+  }
+  A->end = B->start = A->W.a0 - A->W.srcbuf;
+  B->first = j;
+  return 0;
+}
+
+/* Count the bits and bytes a segment stores.
+ */
+static int seam_count(void * ctx, int i)
+{
+  seam_t * const S = ctx;
+  segment_t * const G = S->seg + i;
+  int k, a = G->start;
+
+  G->lead = G->bits = G->bytes = 0;
+  for (k = G->first; k < G->ntok; ++k) {
+    const token_t * const t = G->tok + k;
+    if (k == G->first)
+      G->lead = t->pos - a;
+    else {
+      G->bits += literal_cost(t->pos - a);
+      G->bytes += t->pos - a;
+    }
+    G->bits += offset_cost(t->len, t->off) + stringlength_cost(t->len);
+    a = t->pos + t->len;
+  }
+  G->tail = G->end - a;
+  return 0;
+}
+
+/* Store the tokens of a segment.
+ */
+static int seam_store(void * ctx, int i)
+{
+  seam_t * const S = ctx;
+  segment_t * const G = S->seg + i;
+  all_regs_t * const W = &G->W;
+  int k;
+
+  W->a0 = W->srcbuf + G->start;
+  W->a1 = G->out;
+  W->d5 = G->d5;
+  W->d6 = 7 - G->cnt;
+  W->d7 = 0;
+  G->fix = 0;
+  G->shift = 0;
+  for (k = G->first; k < G->ntok; ++k) {
+    const token_t * const t = G->tok + k;
+    areg_t at;
+
+    W->d5 += W->srcbuf + t->pos - W->a0;
+    W->a0 = W->srcbuf + t->pos;
+    at = W->a1 + W->d5;                 /* bits come after the literals */
+    emit_string(W, t->len, t->off);
+    if (!G->fix && W->a1 > at)
+      G->fix = at;
+  }
+  W->d5 += W->srcbuf + G->end - W->a0;
+  W->a0 = W->srcbuf + G->end;
+  if (S->last && i == S->count-1) {
+    const areg_t at = W->a1 + W->d5 + (W->srcend - W->a0);
+    ice_finish(W);
+    if (!G->fix) {
+      G->fix = at;
+      if (at == W->dstbuf + W->d0 - 1)
+        G->shift = 1 + W->d6;           /* last byte, bits are on top */
+    }
+  }
+  return W->error;
+}
+
+static int seam_run(void * ctx, int i)
+{
+  all_regs_t * const R = ctx;
+  const int lo = SEAM_SEGMENT * i;
+
+  run_table(R, lo,
+            R->srclen - lo > SEAM_SEGMENT ? lo + SEAM_SEGMENT : R->srclen);
+  return 0;
+}
+
+/* Greedy or lazy parsing of segments on many threads.
+ */
+static int segment_crunch(all_regs_t *R, int threads)
+{
+  segment_t * const seg = calloc(SEAM_ROUND, sizeof(segment_t));
+  seam_t S;
+  int i;
+
+  if (!seg)
+    return R->error = -1;
+  /* Run-length table by segments. Sequences crossing a seam are
+   * counted again from it up to where the counts agree, which they
+   * do within 0x409 bytes as they are capped.
+   */
+  if (R->run) {
+    const int count = (R->srclen + SEAM_SEGMENT - 1) / SEAM_SEGMENT;
+    unice68_parallel(count, seam_run, R, threads);
+    for (i = SEAM_SEGMENT * (count-1) - 1; i > 0; i -= SEAM_SEGMENT) {
+      int k, n;
+      for (k = i; k >= 0 && R->srcbuf[k] == R->srcbuf[k+1]; --k) {
+        n = R->run[k+1] - (R->run[k+1] == 0x409) + 1;
+        if (R->run[k] == n)
+          break;
+        R->run[k] = n;
+      }
+    }
+  }
+
+  S.seg = seg;
+  S.steps = R->parse == UNICE68_PARSE_LAZY2 ? 2
+    : R->parse == UNICE68_PARSE_LAZY;
+  do {
+    const int start = R->a0 - R->srcbuf, left = R->srclen - start;
+    int pend = R->d7, failed;
+
+    S.count = left > SEAM_SEGMENT * SEAM_ROUND ? SEAM_ROUND
+      : left ? (left + SEAM_SEGMENT - 1) / SEAM_SEGMENT : 1;
+    S.last = left <= SEAM_SEGMENT * S.count;
+    S.end = S.last ? R->srclen : start + SEAM_SEGMENT * S.count;
+    for (i = 0; i < S.count; ++i) {
+      segment_t * const G = seg + i;
+      G->W = *R;
+      G->W.last = G->W.link = 0;
+      G->start = start + SEAM_SEGMENT * i;
+      G->ntok = G->first = G->missed = 0;
+    }
+
+    /* Parse the segments then join them */
+    failed = unice68_parallel(S.count, seam_parse, &S, threads);
+    if (!failed)
+      failed = unice68_parallel(S.count-1, seam_join, &S, threads);
+    for (i = 0; i < S.count; ++i) {
+      free(seg[i].W.last);
+      seg[i].W.last = seg[i].W.link = 0;
+    }
+    if (failed) {
+      R->error = -1;
+      break;
+    }
+
+    /* Place the segments in the packed stream */
+    unice68_parallel(S.count, seam_count, &S, threads);
+    for (i = 0; i < S.count; ++i) {
+      segment_t * const G = seg + i;
+      const int cnt = 7 - R->d6;
+      G->d5 = R->d5;
+      G->cnt = cnt;
+      G->out = R->a1;
+      if (G->first < G->ntok) {
+        const int lits = R->d5 + G->lead;
+        const int bits = cnt + literal_cost(lits) + G->bits;
+        R->a1 += lits + G->bytes + bits / 8;
+        R->d6 = 7 - (bits & 7);
+        R->d5 = G->tail;
+      } else
+        R->d5 += G->end - G->start;
+      R->missed += G->missed;
+    }
+
+    /* Store them and merge the pending bits */
+    if (unice68_parallel(S.count, seam_store, &S, threads)) {
+      R->error = -1;
+      break;
+    }
+    for (i = 0; i < S.count; ++i) {
+      segment_t * const G = seg + i;
+      if (G->fix)
+        *G->fix |= pend >> (8 - G->cnt) << G->shift;
+      else
+        G->W.d7 |= pend >> (8 - G->cnt) << (1 + G->W.d6);
+      pend = G->W.d7;
+    }
+    R->a0 = R->srcbuf + seg[S.count-1].end;
+    R->d7 = pend;
+    R->d0 = seg[S.count-1].W.d0;
+  } while (!S.last);
+
+  for (i = 0; i < SEAM_ROUND; ++i)
+    free(seg[i].tok);
+  free(seg);
   return R->d0;
 }
 
-static void make_normal_bytes(all_regs_t * R)
+#define PRICE_INF INT_MAX
+
+/* Sliding window minimum of price[] for one literal count class.
+ */
+typedef struct {
+  int *q, mask, head, tail;
+} window_min_t;
+
+/* Optimal parsing.
+ *
+ *   Dynamic programming over the input block [a0,end) with the exact
+ *   bit cost of every encoded field. A token is a literal run
+ *   followed by a string; the price of a literal run only depends on
+ *   its count class so each class keeps its own sliding window
+ *   minimum.
+ *
+ *   Unless it is the last block, tokens are stored up to the last
+ *   string only. The trailing literal bytes are parsed again with
+ *   the next block.
+ *
+ *   Strings copy from below the next restart interval boundary only
+ *   (see search_end).
+ *
+ *   price[i] : cost to reach i with a string ending there, minus 8*i
+ *   lits[i]  : start of the best literal run ending at i
+ *   from[i]  : best string ending at i (offset << 11 | length)
+ */
+static int optimal_parse(all_regs_t *R, areg_t end, int last)
 {
-  static const int t1a[7] = { 0, 1, 2, 5, 8, 15, 270 };
+  const areg_t s = R->a0, srcbuf = R->srcbuf;
+  const int n = end - s, base = s - srcbuf;
+  areg_t stop;
+  int *price, *lits, *qbuf, *qptr;
+  uint32_t *from;
+  window_min_t win[7];
+  int lenbits[0x40a];
+  int c, i, p, run = 0, skip = 0, total = 0;
+
+  price = malloc(sizeof(int) * (n+1) * 3);
+  qbuf = malloc(sizeof(int) * (0x100 * 6 + 0x10000));
+  if (!price || !qbuf) {
+    free(price);
+    free(qbuf);
+    return R->error = -1;
+  }
+  lits = price + n + 1;
+  from = (uint32_t *) (lits + n + 1);
+
+  for (i = 2; i <= 0x409; ++i)
+    lenbits[i] = stringlength_cost(i);
+  for (qptr = qbuf, c = 0; c < 7; ++c) {
+    const int size = c < 6 ? 0x100 : 0x10000;
+    win[c].q = qptr;
+    win[c].mask = size - 1;
+    win[c].head = win[c].tail = 0;
+    qptr += size;
+  }
+  for (i = 0; i <= n; ++i)
+    price[i] = PRICE_INF;
+  price[0] = 0;
+
+  /* Hash-chain positions are relative to the block */
+  R->srcbuf = s;
+  R->ins = 0;
+  memset(R->last, -1, sizeof(int) * CHAIN_KEYS);
+
+  for (p = 0; p <= n; ++p) {
+    const areg_t a0 = s + p;
+    int best = PRICE_INF, from_lit = 0, nn = n;
+
+    /* Literal run ending at p */
+    for (c = 0; c < 7; ++c) {
+      window_min_t * const w = win + c;
+      const int lo = t1a[c], hi = c < 6 ? t1a[c+1]-1 : 0x810d;
+      const int j = p - lo;
+      if (j >= 0 && price[j] != PRICE_INF) {
+        while (w->tail != w->head &&
+               price[w->q[(w->tail-1) & w->mask]] >= price[j])
+          --w->tail;
+        w->q[w->tail++ & w->mask] = j;
+      }
+      while (w->tail != w->head && w->q[w->head & w->mask] < p - hi)
+        ++w->head;
+      if (w->tail != w->head) {
+        const int k = w->q[w->head & w->mask];
+        const int v = price[k] + tib[c][1];
+        if (v < best) {
+          best = v;
+          from_lit = k;
+        }
+      }
+    }
+    lits[p] = from_lit;
+    if (p == n) {
+      total = best;
+      break;
+    }
+    if (R->interval) {
+      const int lim = ((base + p) / R->interval + 1) * R->interval - base;
+      if (lim < n)
+        nn = lim;
+    }
+    if (best == PRICE_INF || nn - p < 3 || p < skip)
+      continue;
+
+    /* Strings starting at p (run of identical bytes first) */
+    if (run <= p)
+      for (run = p+1; run < n && s[run] == *a0; ++run)
+        ;
+    {
+      const int lim = p + R->optimize < nn ? p + R->optimize : nn;
+      int len, max, k, cnt = R->depth > 0 ? R->depth : INT_MAX;
+      int l = (run < nn ? run : nn) - p - 1;
+
+      if (l > 0x409)
+        l = 0x409;
+      for (i = 2; i <= l; ++i) {
+        const int v = best + lenbits[i] + offset_cost(i, 0) - 8*i;
+        if (v < price[p+i]) {
+          price[p+i] = v;
+          from[p+i] = i;
+        }
+      }
+      if (l < 1)
+        l = 1;
+
+      chain_insert(R, p, lim - 1);
+      for (k = R->link[p & R->mask]; k >= 0 && l < 0x409;
+           k = R->link[k & R->mask]) {
+        const int d = k - p;
+        if (--cnt < 0 || d - 0x408 > 0x111f)
+          break;
+        max = nn - k;
+        if (max > d) max = d;
+        if (max > 0x409) max = 0x409;
+        if (max <= l || a0[l] != s[k+l])
+          continue;
+        for (len = 0; len < max && a0[len] == s[k+len]; ++len)
+          ;
+        for (i = l+1; i <= len; ++i) {
+          const int off = d - i + 1;
+          int v;
+          if (i < 2 || off > (i == 2 ? 0x23f : 0x111f))
+            continue;
+          v = best + lenbits[i] + offset_cost(i, off) - 8*i;
+          if (v < price[p+i]) {
+            price[p+i] = v;
+            from[p+i] = off << 11 | i;
+          }
+        }
+        if (len > l)
+          l = len;
+      }
+      if (l == 0x409)
+        skip = p + l;       /* maximal string: skip the inner positions */
+    }
+  }
+
+  R->srcbuf = srcbuf;
+  if (total == PRICE_INF || (!last && !lits[n])) {
+    /* Literal run too long */
+    free(price);
+    free(qbuf);
+    return R->error = -1;
+  }
+
+  /* Walk back the best path, marking string starts in price[] */
+  for (p = lits[n], i = 0; i <= n; ++i)
+    price[i] = -1;
+  while (p > 0) {
+    const int len = from[p] & 0x7ff;
+    price[p-len] = from[p];
+    p = lits[p-len];
+  }
+
+  /* Emit tokens */
+  stop = last ? end : s + lits[n];
+  while (R->a0 < stop) {
+    const int code = price[R->a0 - s];
+    if (code < 0) {
+      R->a0++;
+      R->d5++;
+      continue;
+    }
+    emit_string(R, code & 0x7ff, code >> 11);
+  }
+  free(price);
+  free(qbuf);
+  return 0;
+}
 
-  static const int tib[7][2] = {
-    { 0x01,0x01 }, { 0x01, 0x02 }, { 0x02, 0x04 }, { 0x02, 0x06 },
-    { 0x03,0x09 }, { 0x08, 0x11 }, { 0x0f, 0x20 }
-  };
+static int optimal_crunch(all_regs_t *R)
+{
+  if (optimal_parse(R, R->srcend, 1))
+    return -1;
+  return ice_finish(R);
+}
+
+/* Store the d5 literal bytes before a0 and their count.
+ *
+ *   Literal bytes are not copied one by one while crunching. Nothing
+ *   else is written until their count is stored so copying the whole
+ *   run here produces the very same stream.
+ */
+static void make_normal_bytes(all_regs_t * R)
+{
+  memcpy(R->a1, R->a0 - R->d5, R->d5);
+  R->a1 += R->d5;
 
   /* cmp.l      #$810d,d5 */
   /* bls.s      noerror */
@@ -526,7 +1638,7 @@ kleiner:
   /* moveq      #-1,d1 */
   /* lsl.l      d2,d1 */
   /* or.w       d5,d1 */
-  R->d1 = (-1 << R->d2) | R->d5;
+  R->d1 = (int) ((unsigned) -1 << R->d2) | R->d5;
   /* moveq      #0,d5 */
   R->d5 = 0;
   /* move.b     (a3)+,d4 */
@@ -539,20 +1651,52 @@ kleiner:
 
 int unice68_packer(void * dst, int dstsz, const void * src, int srcsz)
 {
-  all_regs_t allregs, *R = &allregs;
+  return unice68_packer_ex(dst, dstsz, src, srcsz, 0);
+}
 
+int unice68_params_level(unice68_params_t * params, int level)
+{
+  /* window, depth, parse */
+  static const int levels[UNICE68_LEVEL_MAX+1][3] = {
+    { 0x0400,   4, UNICE68_PARSE_GREEDY  },   /* 0 */
+    { 0x1000,   8, UNICE68_PARSE_GREEDY  },   /* 1 */
+    { 0x1580,  16, UNICE68_PARSE_GREEDY  },   /* 2 */
+    { 0x1580,  64, UNICE68_PARSE_GREEDY  },   /* 3 */
+    { 0x1580, 256, UNICE68_PARSE_GREEDY  },   /* 4 */
+    { 0x1580,   0, UNICE68_PARSE_GREEDY  },   /* 5 */
+    { 0x1580,   0, UNICE68_PARSE_LAZY    },   /* 6 */
+    { 0x1580, 256, UNICE68_PARSE_OPTIMAL },   /* 7 */
+    { 0x1580,1024, UNICE68_PARSE_OPTIMAL },   /* 8 */
+    { 0x1580,   0, UNICE68_PARSE_OPTIMAL },   /* 9 */
+  };
 
-  /***********************************************************************
-   * Save parameters
-   */
-  R->srcbuf = (areg_t) src;
-  R->srcend = R->srcbuf + srcsz;
-  R->srclen = srcsz;
-  R->dstbuf = (areg_t) dst;
-  R->dstend = R->dstbuf + dstsz;
-  R->dstlen = 0;
-  R->dstmax = dstsz;
+  if (level < UNICE68_LEVEL_MIN || level > UNICE68_LEVEL_MAX)
+    return -1;
+  memset(params, 0, sizeof(*params));
+  params->engine = UNICE68_ENGINE_CHAIN;
+  params->window = levels[level][0];
+  params->depth  = levels[level][1];
+  params->parse  = levels[level][2];
+  return 0;
+}
+
+int unice68_packer_level(void * dst, int dstsz, const void * src, int srcsz,
+                         int level)
+{
+  unice68_params_t params;
 
+  if (unice68_params_level(&params, level))
+    return -1;
+  return unice68_packer_ex(dst, dstsz, src, srcsz, &params);
+}
+
+/* Setup the registers and allocate the match finder.
+ *
+ * runlen : run-length table size (positions)
+ */
+static void pack_init(all_regs_t *R, const unice68_params_t * params,
+                      int runlen)
+{
   R->a0 = R->srcbuf;
   R->d0 = R->srclen;
   R->a1 = R->dstbuf;
@@ -561,14 +1705,59 @@ int unice68_packer(void * dst, int dstsz, const void * src, int srcsz)
 
   R->error     = 0;
   R->optimize  = 0x1580;
+  if (params && params->window > 0 && params->window < R->optimize)
+    R->optimize = params->window < 0x20 ? 0x20 : params->window;
   R->maxlength = 0;
   R->maxgleich = 0;
   R->maxoffset = 0;
 
-  /***********************************************************************
-   * Store header
-   */
+  R->last  = R->link = 0;
+  R->mask  = R->ins = 0;
+  R->run   = 0;
+  R->depth = params ? params->depth : 0;
+  R->parse = params ? params->parse : UNICE68_PARSE_GREEDY;
+
+  R->lz_have = 0;
+  R->stop    = 0;
+  R->stream  = 0;
+  R->flushed = 0;
+
+  R->interval  = 0;
+  R->next_restart = 0;
+  R->points    = 0;
+  R->npoints   = R->maxpoints = 0;
+
+  R->matches   = 0;
+  R->mstart    = R->mend = 0;
+  R->missed    = 0;
+
+  if (!params || params->engine == UNICE68_ENGINE_CHAIN ||
+      R->parse == UNICE68_PARSE_OPTIMAL) {
+    /* Ring buffer large enough for the whole forward window */
+    int size = 1;
+    while (size < R->optimize)
+      size <<= 1;
+    R->last = malloc(sizeof(int) * (CHAIN_KEYS + size));
+    if (R->last) {
+      memset(R->last, -1, sizeof(int) * CHAIN_KEYS);
+      R->link = R->last + CHAIN_KEYS;
+      R->mask = size - 1;
+    }
+    /* else fallback to the window scan */
+  }
+
+  if (R->parse != UNICE68_PARSE_OPTIMAL) {
+    R->run = malloc(sizeof(*R->run) * runlen + 1);
+    /* else fallback to the compare loop */
+  }
+}
 
+/* Store the header and the first bit.
+ *
+ * len : unpacked length
+ */
+static void pack_header(all_regs_t *R, int len)
+{
   /* move.l  #'Ice!',d7 */
   /* bsr     longword_store */
   /* addq.l  #4,a1 */
@@ -578,7 +1767,7 @@ int unice68_packer(void * dst, int dstsz, const void * src, int srcsz)
   R->d7 = ICE_MAGIC;               /* Store magic id 'Ice!'         */
   longword_store(R);
   R->a1 += 4;                      /* Leave space for packed length */
-  R->d7 = R->srclen;               /* Store unpacked length         */
+  R->d7 = len;                     /* Store unpacked length         */
   longword_store(R);
 
   /* moveq   #0,d5 */
@@ -592,13 +1781,350 @@ int unice68_packer(void * dst, int dstsz, const void * src, int srcsz)
 
   /* Store one bit for picture flag */
   put_bits(R);
+}
 
+/* Pack a whole buffer.
+ *
+ * interval : distance between restart points (0:none)
+ * points   : receives the restart points (maxpoints at most)
+ */
+static int pack_buffer(all_regs_t *R,
+                       void * dst, int dstsz, const void * src, int srcsz,
+                       const unice68_params_t * params, int interval,
+                       unice68_checkpoint_t * points, int maxpoints)
+{
+  /***********************************************************************
+   * Save parameters
+   */
+  R->srcbuf = (areg_t) src;
+  R->srcend = R->srcbuf + srcsz;
+  R->srclen = srcsz;
+  R->dstbuf = (areg_t) dst;
+  R->dstend = R->dstbuf + dstsz;
+  R->dstlen = 0;
+  R->dstmax = dstsz;
+
+  pack_init(R, params, R->srclen);
+  R->interval  = interval;
+  R->next_restart = interval;
+  R->points    = points;
+  R->maxpoints = maxpoints;
+
+  /***********************************************************************
+   * Store header
+   */
+  pack_header(R, R->srclen);
 
   /* Main loop */
-  ice_crunch(R);
+  if (R->parse == UNICE68_PARSE_OPTIMAL) {
+    if (R->link)
+      optimal_crunch(R);
+    else
+      R->error = -1;
+  } else if (params && params->segments && !interval &&
+             R->link && R->srclen > SEAM_SEGMENT)
+    segment_crunch(R, params->threads < 0 ? 0
+                   : params->threads ? params->threads : 1);
+  else {
+    if (R->run)
+      run_table(R, 0, R->srclen);
+    if (params && params->threads && params->threads != 1 &&
+        R->link && R->srclen > SEARCH_SEGMENT)
+      threaded_crunch(R, params->threads < 0 ? 0 : params->threads);
+    else if (R->parse == UNICE68_PARSE_LAZY ||
+             R->parse == UNICE68_PARSE_LAZY2)
+      lazy_crunch(R);
+    else
+      ice_crunch(R);
+  }
+  free(R->last);
+  free(R->run);
 
   if (R->error)
     R->d0 = -1;
 
   return R->d0;
 }
+
+int unice68_packer_ex(void * dst, int dstsz, const void * src, int srcsz,
+                      const unice68_params_t * params)
+{
+  all_regs_t allregs;
+
+  return pack_buffer(&allregs, dst, dstsz, src, srcsz, params, 0, 0, 0);
+}
+
+int unice68_packer_threads(void * dst, int dstsz, const void * src, int srcsz,
+                           int level, int threads)
+{
+  unice68_params_t params;
+
+  if (level < 0)
+    level = UNICE68_LEVEL_DEFAULT;
+  if (unice68_params_level(&params, level))
+    return -1;
+  params.threads = threads ? threads : -1;
+  return unice68_packer_ex(dst, dstsz, src, srcsz, &params);
+}
+
+int unice68_packer_segments(void * dst, int dstsz, const void * src, int srcsz,
+                            int level, int threads, int * missed)
+{
+  all_regs_t allregs;
+  unice68_params_t params;
+  int size;
+
+  if (level < 0)
+    level = UNICE68_LEVEL_DEFAULT;
+  if (unice68_params_level(&params, level))
+    return -1;
+  params.segments = 1;
+  params.threads = threads ? threads : -1;
+  size = pack_buffer(&allregs, dst, dstsz, src, srcsz, &params, 0, 0, 0);
+  if (missed)
+    *missed = size < 0 ? 0 : allregs.missed;
+  return size;
+}
+
+int unice68_packer_restart(void * dst, int dstsz, const void * src, int srcsz,
+                           int level, int interval,
+                           unice68_checkpoint_t * points, int * count)
+{
+  all_regs_t allregs;
+  unice68_params_t params;
+  int size;
+
+  if (level < 0)
+    level = UNICE68_LEVEL_DEFAULT;
+  if (unice68_params_level(&params, level) || interval <= 0 ||
+      !count || *count < 0 || (*count && !points))
+    return -1;
+  size = pack_buffer(&allregs, dst, dstsz, src, srcsz, &params, interval,
+                     points, *count);
+  *count = size < 0 ? 0 : allregs.npoints;
+  return size;
+}
+
+/***********************************************************************
+ * Streaming packer
+ *
+ *   The input is kept in a window that slides forward. Crunching
+ *   pauses as soon as a0 gets too close to the end of the buffered
+ *   input to take the same decisions than with the whole input, so
+ *   greedy and lazy parsing produce the very same stream than
+ *   unice68_packer_ex(). Optimal parsing works on blocks.
+ *
+ *   The window keeps the pending literal bytes before a0 (at most
+ *   0x810d) as they are copied when their count is stored.
+ */
+
+#define STREAM_LOOK  (0x1580 + 0x409 + 4) /* lookahead (window, run, lazy) */
+#define STREAM_CHUNK 0x10000              /* input accepted by a feed (min) */
+#define STREAM_BLOCK 0x40000              /* optimal parsing block size */
+
+struct unice68_stream_s {
+  all_regs_t regs;
+  int incap;                    /* input window size */
+  int outcap;                   /* output buffer size */
+  int outpos;                   /* output bytes already read */
+  int total;                    /* input bytes fed */
+  int run_done;                 /* run[] is final below this position */
+  int finished;                 /* unice68_stream_finish() called */
+};
+
+/* Update the run-length table for the new input.
+ */
+static void stream_run(unice68_stream_t * S)
+{
+  all_regs_t * const R = &S->regs;
+  uint16_t * const run = R->run;
+  int i = R->srcend - R->srcbuf;
+
+  if (!run || --i < S->run_done)
+    return;
+  run[i] = 1;
+  while (--i >= S->run_done)
+    run[i] = R->srcbuf[i] != R->srcbuf[i+1] ? 1 :
+      run[i+1] - (run[i+1] == 0x409) + 1;
+
+  /* Sequences running to the end may still grow (unless capped) */
+  i = R->srcend - R->srcbuf - 0x409;
+  if (i > S->run_done)
+    S->run_done = i;
+}
+
+/* Discard the input before the pending literal bytes.
+ *
+ *   The shift is a multiple of the hash-chain ring size so that the
+ *   ring entries only need to be rebased.
+ */
+static void stream_slide(unice68_stream_t * S)
+{
+  all_regs_t * const R = &S->regs;
+  const int keep = R->a0 - R->d5 - R->srcbuf;
+  const int shift = keep & ~R->mask;
+  const int len = R->srcend - R->srcbuf - shift;
+  int i;
+
+  if (shift <= 0)
+    return;
+  memmove(R->srcbuf, R->srcbuf + shift, len);
+  if (R->run)
+    memmove(R->run, R->run + shift, len * sizeof(*R->run));
+  if (R->link) {
+    for (i = 0; i < CHAIN_KEYS; ++i)
+      R->last[i] = R->last[i] >= shift ? R->last[i] - shift : -1;
+    for (i = 0; i <= R->mask; ++i)
+      R->link[i] = R->link[i] >= shift ? R->link[i] - shift : -1;
+    R->ins -= shift;
+    if (R->ins < 0)
+      R->ins = 0;
+  }
+  S->run_done -= shift;
+  R->a0 -= shift;
+  R->srcend -= shift;
+}
+
+/* Crunch the buffered input.
+ *
+ * final : all the input has been fed
+ */
+static int stream_crunch(unice68_stream_t * S, int final)
+{
+  all_regs_t * const R = &S->regs;
+
+  if (R->parse == UNICE68_PARSE_OPTIMAL) {
+    while (!R->error && R->srcend - R->a0 >= STREAM_BLOCK)
+      optimal_parse(R, R->a0 + STREAM_BLOCK, 0);
+    if (final && !R->error &&
+        (R->a0 == R->srcend || !optimal_parse(R, R->srcend, 1)))
+      ice_finish(R);
+  } else {
+    stream_run(S);
+    R->stop = final ? 0 : R->srcend - R->a0 > STREAM_LOOK
+      ? R->srcend - STREAM_LOOK : R->a0;
+    if (R->parse == UNICE68_PARSE_LAZY || R->parse == UNICE68_PARSE_LAZY2)
+      lazy_crunch(R);
+    else
+      ice_crunch(R);
+  }
+  return R->error ? -1 : 0;
+}
+
+unice68_stream_t * unice68_stream_new(int level)
+{
+  unice68_stream_t * S;
+  unice68_params_t params;
+  all_regs_t * R;
+  int incap;
+
+  if (level < 0)
+    level = UNICE68_LEVEL_DEFAULT;
+  if (unice68_params_level(&params, level))
+    return 0;
+  incap = params.parse == UNICE68_PARSE_OPTIMAL
+    ? STREAM_BLOCK + 0x2000 + STREAM_CHUNK
+    : 0x810e + 0x2000 + STREAM_LOOK + 0x409 + STREAM_CHUNK;
+
+  S = calloc(1, sizeof(*S) + incap + UNICE68_PACK_BOUND(incap));
+  if (!S)
+    return 0;
+  S->incap  = incap;
+  S->outcap = UNICE68_PACK_BOUND(incap);
+
+  R = &S->regs;
+  R->srcbuf = R->srcend = (areg_t) (S+1);
+  R->srclen = 0;
+  R->dstbuf = R->srcbuf + incap;
+  R->dstend = R->dstbuf + S->outcap;
+  R->dstmax = S->outcap;
+  pack_init(R, &params, incap);
+  R->stream = 1;
+  if (!R->link || (R->parse != UNICE68_PARSE_OPTIMAL && !R->run)) {
+    unice68_stream_free(S);
+    return 0;
+  }
+  pack_header(R, 0);
+  return S;
+}
+
+int unice68_stream_feed(unice68_stream_t * S, const void * src, int len)
+{
+  all_regs_t * const R = &S->regs;
+  int n;
+
+  if (S->finished || R->error || len < 0)
+    return -1;
+  if (S->outpos < R->a1 - R->dstbuf)
+    return 0;                           /* output not read */
+  R->flushed += R->a1 - R->dstbuf;
+  R->a1 = R->dstbuf;
+  S->outpos = 0;
+
+  if (S->incap - (R->srcend - R->srcbuf) < STREAM_CHUNK)
+    stream_slide(S);
+  n = S->incap - (R->srcend - R->srcbuf);
+  if (n > len)
+    n = len;
+  if (n > 0x7fffffff - S->total)
+    return R->error = -1;               /* does not fit the header */
+  memcpy(R->srcend, src, n);
+  R->srcend += n;
+  S->total += n;
+
+  return stream_crunch(S, 0) ? -1 : n;
+}
+
+int unice68_stream_read(unice68_stream_t * S, void * dst, int max)
+{
+  all_regs_t * const R = &S->regs;
+  int n = R->a1 - R->dstbuf - S->outpos;
+
+  if (n > max)
+    n = max;
+  if (n > 0) {
+    memcpy(dst, R->dstbuf + S->outpos, n);
+    S->outpos += n;
+  }
+  return n;
+}
+
+int unice68_stream_finish(unice68_stream_t * S, void * header)
+{
+  all_regs_t * const R = &S->regs;
+  uint8_t * const hd = header;
+  areg_t a1;
+
+  if (S->finished || R->error || !S->total)
+    return -1;
+  if (S->outpos < R->a1 - R->dstbuf)
+    return -1;                          /* output not read */
+  R->flushed += R->a1 - R->dstbuf;
+  R->a1 = R->dstbuf;
+  S->outpos = 0;
+
+  S->finished = 1;
+  if (stream_crunch(S, 1))
+    return -1;
+
+  /* Same header than pack_header() with the final lengths */
+  a1 = R->a1;
+  R->a1 = hd;
+  R->d7 = ICE_MAGIC;
+  longword_store(R);
+  R->d7 = R->d0;
+  longword_store(R);
+  R->d7 = S->total;
+  longword_store(R);
+  R->a1 = a1;
+  return R->d0;
+}
+
+void unice68_stream_free(unice68_stream_t * S)
+{
+  if (S) {
+    free(S->regs.last);
+    free(S->regs.run);
+    free(S);
+  }
+}
@@ -25,6 +25,8 @@
 /* #include "private.h" */
 #include "unice68.h"
 #include <stdint.h>
+#include <stdlib.h>
+#include <string.h>
 
 typedef uint8_t u8;
 typedef  int8_t s8;
@@ -37,6 +39,7 @@ typedef struct {
   areg_t a0,a1,a2,a3,a4,a5,a6,a7;
   dreg_t d0,d1,d2,d3,d4,d5,d6,d7;
   areg_t srcbuf,srcend,dstbuf,dstend;
+  areg_t stop;                /* decoding pauses below (see stream) */
   int overflow;
 } all_regs_t;
 
@@ -88,6 +91,7 @@ static void dump_regs(const char * label)
 
 static void strings(all_regs_t *);
 static void normal_bytes(all_regs_t *);
+static int fast_bytes(all_regs_t *);
 static int get_d0_bits(all_regs_t *, int d0);
 
 static inline int chk_dst_range(all_regs_t *R, const areg_t a, const areg_t b)
@@ -186,9 +190,16 @@ static int ice_decrunch(all_regs_t *R)
   R->a6 = R->a4 = R->a1;
   R->a6 += R->d0;
   R->dstend = R->a3 = R->a6;
+  R->stop = R->a4;
 
   R->d7 = *(--R->a5);
-  normal_bytes(R);
+  if (fast_bytes(R)) {
+    /* Start over with the reference decoder */
+    R->a5 = R->srcend;
+    R->a6 = R->a3;
+    R->d7 = *(--R->a5);
+    normal_bytes(R);
+  }
 
 /*      move.l  a3,a6 */
 /*      bsr     get_1_bit */
@@ -298,6 +309,8 @@ static void normal_bytes(all_regs_t *R)
   while (1) {
     const int * tab;
 
+    if (R->a6 < R->stop)
+      break;                            /* paused (stream, segment) */
     GET_1_BIT_BCC(test_if_end);
     R->d1 = 0;
     GET_1_BIT_BCC(copy_direkt);
@@ -332,6 +345,8 @@ static void normal_bytes(all_regs_t *R)
       break;
     }
     strings(R);
+    if (R->overflow)
+      break;
   }
 }
 
@@ -471,12 +486,267 @@ less_40:
 depack_bytes:
   R->a1 = R->a6 + 2 + (s16)R->d4 + (s16)R->d1;
   chk_dst_range(R, R->a6 - DBF_COUNT(R->d4) - 1, R->a6-1);
+  /* The string source must be the output above a6 */
+  if (chk_dst_range(R, R->a6, R->a1-1))
+    return;
   if (R->a6>R->a4) *(--R->a6) = *(--R->a1);
 dep_b:
   if (R->a6>R->a4) *(--R->a6) = *(--R->a1);
   DBF(R->d4,dep_b);
 }
 
+/* Fast decoder
+ *
+ *   Same stream as normal_bytes() and strings() but the bits are
+ *   peeked from a 64-bit reservoir and the variable length codes are
+ *   decoded by table lookup.
+ *
+ *   Literal bytes are interleaved with the bit bytes. The reservoir
+ *   holds the remaining bits of the current bit byte followed by the
+ *   next bytes as if they were bit bytes too. Before copying literal
+ *   bytes the prefetched whole bytes are given back.
+ *
+ *   Anything the reference decoder would report as an overflow makes
+ *   the fast decoder give up so the caller can start over with the
+ *   reference decoder.
+ */
+
+/* Literal count: 9 next bits -> consumed bits | count << 4 (0:escape) */
+#define LIT_CODE(v) (u8) (                                      \
+    !((v) & 0x100)       ? 1                                  : \
+    !((v) & 0x080)       ? 2 | 1 << 4                         : \
+    ((v) >> 5 & 3) != 3  ? 4 | (2 + ((v) >> 5 & 3)) << 4      : \
+    ((v) >> 3 & 3) != 3  ? 6 | (5 + ((v) >> 3 & 3)) << 4      : \
+    ((v) & 7) != 7       ? 9 | (8 + ((v) & 7)) << 4           : 0 )
+
+/* String length: 6 next bits -> consumed bits | length << 4 (0:escape) */
+#define LEN_CODE(v) (u8) (                                      \
+    !((v) & 0x20)        ? 1 | 2 << 4                         : \
+    !((v) & 0x10)        ? 2 | 3 << 4                         : \
+    !((v) & 0x08)        ? 4 | (4 + ((v) >> 2 & 1)) << 4      : \
+    !((v) & 0x04)        ? 6 | (6 + ((v) & 3)) << 4           : 0 )
+
+#define T2(M,v)   M(v), M((v)+1)
+#define T4(M,v)   T2(M,v),   T2(M,(v)+2)
+#define T8(M,v)   T4(M,v),   T4(M,(v)+4)
+#define T16(M,v)  T8(M,v),   T8(M,(v)+8)
+#define T32(M,v)  T16(M,v),  T16(M,(v)+16)
+#define T64(M,v)  T32(M,v),  T32(M,(v)+32)
+#define T128(M,v) T64(M,v),  T64(M,(v)+64)
+#define T256(M,v) T128(M,v), T128(M,(v)+128)
+#define T512(M,v) T256(M,v), T256(M,(v)+256)
+
+static const u8 lit_codes[512] = { T512(LIT_CODE,0) };
+static const u8 len_codes[64]  = { T64(LEN_CODE,0) };
+
+static inline uint64_t load64le(const u8 * p)
+{
+  return (uint64_t)p[0]       | (uint64_t)p[1] <<  8 |
+    (uint64_t)p[2] << 16      | (uint64_t)p[3] << 24 |
+    (uint64_t)p[4] << 32      | (uint64_t)p[5] << 40 |
+    (uint64_t)p[6] << 48      | (uint64_t)p[7] << 56;
+}
+
+/* bits: reservoir (MSB first), cnt: valid bits, p: next byte to load */
+#define PEEK(n) ((unsigned) (bits >> (64-(n))))
+#define SKIP(n) (bits <<= (n), cnt -= (n))
+#define NEED(n) if (cnt < (n)) goto fallback; else
+#define REFILL()                                                \
+  if (p - src >= 8) {                                           \
+    const int k = (63 - cnt) >> 3;                              \
+    bits |= load64le(p - 8) >> cnt;                             \
+    p -= k; cnt += k << 3;                                      \
+  } else                                                        \
+    for (; cnt <= 56 && p > src; cnt += 8)                      \
+      bits |= (uint64_t) *--p << (56 - cnt)
+
+/* Literal count (n) and its code length (c) */
+#define LIT_COUNT(n,c)                                          \
+  if ((c = lit_codes[PEEK(9)]) != 0) {                          \
+    n = c >> 4;                                                 \
+    c &= 15;                                                    \
+  } else if ((PEEK(17) & 0xff) != 0xff) {                       \
+    n = 15 + (PEEK(17) & 0xff);                                 \
+    c = 17;                                                     \
+  } else {                                                      \
+    n = 270 + (PEEK(32) & 0x7fff);                              \
+    c = 32;                                                     \
+  }
+
+/* String length (n) and its code length (c) */
+#define STR_LENGTH(n,c)                                         \
+  if ((c = len_codes[PEEK(6)]) != 0) {                          \
+    n = c >> 4;                                                 \
+    c &= 15;                                                    \
+  } else {                                                      \
+    n = 10 + (PEEK(14) & 0x3ff);                                \
+    c = 14;                                                     \
+  }
+
+/* String offset (1-n is a run of the byte above a6) */
+#define STR_OFFSET(n,off,c)                                     \
+  if (n == 2) {                                                 \
+    if (PEEK(1)) {                                              \
+      c = 10;                                                   \
+      off = (PEEK(10) & 0x1ff) + 0x3f;                          \
+    } else {                                                    \
+      c = 7;                                                    \
+      off = (PEEK(7) & 0x3f) - 1;                               \
+    }                                                           \
+  } else if (!(PEEK(1))) {                                      \
+    c = 9;                                                      \
+    off = (PEEK(9) & 0xff) + 0x1f;                              \
+  } else if (!(PEEK(2) & 1)) {                                  \
+    c = 7;                                                      \
+    off = (PEEK(7) & 0x1f) - 1;                                 \
+    if (off < 0)                                                \
+      off = 1 - n;                                              \
+  } else {                                                      \
+    c = 14;                                                     \
+    off = (PEEK(14) & 0xfff) + 0x11f;                           \
+  }
+
+/* Keep the remaining bits of the current bit byte only */
+#define GIVE_BACK()                                             \
+  p += cnt >> 3;                                                \
+  cnt &= 7;                                                     \
+  bits = cnt ? bits & ~(~(uint64_t) 0 >> cnt) : 0
+
+/* Distance to the buffer edges for the unchecked loop: a whole
+ * token (short literal run and longest string) plus the 16 bytes
+ * moves can't cross them.
+ */
+#define FAST_SRC_GUARD 64
+#define FAST_DST_GUARD (14 + 0x409 + 16)
+#define FAST_OK() (p - src >= FAST_SRC_GUARD && a6 - dst >= FAST_DST_GUARD \
+                   && a6 >= stop)
+
+static int fast_bytes(all_regs_t *R)
+{
+  const areg_t src = R->srcbuf, dst = R->a4, dend = R->a3, stop = R->stop;
+  areg_t p = R->a5, a6 = R->a6;
+  uint64_t bits;
+  int cnt, c, n, off;
+
+  if (R->srcend - src <= 12 || !(R->d7 & 255) ||
+      (dst < R->srcend && src < dend))
+    return -1;                          /* let the reference handle it */
+
+  /* Remaining bits are above the lowest bit set */
+  for (cnt = 7; !(R->d7 & (0x80 >> cnt)); --cnt)
+    ;
+  bits = (uint64_t) (R->d7 & (0xff00 >> cnt)) << 56;
+
+  /* Checked loop: tokens close to the buffer edges */
+  for (;;) {
+  checked_loop:
+    if (a6 < stop)
+      break;                            /* paused (stream, segment) */
+    if (FAST_OK())
+      goto fast_loop;
+
+    /* normal_bytes: literal count */
+    REFILL();
+    LIT_COUNT(n,c);
+    NEED(c);
+    SKIP(c);
+
+    if (n) {
+      GIVE_BACK();
+      if (p - src < n || a6 - dst < n)
+        goto fallback;
+      p  -= n;
+      a6 -= n;
+      memmove(a6, p, n);
+      REFILL();
+    }
+
+  test_if_end:
+    if (a6 <= dst) {
+      if (a6 < dst)
+        goto fallback;
+      break;
+    }
+
+    /* strings */
+    REFILL();
+    STR_LENGTH(n,c);
+    NEED(c);
+    SKIP(c);
+    STR_OFFSET(n,off,c);
+    NEED(c);
+    SKIP(c);
+
+    /* depack_bytes */
+    if (a6 - dst < n || a6 + n + off > dend)
+      goto fallback;
+    a6 -= n;
+    if (off < 0)
+      memset(a6, a6[n], n);
+    else
+      memcpy(a6, a6 + n + off, n);
+  }
+
+  /* Back to the reference registers */
+  R->a5 = p + (cnt >> 3);
+  cnt &= 7;
+  R->d7 = (int) (bits >> 56 & (0xff00 >> cnt)) | (0x80 >> cnt);
+  R->a6 = a6;
+  return 0;
+
+  /* Unchecked loop: the reservoir always has enough bits for a
+   * literal count or a string, and the moves may overrun the token
+   * by up to 16 bytes. */
+fast_loop:
+  do {
+    REFILL();
+    LIT_COUNT(n,c);
+    SKIP(c);
+
+    if (n) {
+      GIVE_BACK();
+      if (n > 14) {
+        /* Long literal run: back to the checked loop */
+        if (p - src < n || a6 - dst < n)
+          goto fallback;
+        p  -= n;
+        a6 -= n;
+        memmove(a6, p, n);
+        REFILL();
+        goto test_if_end;
+      }
+      memcpy(a6 - 16, p - 16, 16);
+      p  -= n;
+      a6 -= n;
+    }
+
+    REFILL();
+    STR_LENGTH(n,c);
+    SKIP(c);
+    STR_OFFSET(n,off,c);
+    SKIP(c);
+
+    /* The string source is above a6 but may be out of the buffer */
+    if (a6 + n + off > dend)
+      goto fallback;
+    a6 -= n;
+    if (n + off >= 16) {
+      areg_t d = a6 + n;
+      do {
+        d -= 16;
+        memcpy(d, d + n + off, 16);
+      } while (d > a6);
+    } else if (off < 0)
+      memset(a6, a6[n], n);
+    else
+      memcpy(a6, a6 + n + off, n);
+  } while (FAST_OK());
+  goto checked_loop;
+
+fallback:
+  return -1;
+}
+
 int unice68_depacked_size(const void * buffer, int * p_csize)
 {
   int id, csize, dsize;
@@ -533,3 +803,242 @@ int unice68_depacker(void * dest, const void * src)
 
   return ice_decrunch(&allregs);
 }
+
+/* Segment depacker
+ *
+ *   In a stream packed with restart points (see unice68_packer_restart)
+ *   a token ends at each restart point and no string copies bytes
+ *   from above the next one. The output between two restart points
+ *   can be depacked on its own, and concurrently with the others.
+ */
+int unice68_depack_segment(void * dst, const void * src,
+                           const unice68_checkpoint_t * top, int bottom)
+{
+  all_regs_t allregs, * const R = &allregs;
+  int csize = 0, dsize, toppos, d7;
+  areg_t a5;
+
+  dsize = unice68_depacked_size(src, &csize);
+  if (dsize <= 0)
+    return -1;
+
+  memset(R, 0, sizeof(*R));
+  R->srcbuf = (areg_t) src;
+  R->srcend = R->srcbuf + csize;
+  if (top) {
+    if (top->srcpos < 12 || top->srcpos >= csize ||
+        top->dstpos > dsize || !(top->bits & 255))
+      return -1;
+    R->a5 = R->srcbuf + top->srcpos;
+    R->d7 = top->bits & 255;
+    toppos = top->dstpos;
+  } else {
+    R->a5 = R->srcend;
+    R->d7 = *(--R->a5);
+    toppos = dsize;
+  }
+  if (bottom < 0 || bottom >= toppos)
+    return -1;
+
+  R->dstbuf = R->a4 = (areg_t) dst + bottom;
+  R->dstend = R->a3 = R->a6 = (areg_t) dst + toppos;
+  R->stop = bottom ? R->a4 + 1 : R->a4; /* pause at the restart point */
+
+  a5 = R->a5;
+  d7 = R->d7;
+  if (fast_bytes(R)) {
+    /* Start over with the reference decoder */
+    R->a5 = a5;
+    R->d7 = d7;
+    R->a6 = R->a3;
+    normal_bytes(R);
+  }
+  if (R->overflow || R->a6 != R->a4)
+    return -1;
+  /* No picture conversion (see dstream_round) */
+  if (!bottom && get_1_bit(R))
+    return -1;
+  return -!!R->overflow;
+}
+
+/* Streaming depacker
+ *
+ *   The output is produced from its end towards its start and the
+ *   strings only copy bytes a little above a6, so the depacker does
+ *   not need the whole output buffer. A window buffer covers the
+ *   output offsets [base, base+size). Each round decodes down to the
+ *   stop position, then the bytes that are no longer referenced are
+ *   handed out and the ones above a6 are moved to the top of the
+ *   window before the next round.
+ *
+ *   Between two rounds the whole decoder state is a5, the d7 bit
+ *   buffer, a6 and the UNICE68_DEPACK_WINDOW bytes above a6. It can
+ *   be saved as a checkpoint to restart the depacker later from
+ *   there.
+ */
+
+#define DSTREAM_KEEP  0x2000    /* string sources above a6 (0x1527 max) */
+#define DSTREAM_TOKEN 0x8600    /* longest literal run and string       */
+#define DSTREAM_CHUNK 0x40000   /* output handed out by a round (min)   */
+#define DSTREAM_SIZE  (DSTREAM_KEEP + DSTREAM_CHUNK + DSTREAM_TOKEN)
+
+struct unice68_depack_stream_s {
+  all_regs_t regs;
+  int dsize;                            /* depacked size           */
+  int size;                             /* window buffer size      */
+  int chunk;                            /* output decoded by round */
+  int base;                             /* output offset of buf[0] */
+  int state;                            /* 0:run 1:done <0:error   */
+  u8 buf[1];
+};
+
+unice68_depack_stream_t * unice68_depack_stream_new(const void * src,
+                                                    int srclen)
+{
+  unice68_depack_stream_t * S;
+  all_regs_t * R;
+  int csize = 0, dsize, size;
+
+  if (!src || srclen < 12)
+    return 0;
+  dsize = unice68_depacked_size(src, &csize);
+  if (dsize <= 0 || csize > srclen)
+    return 0;
+
+  size = dsize < DSTREAM_SIZE ? dsize : DSTREAM_SIZE;
+  S = calloc(1, sizeof(*S) + size);
+  if (!S)
+    return 0;
+  S->dsize = dsize;
+  S->size = size;
+  S->chunk = DSTREAM_CHUNK;
+  S->base = dsize;
+
+  R = &S->regs;
+  R->srcbuf = (areg_t)src;
+  R->srcend = R->a5 = R->srcbuf + csize;
+  R->d7 = *(--R->a5);
+  R->a6 = R->a3 = S->buf;               /* nothing decoded yet */
+  return S;
+}
+
+/* Move the unreferenced bytes out of the window and decode a round */
+static int dstream_round(unice68_depack_stream_t * S)
+{
+  all_regs_t * const R = &S->regs;
+  const int keep = R->a3 - R->a6 < DSTREAM_KEEP
+    ? (int) (R->a3 - R->a6) : DSTREAM_KEEP;
+  const int from = S->base + (int) (R->a6 - S->buf);
+  areg_t a5 = R->a5;
+  int d7 = R->d7, room;
+
+  S->base = from + keep - S->size;
+  if (S->base < 0)
+    S->base = 0;
+  memmove(S->buf + from - S->base, R->a6, keep);
+
+  R->dstbuf = R->a4 = S->buf;
+  R->dstend = R->a3 = S->buf + from - S->base + keep;
+  R->a6 = R->a3 - keep;
+
+  /* Pause after a chunk; keep room for a whole token below so the
+   * depacker never pauses at the very start of the output */
+  room = from - S->base - S->chunk;
+  if (room < DSTREAM_TOKEN)
+    room = S->base ? DSTREAM_TOKEN : 0;
+  R->stop = room > 0 ? S->buf + room : R->a4;
+
+  if (fast_bytes(R)) {
+    /* Start the round over with the reference decoder */
+    R->a5 = a5;
+    R->d7 = d7;
+    R->a6 = R->a3 - keep;
+    normal_bytes(R);
+  }
+  if (R->overflow)
+    return -1;
+  if (R->a6 == R->a4 && !S->base) {
+    /* End of the output, the picture conversion is not supported
+     * with separate buffers (see ice_decrunch) */
+    if (get_1_bit(R))
+      return -1;
+    S->state = 1;
+  }
+  return 0;
+}
+
+int unice68_depack_stream_read(unice68_depack_stream_t * S,
+                               const void ** data, int * offset)
+{
+  if (!S || S->state)
+    return S && S->state > 0 ? 0 : UNICE68_ERR_DATA;
+
+  if (dstream_round(S)) {
+    S->state = -1;
+    return UNICE68_ERR_DATA;
+  }
+  if (S->state)
+    *data = S->regs.a4;
+  else
+    *data = S->regs.a6 + DSTREAM_KEEP;
+  *offset = S->base + (int) ((const u8 *) *data - S->buf);
+  return (int) (S->regs.a3 - (const u8 *) *data);
+}
+
+int unice68_depack_stream_chunk(unice68_depack_stream_t * S, int size)
+{
+  if (size < 2 * DSTREAM_KEEP)
+    size = 2 * DSTREAM_KEEP;            /* a round must hand out bytes */
+  if (size > DSTREAM_CHUNK)
+    size = DSTREAM_CHUNK;
+  return S->chunk = size;
+}
+
+/* Window bytes of a checkpoint at a given output position */
+static int dstream_window(unice68_depack_stream_t * S, int dstpos)
+{
+  return S->dsize - dstpos < UNICE68_DEPACK_WINDOW
+    ? S->dsize - dstpos : UNICE68_DEPACK_WINDOW;
+}
+
+int unice68_depack_stream_save(unice68_depack_stream_t * S,
+                               unice68_checkpoint_t * cp, void * window)
+{
+  all_regs_t * const R = &S->regs;
+  int len;
+
+  if (S->state)
+    return -1;
+  cp->srcpos = (int) (R->a5 - R->srcbuf);
+  cp->dstpos = S->base + (int) (R->a6 - S->buf);
+  cp->bits   = R->d7 & 255;
+  len = dstream_window(S, cp->dstpos);
+  memcpy(window, R->a6, len);
+  return len;
+}
+
+int unice68_depack_stream_restore(unice68_depack_stream_t * S,
+                                  const unice68_checkpoint_t * cp,
+                                  const void * window, int len)
+{
+  all_regs_t * const R = &S->regs;
+
+  if (cp->srcpos < 12 || cp->srcpos >= R->srcend - R->srcbuf ||
+      cp->dstpos <= 0 || cp->dstpos > S->dsize || !(cp->bits & 255) ||
+      len != dstream_window(S, cp->dstpos))
+    return -1;
+  memcpy(S->buf, window, len);
+  R->a5 = R->srcbuf + cp->srcpos;
+  R->d7 = cp->bits & 255;
+  R->a6 = S->buf;
+  R->a3 = S->buf + len;
+  R->overflow = 0;
+  S->base = cp->dstpos;
+  S->state = 0;
+  return 0;
+}
+
+void unice68_depack_stream_free(unice68_depack_stream_t * S)
+{
+  free(S);
+}